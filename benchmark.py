@@ -0,0 +1,272 @@
+from argparse import ArgumentParser
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import List, Dict
+
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+STAGES = ('ns', 'ip', 'asn', 'org')
+# metric -> whether a higher value is better
+TRACKED_METRICS = {'lookups_per_second': True, 'p99_ms': False, 'p999_ms': False, 'peak_rss_mb': False}
+
+'''
+Benchmarks every stage and the full run.py pipeline against a local SyntheticDNSServer.
+Each scale runs in a scratch copy of the project so the shipped outputs and graphics are never touched,
+and every measurement runs in its own process so its peak RSS can be read back with wait4.
+'''
+
+def run_stage(stage : str, settings):
+    '''
+    Runs a single stage in this process and writes its metrics, invoked by measure() in a child process
+
+    @Keyword arguments:
+    stage(str): One of STAGES
+    settings: Parsed arguments of the child process
+    '''
+    from scripts import (
+        NameserverResolver, IPResolver, ASNResolver, AS_ORG_Resolver, ResolverMetrics, UpstreamPool, CymruWhoisClient
+    )
+    metrics = ResolverMetrics()
+    whois = None
+    if settings.cymru == 'whois':
+        whois_host, _, whois_port = settings.whois_server.rpartition(':')
+        whois = CymruWhoisClient(whois_host, int(whois_port), metrics=metrics)
+    resolver_options = {
+        'engine': settings.engine, 'concurrency': settings.concurrency, 'metrics': metrics,
+        'upstreams': UpstreamPool(['127.0.0.1'], settings.port)
+    }
+    if stage == 'ns':
+        NameserverResolver(settings.records, settings.max_threads, **resolver_options).execute_nameserver_resolution()
+    elif stage == 'ip':
+        IPResolver(settings.max_threads, **resolver_options).execute_ip_resolution()
+    elif stage == 'asn':
+        ASNResolver(settings.max_threads, whois=whois, **resolver_options).execute_asn_resolution()
+    else:
+        AS_ORG_Resolver(settings.max_threads, whois, **resolver_options).execute_as_org_resolution()
+    metrics.write_json(f'outputs/metrics_{stage}.json')
+
+
+def measure(command : List[str], working_directory : str, metrics_file : str) -> Dict:
+    '''
+    Runs a command to completion and summarizes its throughput, tail latency and peak RSS
+
+    @Keyword arguments:
+    command(List[str]): The command to run
+    working_directory(str): Scratch project directory the command runs in
+    metrics_file(str): ResolverMetrics JSON the command writes, relative to working_directory
+    '''
+    start = time.time()
+    process = subprocess.Popen(command, cwd=working_directory, stdout=subprocess.DEVNULL)
+    _, status, usage = os.wait4(process.pid, 0)
+    seconds = time.time() - start
+    if status != 0:
+        raise Exception(f'Benchmark command {" ".join(command)} failed with status {status}.')
+
+    with open(os.path.join(working_directory, metrics_file), 'r') as jsonfile:
+        metrics = json.load(jsonfile)
+    record_types = metrics['record_types'].values()
+    lookups = sum(record_type['lookups'] for record_type in record_types)
+    failed = sum(count for record_type in record_types for outcome, count in record_type['outcomes'].items()
+                 if outcome not in ('NOERROR', 'CACHED'))
+    return {
+        'seconds': seconds,
+        'lookups': lookups,
+        'failed': failed,
+        'lookups_per_second': lookups / seconds,
+        'p50_ms': max((record_type['latency_ms']['p50'] for record_type in record_types), default=0),
+        'p99_ms': max((record_type['latency_ms']['p99'] for record_type in record_types), default=0),
+        'p999_ms': max((record_type['latency_ms']['p999'] for record_type in record_types), default=0),
+        # ru_maxrss is in kilobytes on Linux
+        'peak_rss_mb': usage.ru_maxrss / 1024
+    }
+
+
+def prepare_working_directory(records : int) -> str:
+    '''
+    Creates a scratch copy of the project with a Tranco list of the requested size,
+    the shipped domains first followed by synthetic ones
+
+    @Keyword arguments:
+    records(int): Number of Tranco records to generate
+    '''
+    from scripts import SyntheticZone
+    working_directory = tempfile.mkdtemp(prefix='dns-benchmark-')
+    shutil.copy(os.path.join(PROJECT_ROOT, 'run.py'), working_directory)
+    shutil.copytree(os.path.join(PROJECT_ROOT, 'scripts'), os.path.join(working_directory, 'scripts'),
+                    ignore=shutil.ignore_patterns('__pycache__'))
+    os.makedirs(os.path.join(working_directory, 'graphics'))
+    os.makedirs(os.path.join(working_directory, 'outputs'))
+
+    domains = SyntheticZone(os.path.join(PROJECT_ROOT, 'outputs')).domains()[:records]
+    with open(os.path.join(working_directory, 'outputs', 'top-1m.csv'), 'w') as csvfile:
+        for rank in range(1, records + 1):
+            domain = domains[rank - 1] if rank <= len(domains) else f'bench{rank}.example'
+            csvfile.write(f'{rank},{domain}\n')
+    return working_directory
+
+
+def free_port(kind : int = socket.SOCK_DGRAM) -> int:
+    '''
+    Returns a port that is currently free on localhost
+
+    @Keyword arguments:
+    kind(int): socket.SOCK_DGRAM for a UDP port, socket.SOCK_STREAM for a TCP port
+    '''
+    with socket.socket(socket.AF_INET, kind) as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+def run_benchmarks(settings) -> Dict[str, Dict[str, Dict]]:
+    '''
+    Runs every stage and the full pipeline at every scale, returning measurements by scale and step
+
+    @Keyword arguments:
+    settings: Parsed arguments of benchmark.py
+    '''
+    from scripts import SyntheticDNSServer
+    port = free_port()
+    whois_port = free_port(socket.SOCK_STREAM)
+    server = SyntheticDNSServer(
+        port=port, latency=settings.latency, jitter=settings.jitter, loss=settings.loss,
+        servfail_rate=settings.servfail_rate, nxdomain_rate=settings.nxdomain_rate,
+        processes=settings.server_processes, dataset_directory=os.path.join(PROJECT_ROOT, 'outputs'),
+        whois_port=whois_port
+    )
+    engine_arguments = ['-r', None, '-t', str(settings.max_threads), '-e', settings.engine,
+                        '-c', str(settings.concurrency), '--port', str(port),
+                        '--cymru', settings.cymru, '--whois-server', f'127.0.0.1:{whois_port}']
+    results : Dict[str, Dict[str, Dict]] = {}
+    with server:
+        for records in settings.scales:
+            engine_arguments[1] = str(records)
+            working_directory = prepare_working_directory(records)
+            scale = results[str(records)] = {}
+            try:
+                for stage in STAGES:
+                    scale[stage] = measure(
+                        [sys.executable, os.path.join(PROJECT_ROOT, 'benchmark.py'), '--stage', stage] + engine_arguments,
+                        working_directory, f'outputs/metrics_{stage}.json'
+                    )
+                    print(f'{records} records, stage {stage}: {format_measurement(scale[stage])}')
+                pipeline_arguments = ['-s'] if settings.stream else []
+                scale['pipeline'] = measure(
+                    [sys.executable, 'run.py'] + engine_arguments + pipeline_arguments,
+                    working_directory, 'outputs/metrics.json'
+                )
+                print(f'{records} records, full pipeline: {format_measurement(scale["pipeline"])}')
+            finally:
+                shutil.rmtree(working_directory)
+    return results
+
+
+def format_measurement(measurement : Dict) -> str:
+    '''
+    Formats one measurement on a single line
+
+    @Keyword arguments:
+    measurement(Dict): Measurement returned by measure()
+    '''
+    return (f'{measurement["lookups"]} lookups ({measurement["failed"]} failed) in {measurement["seconds"]:.2f} seconds, '
+            f'{measurement["lookups_per_second"]:.0f} lookups/sec, p50 {measurement["p50_ms"]:.2f} ms, '
+            f'p99 {measurement["p99_ms"]:.2f} ms, p999 {measurement["p999_ms"]:.2f} ms, '
+            f'peak RSS {measurement["peak_rss_mb"]:.0f} MB')
+
+
+def find_regressions(results : Dict, baseline : Dict, tolerance : float) -> List[str]:
+    '''
+    Compares measurements to the stored baseline, returning a description of every regression
+
+    @Keyword arguments:
+    results(Dict): Measurements by scale and step
+    baseline(Dict): Baseline measurements by scale and step
+    tolerance(float): Fraction a metric may get worse by before it is flagged
+    '''
+    regressions : List[str] = []
+    for scale, steps in results.items():
+        for step, measurement in steps.items():
+            expected = baseline.get(scale, {}).get(step, None)
+            if expected is None:
+                continue
+            for metric, higher_is_better in TRACKED_METRICS.items():
+                if not expected[metric]:
+                    continue
+                change = measurement[metric] / expected[metric] - 1
+                if (-change if higher_is_better else change) > tolerance:
+                    regressions.append(
+                        f'{scale} records, {step}: {metric} {measurement[metric]:.2f} vs baseline {expected[metric]:.2f} ({change:+.0%})'
+                    )
+    return regressions
+
+
+def main():
+    arg_parser = ArgumentParser(description='Benchmark each stage and the full pipeline against a synthetic DNS server')
+    arg_parser.add_argument('--scales', dest='scales', nargs='+', type=int, default=[10000, 100000, 1000000],
+            help='''Numbers of Tranco records to benchmark''')
+    arg_parser.add_argument('-t', '--threads', dest='max_threads', type=int, default=25,
+            help='''Maximum number of threads to spawn for DNS Resolutions''')
+    arg_parser.add_argument('-e', '--engine', dest='engine', choices=('thread', 'async'), default='thread',
+            help='''Resolution engine: thread pool or asyncio event loop''')
+    arg_parser.add_argument('-c', '--concurrency', dest='concurrency', type=int, default=1000,
+            help='''Maximum number of in-flight queries for the async engine''')
+    arg_parser.add_argument('-s', '--stream', dest='stream', action='store_true',
+            help='''Benchmark the full pipeline as one streaming pipeline''')
+    arg_parser.add_argument('--cymru', dest='cymru', choices=('dns', 'whois'), default='dns',
+            help='''Team Cymru interface for steps 3 and 3.5: one TXT query per key, or bulk whois sessions''')
+    arg_parser.add_argument('--latency', dest='latency', type=float, default=0.005,
+            help='''Seconds the synthetic server delays every response by''')
+    arg_parser.add_argument('--jitter', dest='jitter', type=float, default=0.01,
+            help='''Maximum extra seconds of random delay per response''')
+    arg_parser.add_argument('--loss', dest='loss', type=float, default=0,
+            help='''Fraction of queries the synthetic server drops''')
+    arg_parser.add_argument('--servfail', dest='servfail_rate', type=float, default=0,
+            help='''Fraction of queries answered with SERVFAIL''')
+    arg_parser.add_argument('--nxdomain', dest='nxdomain_rate', type=float, default=0.01,
+            help='''Fraction of NS queries answered with NXDOMAIN''')
+    arg_parser.add_argument('--server-processes', dest='server_processes', type=int, default=2,
+            help='''Number of synthetic server processes''')
+    arg_parser.add_argument('--baseline', dest='baseline_path', default='outputs/benchmark_baseline.json',
+            help='''Stored baseline measurements to flag regressions against''')
+    arg_parser.add_argument('--update-baseline', dest='update_baseline', action='store_true',
+            help='''Store these measurements as the new baseline''')
+    arg_parser.add_argument('--tolerance', dest='tolerance', type=float, default=0.2,
+            help='''Fraction a metric may get worse by before it is flagged as a regression''')
+    # Internal: run a single stage in a child process
+    arg_parser.add_argument('--stage', dest='stage', choices=STAGES, default=None)
+    arg_parser.add_argument('-r', '--records', dest='records', type=int, default=10000)
+    arg_parser.add_argument('--port', dest='port', type=int, default=8053)
+    arg_parser.add_argument('--whois-server', dest='whois_server', default='127.0.0.1:43')
+    settings = arg_parser.parse_args()
+
+    if settings.stage is not None:
+        run_stage(settings.stage, settings)
+        return
+
+    results = run_benchmarks(settings)
+    with open('outputs/benchmark.json', 'w') as jsonfile:
+        json.dump(results, jsonfile, indent=4)
+
+    baseline = {}
+    if os.path.exists(settings.baseline_path):
+        with open(settings.baseline_path, 'r') as jsonfile:
+            baseline = json.load(jsonfile)
+    regressions = find_regressions(results, baseline, settings.tolerance)
+    for regression in regressions:
+        print(f'REGRESSION: {regression}')
+    if settings.update_baseline:
+        for scale, steps in results.items():
+            baseline.setdefault(scale, {}).update(steps)
+        with open(settings.baseline_path, 'w') as jsonfile:
+            json.dump(baseline, jsonfile, indent=4)
+        print(f'Stored baseline in {settings.baseline_path}')
+    elif regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
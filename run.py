@@ -1,74 +1,371 @@
-from argparse import ArgumentParser
-from scripts import (
-    NameserverResolver, 
-    IPResolver, 
-    ASNResolver, 
-    AS_ORG_Resolver, 
-    ResultProcessor,
-    ResultPresenter
-)
+from argparse import ArgumentParser, SUPPRESS
 import os
+import sys
 import time
 
+# Choices of -e, --routing and -f, as validated by DNSResolver and UpstreamPool. Kept here so
+# building the parser does not import the resolvers.
+ENGINES = ('thread', 'async')
+ROUTINGS = ('least-outstanding', 'consistent-hash')
+OUTPUT_FORMATS = ('json', 'columnar', 'both')
+# Journals written by each resolver subcommand, the only ones it starts over without --resume
+COMMAND_JOURNALS = {
+    'ns': ['domains_nameservers', 'nameserver_glue'],
+    'ip': ['nameserver_ips'],
+    'asn': ['ip_to_asn_mapping'],
+    'org': ['asn_to_org_mapping']
+}
+# Subcommands running one step of the experiment, each importing only the modules of that step
+STAGE_COMMANDS = ('ns', 'ip', 'asn', 'org')
+COMMANDS = {
+    'ns': 'Step 1: resolve the nameservers of the Tranco domains',
+    'ip': 'Step 2: resolve the IPs of the nameservers found by Step 1',
+    'asn': 'Step 3: resolve the ASNs of the IPs found by Step 2',
+    'org': 'Step 4: resolve the AS organizations of the ASNs found by Step 3',
+    'process': 'Process the outputs of Steps 1-4 into /outputs/results.json',
+    'present': 'Create the graphics from /outputs/results.json'
+}
+
 def main():
+    def cache_report(counters):
+        if resolver_options['cache'] is None:
+            return ''
+        hits, misses = counters
+        errors = resolver_options['cache'].get_error_counter()
+        return f' Cache Hits: {hits}, Cache Misses: {misses}' + (f', Cache Errors: {errors}' if errors else '')
+
     def gather_nameservers():
+        from scripts import NameserverResolver
         start = time.time()
         print('Begin Step 1: Executing Nameserver Resolution')
-        nameserver_resolver = NameserverResolver(settings.records, settings.max_threads)
+        nameserver_resolver = NameserverResolver(settings.records, settings.max_threads, tranco, **resolver_options)
         failed_resolutions = nameserver_resolver.execute_nameserver_resolution()
-        print(f'Completed Step 1 - Total Time: {time.time()-start} seconds. Failed NS Resolutions: {failed_resolutions}')
+        print(f'Completed Step 1 - Total Time: {time.time()-start} seconds. Failed NS Resolutions: {failed_resolutions}{cache_report(nameserver_resolver.get_cache_counters())}')
 
     def gather_ips():
+        from scripts import IPResolver
         start = time.time()
         print('Begin Step 2: Executing IP Resolution for Nameservers')
-        ip_resolver = IPResolver(settings.max_threads)
+        ip_resolver = IPResolver(settings.max_threads, **resolver_options)
         failed_resolutions = ip_resolver.execute_ip_resolution()
-        print(f'Completed Step 2: - Total Time: {time.time()-start} seconds. Failed A Resolutions: {failed_resolutions}')
+        print(f'Completed Step 2: - Total Time: {time.time()-start} seconds. Failed A/AAAA Resolutions: {failed_resolutions}, Nameservers with Glue: {ip_resolver.get_glue_counter()}, Nameservers missing A or AAAA after retries: {ip_resolver.get_partial_counter()}{cache_report(ip_resolver.get_cache_counters())}')
 
     def gather_asns():
+        from scripts import ASNResolver
         start = time.time()
         print('Begin Step 3: Executing ASN Resolution for IPs')
-        asn_resolver = ASNResolver(settings.max_threads)
+        asn_resolver = ASNResolver(settings.max_threads, prefix_table, settings.offline, whois, **resolver_options)
         failed_resolutions = asn_resolver.execute_asn_resolution()
-        print(f'Completed Step 3 - Total Time: {time.time()-start} seconds. Failed TXT Resolutions: {failed_resolutions}')
+        print(f'Completed Step 3 - Total Time: {time.time()-start} seconds. Failed TXT Resolutions: {failed_resolutions}{cache_report(asn_resolver.get_cache_counters())}')
 
     def gather_as_orgs():
+        from scripts import AS_ORG_Resolver
         start = time.time()
         print('Begin Step 4: Executing AS Org Resolution for ASNs')
-        as_org_resolver = AS_ORG_Resolver(settings.max_threads)
+        as_org_resolver = AS_ORG_Resolver(settings.max_threads, whois, **resolver_options)
         failed_resolutions = as_org_resolver.execute_as_org_resolution()
-        print(f'Completed Step 4 - Total Time: {time.time()-start} seconds. Failed TXT Resolutions: {failed_resolutions}')
+        print(f'Completed Step 4 - Total Time: {time.time()-start} seconds. Failed TXT Resolutions: {failed_resolutions}{cache_report(as_org_resolver.get_cache_counters())}')
+
+    def gather_streaming():
+        from scripts import StreamingPipeline
+        start = time.time()
+        print('Begin Steps 1-4: Executing Streaming Resolution')
+        pipeline = StreamingPipeline(settings.records, settings.max_threads, settings.queue_size,
+                                     prefix_table, settings.offline, whois, tranco, **resolver_options)
+        failed_resolutions = pipeline.execute_streaming_resolution()
+        failed_summary = ', '.join(f'Failed {stage} Resolutions: {count}' for stage, count in failed_resolutions.items())
+        if resolver_options['cache'] is not None:
+            for stage, counters in pipeline.get_cache_counters().items():
+                failed_summary += f'. {stage}{cache_report(counters)}'
+        print(f'Completed Steps 1-4 - Total Time: {time.time()-start} seconds. {failed_summary}')
+
+    def gather_incremental():
+        start = time.time()
+        print(f'Begin Steps 1-4: Executing Incremental Resolution against {settings.previous_directory}')
+        failed_resolutions = incremental_resolver.execute_incremental_resolution()
+        failed_summary = ', '.join(f'Failed {stem} Resolutions: {count}' for stem, count in failed_resolutions.items())
+        print(f'Completed Steps 1-4 - Total Time: {time.time()-start} seconds. {failed_summary}')
+
+    def gather_shards():
+        start = time.time()
+        print(f'Begin Steps 1-4: Executing Resolution in {settings.shards} Shards')
+        sharded_run.run_workers([sys.executable, os.path.abspath(__file__)] + sys.argv[1:])
+        print(f'Completed Steps 1-4 - Total Time: {time.time()-start} seconds.')
+
+    def merge_shards():
+        start = time.time()
+        print(f'Merging {settings.shards} Shards')
+        failed_resolutions = sharded_run.merge(settings.output_format)
+        failed_summary = ', '.join(f'Failed {stem} Resolutions: {count}' for stem, count in failed_resolutions.items())
+        print(f'Completed Merge - Total Time: {time.time()-start} seconds. {failed_summary}')
+
+    def run_stage(stems, gather):
+        if all(journal.is_complete(stem) for stem in stems):
+            print(f'Skipping {", ".join(stems)}: already completed by the resumed run')
+        else:
+            gather()
 
     def process_results():
+        from scripts import ResultProcessor
         print('Data Collection Complete. Processing Data and creating graphics.')
-        result_processor = ResultProcessor()
+        result_processor = ResultProcessor(
+            settings.output_format, tranco, settings.cutoffs, settings.resamples, settings.public_suffix_list
+        )
         result_processor.execute_process_all_results()
 
     def present_results():
+        from scripts import ResultPresenter
         result_presenter = ResultPresenter()
-        result_presenter.create_bar_chart()
-        result_presenter.create_table()
-        result_presenter.create_inbailwick_table()
+        if not result_presenter.create_all():
+            print('Skipping graphics: results are unchanged since they were last created')
 
     start_overall = time.time()
     arg_parser = ArgumentParser(description='Messenger', add_help=False)
-
-    arg_parser.add_argument('-r', '--records', dest='records', 
-            action='store', type=int, default=10000,
-            help='''Number of Tranco Records to use''')
-    arg_parser.add_argument('-t', '--threads', dest='max_threads',
-            action='store', type=int, default=25, 
-            help='''Maximum number of threads to spawn for DNS Resolutions''')
+    add_options(arg_parser)
+    subparsers = arg_parser.add_subparsers(dest='command', metavar='{' + ','.join(COMMANDS) + '}',
+            help='''Only run one step of the experiment; every step runs when no subcommand is given''')
+    for command, description in COMMANDS.items():
+        subparser = subparsers.add_parser(command, help=description, description=description)
+        add_options(subparser)
+        # Options given before the subcommand are kept unless repeated after it
+        for action in subparser._actions:
+            action.default = SUPPRESS
     settings = arg_parser.parse_args()
+    if settings.last_rank is None:
+        settings.last_rank = settings.first_rank + settings.records - 1
+    if settings.command == 'present':
+        present_results()
+        return
+    from scripts import TrancoList
+    tranco = TrancoList(settings.tranco_file, settings.first_rank, settings.last_rank)
+    if settings.command == 'process':
+        process_results()
+        return
+    if settings.command is not None and (settings.shards > 1 or settings.shard is not None or settings.stream or settings.previous_directory is not None):
+        raise Exception(f'The {settings.command} subcommand cannot be combined with --shards, --stream or --previous.')
+    if settings.shards > 1 and settings.previous_directory is not None:
+        raise Exception('Incremental resolution with --previous cannot be sharded.')
+    if settings.merge and settings.shards < 2:
+        raise Exception('--merge needs the number of --shards to merge.')
+    sharded_run = None
+    if settings.shards > 1 or settings.shard is not None:
+        from scripts import ShardedRun
+        sharded_run = ShardedRun(settings.shards, tranco, settings.shard_directory)
+    if sharded_run is not None and settings.shard is None:
+        if not settings.merge:
+            gather_shards()
+        merge_shards()
+        summary = sharded_run.merge_metrics()
+        if settings.prometheus_path is not None:
+            from scripts import ResolverMetrics
+            ResolverMetrics().write_prometheus(settings.prometheus_path, summary)
+        process_results()
+        present_results()
+        print(f'Total time to run entire research: {time.time()-start_overall} seconds')
+        return
+    if sharded_run is not None:
+        # The shard runs the regular pipeline inside its own project directory
+        if settings.cache_path is not None:
+            settings.cache_path = os.path.abspath(settings.cache_path)
+        if settings.prefix_table_path is not None:
+            settings.prefix_table_path = os.path.abspath(settings.prefix_table_path)
+        os.chdir(sharded_run.prepare_shard(settings.shard))
+        tranco = TrancoList('outputs/top-1m.csv', settings.first_rank, settings.last_rank)
+    from scripts import (
+        RunJournal, ResolverMetrics, UpstreamPool, ConcurrencyController, RetryPolicy, ResolutionCache
+    )
+    journal = RunJournal(
+        tranco.path, settings.last_rank - settings.first_rank + 1, settings.resume, settings.first_rank,
+        stages=COMMAND_JOURNALS.get(settings.command, None)
+    )
+    prefix_table = None
+    if settings.prefix_table_path is not None and settings.command in (None, 'asn'):
+        from scripts import PrefixTable
+        prefix_table = PrefixTable(settings.prefix_table_path)
+    cache = None
+    if settings.cache_path is not None:
+        cache = ResolutionCache(settings.cache_path, settings.cache_max_age, settings.cache_max_size * 1024 * 1024)
+    metrics = ResolverMetrics()
+    upstreams = UpstreamPool(settings.nameservers, settings.port, settings.routing)
+    metrics.add_section('resolvers', upstreams.stats)
+    controller = None
+    if settings.adaptive:
+        controller = ConcurrencyController(settings.max_threads, maximum=settings.concurrency)
+        metrics.add_section('upstreams', controller.stats)
+    whois = None
+    if settings.cymru == 'whois' and settings.command in (None, 'asn', 'org'):
+        from scripts import CymruWhoisClient
+        whois_host, _, whois_port = settings.whois_server.rpartition(':')
+        whois = CymruWhoisClient(whois_host, int(whois_port), settings.whois_batch, metrics=metrics)
+    retry_policy = None
+    if settings.retries > 0:
+        retry_policy = RetryPolicy(settings.retries + 1, deadline=settings.retry_deadline)
+    resolver_options = {
+        'engine': settings.engine,
+        'concurrency': settings.concurrency,
+        'rate_limit': settings.rate_limit,
+        'cache': cache,
+        'output_format': settings.output_format,
+        'journal': journal,
+        'metrics': metrics,
+        'upstreams': upstreams,
+        'controller': controller,
+        'retry_policy': retry_policy
+    }
 
-    gather_nameservers()
-    gather_ips()
-    gather_asns()
-    gather_as_orgs()
+    stems = ['domains_nameservers', 'nameserver_ips', 'ip_to_asn_mapping', 'asn_to_org_mapping']
+    stages = {
+        'ns': (['domains_nameservers'], gather_nameservers),
+        'ip': (['nameserver_ips'], gather_ips),
+        'asn': (['ip_to_asn_mapping'], gather_asns),
+        'org': (['asn_to_org_mapping'], gather_as_orgs)
+    }
+    if settings.command is not None:
+        run_stage(*stages[settings.command])
+    elif settings.previous_directory is not None:
+        from scripts import IncrementalResolver
+        incremental_resolver = IncrementalResolver(
+            settings.previous_directory, settings.records, settings.max_threads, prefix_table, settings.offline, whois, tranco, **resolver_options
+        )
+        run_stage(stems, gather_incremental)
+    elif settings.stream:
+        run_stage(stems, gather_streaming)
+    else:
+        for stems, gather in stages.values():
+            run_stage(stems, gather)
+    journal.close()
+    metrics.write_json('outputs/metrics.json')
+    if settings.shard is not None or settings.command is not None:
+        # Processing happens once every shard is merged, or is run by the process subcommand
+        if settings.prometheus_path is not None and settings.command is not None:
+            metrics.write_prometheus(settings.prometheus_path)
+        if cache is not None:
+            cache.close()
+        return
+    if settings.prometheus_path is not None:
+        metrics.write_prometheus(settings.prometheus_path)
+    if cache is not None:
+        cache.close()
     process_results()
+    if settings.previous_directory is not None:
+        incremental_resolver.write_delta_report()
     present_results()
     print(f'Total time to run entire research: {time.time()-start_overall} seconds')
 
 
+def add_options(parser : ArgumentParser):
+    '''
+    Adds the options of a run to the main parser or to a subcommand
+
+    @Keyword arguments:
+    parser(ArgumentParser): The parser to add them to
+    '''
+    parser.add_argument('-r', '--records', dest='records', 
+            action='store', type=int, default=10000,
+            help='''Number of Tranco Records to use''')
+    parser.add_argument('--from', dest='first_rank',
+            action='store', type=int, default=1,
+            help='''Rank of the first Tranco record to resolve''')
+    parser.add_argument('--to', dest='last_rank',
+            action='store', type=int, default=None,
+            help='''Rank of the last Tranco record to resolve, --from plus --records minus one by default''')
+    parser.add_argument('--tranco', dest='tranco_file',
+            action='store', type=str, default='outputs/top-1m.csv',
+            help='''The Tranco list, as the rank,domain CSV or the .zip download''')
+    parser.add_argument('-t', '--threads', dest='max_threads',
+            action='store', type=int, default=25, 
+            help='''Maximum number of threads to spawn for DNS Resolutions''')
+    parser.add_argument('-e', '--engine', dest='engine',
+            action='store', choices=ENGINES, default='thread',
+            help='''Resolution engine: thread pool or asyncio event loop''')
+    parser.add_argument('-c', '--concurrency', dest='concurrency',
+            action='store', type=int, default=1000,
+            help='''Maximum number of in-flight queries for the async engine''')
+    parser.add_argument('--rate', dest='rate_limit',
+            action='store', type=float, default=0,
+            help='''Maximum queries per second for the async engine (0 for no cap)''')
+    parser.add_argument('--nameserver', dest='nameservers',
+            action='store', type=str, nargs='+', default=['127.0.0.1'],
+            help='''Addresses of the recursive resolvers queries are spread across, as address or address:port''')
+    parser.add_argument('--port', dest='port',
+            action='store', type=int, default=8053,
+            help='''Port of recursive resolvers given without one''')
+    parser.add_argument('--routing', dest='routing',
+            action='store', choices=ROUTINGS, default='least-outstanding',
+            help='''How queries are spread across the recursive resolvers''')
+    parser.add_argument('--adaptive', dest='adaptive',
+            action='store_true',
+            help='''Adapt the in-flight queries of each upstream with AIMD, from -t up to -c''')
+    parser.add_argument('--retries', dest='retries',
+            action='store', type=int, default=0,
+            help='''Number of times a query that timed out or got SERVFAIL/REFUSED is retried (default 0, every query is sent once)''')
+    parser.add_argument('--retry-deadline', dest='retry_deadline',
+            action='store', type=float, default=30,
+            help='''Seconds after its first failure that a query is given up on''')
+    parser.add_argument('-s', '--stream', dest='stream',
+            action='store_true',
+            help='''Run steps 1-4 as one streaming pipeline instead of one after another''')
+    parser.add_argument('--queue-size', dest='queue_size',
+            action='store', type=int, default=10000,
+            help='''Maximum number of pending items between two streaming stages''')
+    parser.add_argument('--cache', dest='cache_path',
+            action='store', type=str, default=None,
+            help='''Path of a persistent SQLite cache of DNS answers shared across runs''')
+    parser.add_argument('--cache-max-age', dest='cache_max_age',
+            action='store', type=float, default=30 * 24 * 3600,
+            help='''Maximum number of seconds a cached answer is served, even if its TTL is longer''')
+    parser.add_argument('--cache-max-size', dest='cache_max_size',
+            action='store', type=int, default=512,
+            help='''Maximum size of the cache in MB before least recently used answers are evicted''')
+    parser.add_argument('--prefix-table', dest='prefix_table_path',
+            action='store', type=str, default=None,
+            help='''Routeviews pfx2as or pyasn file used to map IPs to ASNs before querying Team Cymru''')
+    parser.add_argument('--offline', dest='offline',
+            action='store_true',
+            help='''Only use the prefix table for IP to ASN, never querying Team Cymru''')
+    parser.add_argument('--cymru', dest='cymru',
+            action='store', choices=('dns', 'whois'), default='dns',
+            help='''Team Cymru interface for IP to ASN and ASN to Org: one TXT query per key, or bulk whois sessions''')
+    parser.add_argument('--whois-server', dest='whois_server',
+            action='store', type=str, default='whois.cymru.com:43',
+            help='''Team Cymru bulk whois server, as host:port''')
+    parser.add_argument('--whois-batch', dest='whois_batch',
+            action='store', type=int, default=10000,
+            help='''Maximum number of IPs or ASNs per bulk whois session''')
+    parser.add_argument('-f', '--format', dest='output_format',
+            action='store', choices=OUTPUT_FORMATS, default='json',
+            help='''Layout of the stage outputs: pretty-printed JSON, memory-mapped columnar files, or both''')
+    parser.add_argument('--cutoffs', dest='cutoffs',
+            action='store', type=lambda cutoffs: [int(cutoff) for cutoff in cutoffs.split(',')], default=[1000, 10000, 100000, 1000000],
+            help='''Comma-separated Tranco ranks the rank statistics are summarized up to''')
+    parser.add_argument('--bootstrap', dest='resamples',
+            action='store', type=int, default=1000,
+            help='''Number of bootstrap resamples behind the confidence intervals of the rank statistics, 0 to skip them''')
+    parser.add_argument('--psl', dest='public_suffix_list',
+            action='store', type=str, default=None,
+            help='''public_suffix_list.dat used to find registrable domains, /outputs/public_suffix_list.dat or the system copy by default''')
+    parser.add_argument('--previous', dest='previous_directory',
+            action='store', type=str, default=None,
+            help='''Outputs directory of a previous run; only re-resolve what changed in the new Tranco snapshot''')
+    parser.add_argument('--prometheus', dest='prometheus_path',
+            action='store', type=str, default=None,
+            help='''Also write the resolver metrics in the Prometheus text format to this file''')
+    parser.add_argument('--resume', dest='resume',
+            action='store_true',
+            help='''Resume an interrupted run from outputs/journal, skipping keys it already resolved''')
+    parser.add_argument('--shards', dest='shards',
+            action='store', type=int, default=1,
+            help='''Partition the Tranco list by domain hash into this many shards, each resolved by its own process''')
+    parser.add_argument('--shard', dest='shard',
+            action='store', type=int, default=None,
+            help='''Only resolve this shard of --shards, e.g. one per machine sharing --shard-directory''')
+    parser.add_argument('--merge', dest='merge',
+            action='store_true',
+            help='''Only merge the shards of --shards resolved by separate --shard runs, then process the results''')
+    parser.add_argument('--shard-directory', dest='shard_directory',
+            action='store', type=str, default='outputs/shards',
+            help='''Directory holding the outputs of every shard''')
+
+
 if __name__ == '__main__':
     main()
\ No newline at end of file
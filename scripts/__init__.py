@@ -1,9 +1,60 @@
-from .dns_resolver import (
-    DNSResolver, ThreadPoolExecutor, json
-)
-from .nameserver_resolver import NameserverResolver
-from .ip_resolver import IPResolver
-from .asn_resolver import ASNResolver
-from .as_org_resolver import AS_ORG_Resolver
-from .process_results import ResultProcessor
-from .present_results import ResultPresenter
\ No newline at end of file
+'''
+Every subsystem is imported on first use instead of with the package, so a run only pays for the
+modules it touches: resolving nameservers never imports NumPy or matplotlib, and presenting the
+results never imports dnspython. Names resolve through the module attribute hook of PEP 562.
+'''
+_EXPORTS = {
+    'ResolutionCache': 'resolution_cache',
+    'RunJournal': 'run_journal',
+    'ResolverMetrics': 'resolver_metrics',
+    'ConcurrencyController': 'concurrency_controller',
+    'RetryPolicy': 'retry_policy',
+    'RetryScheduler': 'retry_policy',
+    'TRANSIENT_OUTCOMES': 'retry_policy',
+    'UpstreamPool': 'upstream_pool',
+    'CymruWhoisClient': 'cymru_whois',
+    'TrancoList': 'tranco_list',
+    'DNSResolver': 'dns_resolver',
+    'RateLimiter': 'dns_resolver',
+    'ThreadPoolExecutor': 'dns_resolver',
+    'json': 'dns_resolver',
+    'PrefixTable': 'prefix_table',
+    'NameserverResolver': 'nameserver_resolver',
+    'IPResolver': 'ip_resolver',
+    'ASNResolver': 'asn_resolver',
+    'AS_ORG_Resolver': 'as_org_resolver',
+    'StreamingPipeline': 'pipeline',
+    'IncrementalResolver': 'incremental_resolver',
+    'DependencyGraph': 'dependency_graph',
+    'ShardedRun': 'sharded_run',
+    'SyntheticDNSServer': 'synthetic_dns_server',
+    'SyntheticZone': 'synthetic_dns_server',
+    'RankStatistics': 'rank_statistics',
+    'BailiwickClassifier': 'bailiwick',
+    'PublicSuffixList': 'bailiwick',
+    'normalize_name': 'bailiwick',
+    'ResultProcessor': 'process_results',
+    'ResultPresenter': 'present_results'
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name : str):
+    '''
+    Imports the submodule defining an exported name on first access, then caches the name on the package
+
+    @Keyword arguments:
+    name(str): The exported name
+    '''
+    module = _EXPORTS.get(name, None)
+    if module is None:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    # __import__ rather than importlib.import_module, so -X importtime reports the submodule
+    value = getattr(__import__(f'{__name__}.{module}', fromlist=[name]), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
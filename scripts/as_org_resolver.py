@@ -1,13 +1,33 @@
-from scripts import DNSResolver, ThreadPoolExecutor, json
+from typing import List, Dict
+from scripts import DNSResolver, DependencyGraph, CymruWhoisClient
 
 '''
 STEP 3.5 OF RESEARCH
 Convert ASN -> Organization Name
 '''
 class AS_ORG_Resolver(DNSResolver):
-    def __init__(self, max_threads : int = 25):
-        super().__init__(record_type = 'TXT')
-        self._max_threads = max_threads
+    def __init__(self, max_threads : int = 25, whois : CymruWhoisClient = None, **resolver_options):
+        '''
+        @Keyword arguments:
+        max_threads(int): number of worker threads used by the 'thread' engine
+        whois(CymruWhoisClient): look ASNs up in bulk over team-cymru's whois interface instead of one TXT query each
+        '''
+        super().__init__(record_type = 'TXT', max_threads = max_threads, **resolver_options)
+        self._whois = whois
+
+
+    def resolve_journaled(self, stem : str, keys : List[str], queries : List[str]) -> List:
+        '''
+        Resolves the organization of every ASN over DNS, or in bulk over whois if there is a whois client
+
+        @Keyword arguments:
+        stem(str): Name of the stage output the results belong to
+        keys(List[str]): The ASNs being resolved
+        queries(List[str]): The DNS query of each ASN
+        '''
+        if self._whois is None:
+            return super().resolve_journaled(stem, keys, queries)
+        return self.resolve_journaled_bulk(stem, keys, self._whois.lookup_asns)
 
     
     def asn_to_query(self, asn: str):
@@ -31,23 +51,29 @@ class AS_ORG_Resolver(DNSResolver):
         return response.split(' | ')[-1].strip('"')
 
     
-    def execute_as_org_resolution(self):
-        '''Executes ASN Resolution from results of IP Resolution'''
-        # Get IP to List[ASN] mapping.
-        ip_to_asn : Dict[str, List[str]] = self.read_json('outputs/ip_to_asn_mapping.json')
-
-        # Get all unique ASNs from the IP to ASN mapping.
-        all_asns = [asn for asn_list in ip_to_asn.values() for asn in asn_list]
-        unique_asns = set(all_asns)
+    def resolve_asns(self, unique_asns : List[str]) -> Dict[str, str]:
+        '''
+        Resolves the organization of every ASN, returning the organization of every ASN that resolved
 
+        @Keyword arguments:
+        unique_asns(List[str]): The unique ASNs to resolve
+        '''
         # Get mapping of ASN to Organization Name.
         asn_queries = [self.asn_to_query(asn) for asn in unique_asns]
-        with ThreadPoolExecutor(max_workers=self._max_threads) as executor:
-            org_results = list(executor.map(self.resolve, asn_queries))
-        asn_to_org = {asn: self.clean_for_organization(response) for asn, response in zip(unique_asns, org_results)}
+        org_results = self.resolve_journaled('asn_to_org_mapping', unique_asns, asn_queries)
+
+        # Clean results of Organization resolution, dropping the ASNs that failed.
+        cleaned_results = self.drop_failed_resolutions(zip(unique_asns, org_results))
+        return {asn: self.clean_for_organization(response) for asn, response in cleaned_results}
+
+
+    def execute_as_org_resolution(self):
+        '''Executes ASN Resolution from results of IP Resolution'''
+        # Get all unique ASNs from the IP to ASN mapping, in first-seen order.
+        unique_asns : List[str] = DependencyGraph.from_outputs([self.read_stage('ip_to_asn_mapping')], 'ip').names('asn')
+        asn_to_org = self.resolve_asns(unique_asns)
 
         # Store ASN to Organization Name mapping in its own JSON.
-        with open('outputs/asn_to_org_mapping.json', 'w') as jsonfile:
-            json.dump(asn_to_org, jsonfile, indent=4)
+        self.write_stage('asn_to_org_mapping', asn_to_org, scalar = True)
 
         return self._resolution_failed_counter
\ No newline at end of file
@@ -1,25 +1,73 @@
-from scripts import DNSResolver, ThreadPoolExecutor, json
+import ipaddress
+from typing import List, Dict
+from scripts import DNSResolver, DependencyGraph, PrefixTable, CymruWhoisClient
 
 '''
 STEP 3 OF RESEARCH
 Convert IP Address -> Autonomous System Number
 '''
 class ASNResolver(DNSResolver):
-    def __init__(self, max_threads : int = 25):
-        super().__init__(record_type = 'TXT')
-        self._max_threads = max_threads
+    def __init__(self, max_threads : int = 25, prefix_table : PrefixTable = None, offline : bool = False,
+                 whois : CymruWhoisClient = None, **resolver_options):
+        '''
+        @Keyword arguments:
+        max_threads(int): number of worker threads used by the 'thread' engine
+        prefix_table(PrefixTable): offline prefix -> origin table consulted before team-cymru
+        offline(bool): never query team-cymru, IPs missing from the prefix table count as failed
+        whois(CymruWhoisClient): look IPs up in bulk over team-cymru's whois interface instead of one TXT query each
+        '''
+        super().__init__(record_type = 'TXT', max_threads = max_threads, **resolver_options)
+        self._prefix_table = prefix_table
+        self._offline = offline
+        self._whois = whois
+
+
+    def get_whois(self) -> CymruWhoisClient:
+        '''Gets the bulk whois client IPs are looked up with, None if they are queried over DNS'''
+        return self._whois
+
+
+    def resolve_journaled(self, stem : str, keys : List[str], queries : List[str]) -> List:
+        '''
+        Resolves the ASNs of every IP over DNS, or in bulk over whois if there is a whois client
+
+        @Keyword arguments:
+        stem(str): Name of the stage output the results belong to
+        keys(List[str]): The IPs being resolved
+        queries(List[str]): The DNS query of each IP
+        '''
+        if self._whois is None:
+            return super().resolve_journaled(stem, keys, queries)
+        return self.resolve_journaled_bulk(stem, keys, self._whois.lookup_ips)
 
     
     def ip_to_query(self, ip : str):
         '''
-        Turns IP into a valid ASN query for team-cymru
+        Turns IP into a valid ASN query for team-cymru,
+        reversed octets under origin.asn.cymru.com for IPv4 and reversed nibbles under origin6.asn.cymru.com for IPv6
         
         @Keyword arguments: 
         ip(str): the IP address to be converted into ASN query format
         '''
+        address = ipaddress.ip_address(ip)
+        if address.version == 6:
+            return address.reverse_pointer[:-len('.ip6.arpa')] + '.origin6.asn.cymru.com'
         query = '.'.join(reversed(ip.split('.'))) + '.origin.asn.cymru.com'
         return query
 
+
+    def unique_ips(self, nameserver_ips) -> List[str]:
+        '''
+        Flattens the addresses of every nameserver into the unique IPs, keeping first-seen order.
+        Outputs of earlier runs map each nameserver to a single IPv4 address instead of a list.
+
+        @Keyword arguments:
+        nameserver_ips: The addresses of each nameserver, e.g. the nameserver_ips stage output
+        '''
+        return list(dict.fromkeys(
+            ip for ips in nameserver_ips for ip in ([ips] if isinstance(ips, str) else ips)
+        ))
+
     
     def clean_for_asn_number(self, response: str):
         '''
@@ -31,23 +79,54 @@ class ASNResolver(DNSResolver):
         return response.split(' | ')[0].strip('"').split()
 
     
-    def execute_asn_resolution(self):
-        '''Executes ASN Resolution from results of IP Resolution'''
-        ips : List[str] = list(self.read_json(output_file_name = 'outputs/nameserver_ips.json').values())
-        ip_queries = [self.ip_to_query(ip) for ip in ips]
+    def lookup_prefix_table(self, ip : str):
+        '''
+        Looks the IP up in the offline prefix table, returning None if there is no table or no covering prefix
+
+        @Keyword arguments:
+        ip(str): the IP address to look up
+        '''
+        if self._prefix_table is None:
+            return None
+        return self._prefix_table.lookup(ip)
+
+
+    def resolve_ips(self, ips : List[str]) -> Dict[str, List[str]]:
+        '''
+        Resolves the ASNs of every IP, from the prefix table where possible,
+        returning the ASNs of every IP that resolved
+
+        @Keyword arguments:
+        ips(List[str]): The unique IPs to resolve
+        '''
+        # answer what we can from the offline prefix table, only the misses are sent to team-cymru
+        found_asns = {ip: self.lookup_prefix_table(ip) for ip in ips}
+        missed_ips = [ip for ip, asns in found_asns.items() if asns is None]
+        if self._offline:
+            self._count_failures(len(missed_ips))
+            for ip in missed_ips:
+                self._record_stage_failure('ip_to_asn_mapping', ip, 'not in prefix table')
+            missed_ips = []
+        ip_queries = [self.ip_to_query(ip) for ip in missed_ips]
 
-        # create thread pool executor to resolve asn of each ip
-        with ThreadPoolExecutor(max_workers=self._max_threads) as executor:
-            results = list(executor.map(self.resolve, ip_queries))
+        # resolve asn of each ip with the configured engine
+        results = self.resolve_journaled('ip_to_asn_mapping', missed_ips, ip_queries)
 
         # Clean results of ASN resolution from nameservers.
-        cleaned_results = self.drop_failed_resolutions(zip(ips, results))
+        cleaned_results = self.drop_failed_resolutions(zip(missed_ips, results))
+        found_asns.update({ip: self.clean_for_asn_number(response) for ip, response in cleaned_results})
 
         # Create a dictionary from the cleaned results
-        ip_to_asn = {ip: self.clean_for_asn_number(response) for ip, response in cleaned_results}
+        return {ip: asns for ip, asns in found_asns.items() if asns is not None}
+
+
+    def execute_asn_resolution(self):
+        '''Executes ASN Resolution from results of IP Resolution'''
+        # many nameservers share an IP, so only resolve each unique IP once.
+        ips : List[str] = DependencyGraph.from_outputs([self.read_stage('nameserver_ips')], 'nameserver').names('ip')
+        ip_to_asn = self.resolve_ips(ips)
 
         # Store IP to List[ASN] mapping in its own JSON.
-        with open('outputs/ip_to_asn_mapping.json', 'w') as jsonfile:
-            json.dump(ip_to_asn, jsonfile, indent=4)
+        self.write_stage('ip_to_asn_mapping', ip_to_asn, scalar = False)
 
         return self._resolution_failed_counter
\ No newline at end of file
@@ -0,0 +1,227 @@
+import os
+from collections.abc import Mapping
+from itertools import chain, repeat
+from typing import List, Dict, Tuple
+import dns.exception
+import dns.name
+import numpy as np
+
+# Looked for in order, the first one found is used
+PUBLIC_SUFFIX_LISTS = ('outputs/public_suffix_list.dat', '/usr/share/publicsuffix/public_suffix_list.dat')
+# Markers stored next to the labels of a trie node, labels are never empty or start with '!'
+_RULE, _EXCEPTION = '', '!'
+
+def canonical_name(name : str) -> str:
+    '''
+    Returns a name lowercased, without the trailing root dot and with internationalized labels in their IDNA ASCII form
+
+    @Keyword arguments:
+    name(str): A domain or nameserver, with or without the trailing dot
+    '''
+    name = name.lower().rstrip('.')
+    if not name.isascii():
+        try:
+            name = dns.name.from_unicode(name).to_text(omit_final_dot=True)
+        except dns.exception.DNSException:
+            pass
+    return name
+
+
+def normalize_name(name : str) -> Tuple[str, ...]:
+    '''
+    Returns the labels of a canonical name from the TLD down, e.g. ('com', 'example', 'ns1')
+
+    @Keyword arguments:
+    name(str): A domain or nameserver, with or without the trailing dot
+    '''
+    name = canonical_name(name)
+    return tuple(reversed(name.split('.'))) if name else ()
+
+
+'''
+Public Suffix List compiled into a trie of labels from the TLD down, answering the public suffix
+and registrable domain of a name in one walk of its reversed labels. Rules follow the list's own
+algorithm: wildcard rules match any one label, exception rules win and drop their leftmost label,
+and a name matching no rule falls back to the implicit '*' rule, its TLD.
+'''
+class PublicSuffixList:
+    def __init__(self, file_name : str = None):
+        '''
+        @Keyword arguments:
+        file_name(str): The public_suffix_list.dat to compile, the first of PUBLIC_SUFFIX_LISTS found if None.
+        Without any list, every name only matches the implicit '*' rule.
+        '''
+        if file_name is None:
+            file_name = next((path for path in PUBLIC_SUFFIX_LISTS if os.path.exists(path)), None)
+        self._file_name = file_name
+        self._trie : Dict = {}
+        if file_name is not None:
+            with open(file_name, 'r', encoding='utf-8') as rules:
+                for line in rules:
+                    rule = line.strip().split(' ')[0]
+                    if rule and not rule.startswith('//'):
+                        self.__add_rule(rule)
+
+
+    def __add_rule(self, rule : str):
+        '''
+        Private function adding one rule of the list to the trie
+
+        @Keyword arguments:
+        rule(str): The rule, e.g. co.uk, *.ck or !www.ck
+        '''
+        exception = rule.startswith('!')
+        node = self._trie
+        for label in normalize_name(rule.lstrip('!')):
+            node = node.setdefault(label, {})
+        node[_EXCEPTION if exception else _RULE] = True
+
+
+    def suffix_length(self, labels : Tuple[str, ...]) -> int:
+        '''
+        Returns the number of labels of a name's public suffix
+
+        @Keyword arguments:
+        labels(Tuple[str, ...]): The name's labels from the TLD down, as returned by normalize_name
+        '''
+        longest, exception = 1, 0
+        nodes = [(self._trie, 0)]
+        while nodes:
+            node, depth = nodes.pop()
+            if depth == len(labels):
+                continue
+            for label in (labels[depth], '*'):
+                child = node.get(label, None)
+                if child is None:
+                    continue
+                if _EXCEPTION in child:
+                    exception = max(exception, depth)
+                if _RULE in child:
+                    longest = max(longest, depth + 1)
+                nodes.append((child, depth + 1))
+        return exception if exception else longest
+
+
+    def registrable_domain(self, labels : Tuple[str, ...]) -> Tuple[str, ...]:
+        '''
+        Returns the labels of a name's registrable domain, its public suffix plus one label,
+        None if the name is itself a public suffix
+
+        @Keyword arguments:
+        labels(Tuple[str, ...]): The name's labels from the TLD down, as returned by normalize_name
+        '''
+        length = self.suffix_length(labels) + 1
+        return labels[:length] if len(labels) >= length else None
+
+
+'''
+Classifies how in-bailiwick the nameservers of every domain are. A nameserver is in-bailiwick of a
+domain when it is the domain or a subdomain of it, compared label by label, so x.com does not match
+ns.fox.com. Every name is canonicalized once and the domains are interned into a hashed index, every
+distinct nameserver looks its ancestors up in that index once, and each (domain, nameserver) pair is
+then tested with NumPy array operations. Registrable domains are only looked up in the Public Suffix
+List trie for the pairs that can share one.
+
+Every domain with nameservers falls in at most one bucket:
+full: every nameserver is in-bailiwick
+partial: some, but not all, nameservers are in-bailiwick
+same_registrable: no nameserver is in-bailiwick, but one shares the domain's registrable domain,
+e.g. www.example.co.uk served by ns1.example.co.uk
+'''
+class BailiwickClassifier:
+    def __init__(self, public_suffix_list : PublicSuffixList = None):
+        '''
+        @Keyword arguments:
+        public_suffix_list(PublicSuffixList): Compiled list the registrable domains come from, the default list if None
+        '''
+        self._public_suffix_list = public_suffix_list if public_suffix_list is not None else PublicSuffixList()
+
+
+    def __registrable_domain(self, name : str) -> str:
+        '''
+        Private function returning the registrable domain of a canonical name, None for public suffixes
+
+        @Keyword arguments:
+        name(str): The canonical name
+        '''
+        registrable = self._public_suffix_list.registrable_domain(normalize_name(name))
+        return None if registrable is None else '.'.join(reversed(registrable))
+
+
+    def classify(self, domains_to_nameservers : Mapping) -> Dict[str, List[str]]:
+        '''
+        Returns the domains of every bucket, in the order of domains_to_nameservers
+
+        @Keyword arguments:
+        domains_to_nameservers(Mapping): Nameservers of every domain, as written by Step 1
+        '''
+        domains = list(domains_to_nameservers.keys())
+        nameserver_lists = list(domains_to_nameservers.values())
+        nameserver_counts = np.fromiter(map(len, nameserver_lists), dtype=np.int64, count=len(nameserver_lists))
+
+        # every distinct nameserver is canonicalized once, and every pair refers to it by id
+        raw_nameservers = list(dict.fromkeys(chain.from_iterable(nameserver_lists)))
+        raw_ids = dict(zip(raw_nameservers, range(len(raw_nameservers))))
+        pair_nameservers = np.fromiter(
+            map(raw_ids.__getitem__, chain.from_iterable(nameserver_lists)), dtype=np.int64, count=int(nameserver_counts.sum())
+        )
+        nameservers = list(map(canonical_name, raw_nameservers))
+
+        # domains are canonicalized and interned, a domain listed twice keeps one id
+        names = list(map(canonical_name, domains))
+        domain_index = dict(zip(names, range(len(names))))
+        domain_ids = np.fromiter(map(domain_index.__getitem__, names), dtype=np.int64, count=len(names))
+
+        # every ancestor of every nameserver, itself included, is looked up among the domains
+        ancestor_counts : List[int] = []
+        ancestor_ids : List[int] = []
+        for name in nameservers:
+            dot, count = -1, 0
+            while True:
+                ancestor = domain_index.get(name[dot + 1:], None)
+                if ancestor is not None:
+                    ancestor_ids.append(ancestor)
+                    count += 1
+                dot = name.find('.', dot + 1)
+                if dot < 0:
+                    break
+            ancestor_counts.append(count)
+        ancestor_counts = np.asarray(ancestor_counts, dtype=np.int64)
+        ancestor_starts = np.cumsum(ancestor_counts) - ancestor_counts
+        ancestor_ids = np.asarray(ancestor_ids, dtype=np.int64)
+
+        # one row per (domain, nameserver) pair
+        pair_domains = np.repeat(np.arange(len(domains), dtype=np.int64), nameserver_counts)
+
+        # a pair is in-bailiwick when the domain is one of the nameserver's ancestors
+        counts = ancestor_counts[pair_nameservers]
+        pairs = np.repeat(np.arange(len(pair_nameservers), dtype=np.int64), counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        matches = ancestor_ids[np.repeat(ancestor_starts[pair_nameservers], counts) + offsets] == domain_ids[pair_domains[pairs]]
+        in_bailiwick = np.bincount(pairs[matches], minlength=len(pair_nameservers)) > 0
+        in_bailiwick_counts = np.bincount(pair_domains[in_bailiwick], minlength=len(domains))
+
+        # a domain without in-bailiwick nameservers can only share a nameserver's registrable domain by being
+        # a subdomain of it, so it has at least three labels. Only those pairs go through the trie, each name once.
+        domain_dots = np.fromiter(map(str.count, names, repeat('.')), dtype=np.int64, count=len(names))
+        candidates = np.flatnonzero((in_bailiwick_counts[pair_domains] == 0) & (domain_dots[pair_domains] >= 2))
+        nameserver_registrables : Dict[int, str] = {}
+        domain_registrables : Dict[int, str] = {}
+        same_registrable = np.zeros(len(pair_nameservers), dtype=bool)
+        for pair, domain, nameserver in zip(candidates.tolist(), pair_domains[candidates].tolist(), pair_nameservers[candidates].tolist()):
+            if nameserver not in nameserver_registrables:
+                nameserver_registrables[nameserver] = self.__registrable_domain(nameservers[nameserver])
+            registrable = nameserver_registrables[nameserver]
+            if registrable is None or not names[domain].endswith('.' + registrable):
+                continue
+            if domain not in domain_registrables:
+                domain_registrables[domain] = self.__registrable_domain(names[domain])
+            same_registrable[pair] = domain_registrables[domain] == registrable
+        same_registrable_counts = np.bincount(pair_domains[same_registrable], minlength=len(domains))
+
+        buckets = {
+            'full': (nameserver_counts > 0) & (in_bailiwick_counts == nameserver_counts),
+            'partial': (in_bailiwick_counts > 0) & (in_bailiwick_counts < nameserver_counts),
+            'same_registrable': (in_bailiwick_counts == 0) & (same_registrable_counts > 0)
+        }
+        return {bucket: [domains[index] for index in np.flatnonzero(mask).tolist()] for bucket, mask in buckets.items()}
@@ -0,0 +1,349 @@
+import hashlib
+import json
+import os
+from array import array
+from collections.abc import Mapping
+from typing import List, Dict, Iterator
+import numpy as np
+
+'''
+Columnar binary layout for the stage outputs, as an alternative to pretty-printed JSON.
+
+Every string (domain, nameserver, IP, ASN, organization) is interned once into a table shared by all
+stages. Each stage output is stored as int32 key ids plus a CSR pair of int64 value offsets and int32
+value ids. All files are raw little-endian arrays, memory-mapped zero-copy by readers. A stage output is
+written in one pass once the stage completes, in place of its JSON dump; results journaled while the stage
+runs live in outputs/journal. The string table only grows, and a hash index kept next to it lets the
+next writer intern strings without decoding the table.
+
+outputs/columns/strings.bin                 utf-8 bytes of every interned string
+outputs/columns/string_offsets.bin          int64 end offset of each string in strings.bin
+outputs/columns/string_hashes.bin           sorted uint64 hash of every interned string
+outputs/columns/string_index.bin            int32 string id of each hash in string_hashes.bin
+outputs/columns/<stem>.keys.bin             int32 string id of each key
+outputs/columns/<stem>.value_offsets.bin    int64 CSR offsets into values.bin: 0, then the end of each key's values
+outputs/columns/<stem>.values.bin           int32 string id of each value
+outputs/columns/<stem>.meta.json            record counts and whether values are scalars
+'''
+
+COLUMNS_DIRECTORY = 'outputs/columns'
+
+
+def _memmap(file_name : str, dtype) -> np.ndarray:
+    '''
+    Memory-maps a raw array file read-only, returning an empty array for missing or empty files
+
+    @Keyword arguments:
+    file_name(str): Name of the raw array file
+    dtype: NumPy dtype of the array
+    '''
+    if not os.path.exists(file_name) or os.path.getsize(file_name) == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(file_name, dtype=dtype, mode='r')
+
+
+def _string_hash(encoded : bytes) -> int:
+    '''
+    Returns the 64-bit hash a string is indexed by, stable across processes unlike hash()
+
+    @Keyword arguments:
+    encoded(bytes): The utf-8 bytes of the string
+    '''
+    return int.from_bytes(hashlib.blake2b(encoded, digest_size=8).digest(), 'little')
+
+
+'''Append-only table of interned strings shared by every stage output'''
+class StringTable:
+    def __init__(self, directory : str = COLUMNS_DIRECTORY, writable : bool = False):
+        '''
+        @Keyword arguments:
+        directory(str): Directory holding strings.bin and string_offsets.bin
+        writable(bool): Open the interning index so new strings can be appended
+        '''
+        self._directory = directory
+        self._writable = writable
+        self._strings_path = os.path.join(directory, 'strings.bin')
+        self._offsets_path = os.path.join(directory, 'string_offsets.bin')
+        self._hashes_path = os.path.join(directory, 'string_hashes.bin')
+        self._index_path = os.path.join(directory, 'string_index.bin')
+        self._blob = _memmap(self._strings_path, np.uint8)
+        self._offsets = _memmap(self._offsets_path, np.int64)
+        # Ids of the strings interned since the table was opened
+        self._ids : Dict[str, int] = {}
+        self._pending_strings : List[bytes] = []
+        self._pending_offsets = array('q')
+        self._pending_hashes : List[int] = []
+        # Hashes of the flushed strings not yet merged into the index, which starts at id self._first_unindexed
+        self._unindexed_hashes : List[int] = []
+        self._first_unindexed = len(self._offsets)
+        self._size = int(self._offsets[-1]) if len(self._offsets) else 0
+        self._sorted_hashes = np.zeros(0, dtype=np.uint64)
+        self._sorted_ids = np.zeros(0, dtype=np.int32)
+        if writable:
+            os.makedirs(directory, exist_ok=True)
+            self._sorted_hashes = _memmap(self._hashes_path, np.uint64)
+            self._sorted_ids = _memmap(self._index_path, np.int32)
+            indexed = len(self._sorted_ids)
+            if indexed < len(self._offsets):
+                # strings appended by a writer that stopped before indexing them, or by one predating the index
+                self.__index(indexed, [_string_hash(self.__bytes(i)) for i in range(indexed, len(self._offsets))])
+
+
+    def __len__(self) -> int:
+        return len(self._offsets) + len(self._pending_offsets)
+
+
+    def __getitem__(self, string_id : int) -> str:
+        '''
+        Decodes an interned string
+
+        @Keyword arguments:
+        string_id(int): Id of the string
+        '''
+        return self.__bytes(string_id).decode()
+
+
+    def __bytes(self, string_id : int) -> bytes:
+        '''
+        Private function returning the utf-8 bytes of an interned string
+
+        @Keyword arguments:
+        string_id(int): Id of the string
+        '''
+        if string_id >= len(self._offsets):
+            return self._pending_strings[string_id - len(self._offsets)]
+        start = int(self._offsets[string_id - 1]) if string_id > 0 else 0
+        return self._blob[start:int(self._offsets[string_id])].tobytes()
+
+
+    def __find(self, encoded : bytes, string_hash : int) -> int:
+        '''
+        Private function looking a string up in the index on disk, returning its id or None
+
+        @Keyword arguments:
+        encoded(bytes): The utf-8 bytes of the string
+        string_hash(int): The hash of the string
+        '''
+        position = int(np.searchsorted(self._sorted_hashes, np.uint64(string_hash)))
+        while position < len(self._sorted_hashes) and int(self._sorted_hashes[position]) == string_hash:
+            string_id = int(self._sorted_ids[position])
+            if self.__bytes(string_id) == encoded:
+                return string_id
+            position += 1
+        return None
+
+
+    def __index(self, first_id : int, string_hashes : List[int]):
+        '''
+        Private function merging the hashes of consecutive new strings into the index on disk
+
+        @Keyword arguments:
+        first_id(int): Id of the first new string
+        string_hashes(List[int]): Hash of every new string, in id order
+        '''
+        new_hashes = np.array(string_hashes, dtype=np.uint64)
+        order = np.argsort(new_hashes, kind='stable')
+        new_hashes = new_hashes[order]
+        new_ids = (first_id + order).astype(np.int32)
+        positions = np.searchsorted(self._sorted_hashes, new_hashes, side='right')
+        # replaced atomically, a reader or a crash never sees a half-written index
+        for path, merged in ((self._hashes_path, np.insert(self._sorted_hashes, positions, new_hashes)),
+                             (self._index_path, np.insert(self._sorted_ids, positions, new_ids))):
+            merged.tofile(f'{path}.tmp')
+            os.replace(f'{path}.tmp', path)
+        self._sorted_hashes = _memmap(self._hashes_path, np.uint64)
+        self._sorted_ids = _memmap(self._index_path, np.int32)
+
+
+    def intern(self, string : str) -> int:
+        '''
+        Returns the id of a string, appending it to the table if it is new
+
+        @Keyword arguments:
+        string(str): The string to intern
+        '''
+        string_id = self._ids.get(string, None)
+        if string_id is not None:
+            return string_id
+        encoded = string.encode()
+        string_hash = _string_hash(encoded)
+        string_id = self.__find(encoded, string_hash)
+        if string_id is None:
+            string_id = len(self)
+            self._size += len(encoded)
+            self._pending_strings.append(encoded)
+            self._pending_offsets.append(self._size)
+            self._pending_hashes.append(string_hash)
+        self._ids[string] = string_id
+        return string_id
+
+
+    def flush(self):
+        '''Appends pending strings to disk and re-maps the table'''
+        if not self._pending_offsets:
+            return
+        with open(self._strings_path, 'ab') as strings_file:
+            strings_file.write(b''.join(self._pending_strings))
+        with open(self._offsets_path, 'ab') as offsets_file:
+            self._pending_offsets.tofile(offsets_file)
+        self._unindexed_hashes.extend(self._pending_hashes)
+        self._pending_strings, self._pending_offsets, self._pending_hashes = [], array('q'), []
+        self._blob = _memmap(self._strings_path, np.uint8)
+        self._offsets = _memmap(self._offsets_path, np.int64)
+
+
+    def write_index(self):
+        '''
+        Flushes pending strings and merges every string added since the last call into the index on disk.
+        Rewrites the whole index, so it is called once per stage output rather than on every flush.
+        '''
+        self.flush()
+        if self._unindexed_hashes:
+            self.__index(self._first_unindexed, self._unindexed_hashes)
+            self._unindexed_hashes = []
+            self._first_unindexed = len(self._offsets)
+
+
+'''Incrementally appends one stage output in the columnar layout'''
+class ColumnarWriter:
+    def __init__(self, stem : str, table : StringTable, scalar : bool = False, append : bool = False,
+                 directory : str = COLUMNS_DIRECTORY, flush_interval : int = 10000):
+        '''
+        @Keyword arguments:
+        stem(str): Name of the stage output, e.g. domains_nameservers
+        table(StringTable): Writable string table shared by every stage
+        scalar(bool): Whether each key maps to a single value instead of a list
+        append(bool): Keep records already on disk instead of truncating the stage output
+        directory(str): Directory holding the columnar files
+        flush_interval(int): Number of records buffered before appending to disk
+        '''
+        self._table = table
+        self._scalar = scalar
+        self._flush_interval = flush_interval
+        self._path = os.path.join(directory, stem)
+        mode = 'ab' if append else 'wb'
+        self._keys_file = open(f'{self._path}.keys.bin', mode)
+        self._offsets_file = open(f'{self._path}.value_offsets.bin', mode)
+        self._values_file = open(f'{self._path}.values.bin', mode)
+        self._value_count = self._values_file.tell() // 4
+        self._record_count = self._keys_file.tell() // 4
+        # the offsets start with a 0, so readers memory-map them as the CSR index pointer as they are
+        self._keys, self._offsets, self._values = array('i'), array('q', [0] if self._offsets_file.tell() == 0 else []), array('i')
+
+
+    def append(self, key : str, values):
+        '''
+        Buffers one record, flushing to disk every flush_interval records
+
+        @Keyword arguments:
+        key(str): The record key
+        values: The record value, a string for scalar outputs and a list of strings otherwise
+        '''
+        if self._scalar:
+            values = [values]
+        self._keys.append(self._table.intern(key))
+        self._values.extend(self._table.intern(value) for value in values)
+        self._value_count += len(values)
+        self._offsets.append(self._value_count)
+        self._record_count += 1
+        if len(self._keys) >= self._flush_interval:
+            self.flush()
+
+
+    def flush(self):
+        '''Appends buffered records and new strings to disk, strings first so readers never see dangling ids'''
+        self._table.flush()
+        self._keys.tofile(self._keys_file)
+        self._offsets.tofile(self._offsets_file)
+        self._values.tofile(self._values_file)
+        for columnar_file in (self._keys_file, self._offsets_file, self._values_file):
+            columnar_file.flush()
+        self._keys, self._offsets, self._values = array('i'), array('q'), array('i')
+        with open(f'{self._path}.meta.json', 'w') as meta_file:
+            json.dump({'scalar': self._scalar, 'records': self._record_count, 'values': self._value_count, 'indptr': True}, meta_file)
+
+
+    def close(self):
+        '''Flushes and closes the stage output, and indexes the strings it added'''
+        self.flush()
+        self._table.write_index()
+        for columnar_file in (self._keys_file, self._offsets_file, self._values_file):
+            columnar_file.close()
+
+
+'''Read-only, memory-mapped view of one stage output that behaves like the dict loaded from its JSON'''
+class ColumnarStore(Mapping):
+    def __init__(self, stem : str, table : StringTable = None, directory : str = COLUMNS_DIRECTORY):
+        '''
+        @Keyword arguments:
+        stem(str): Name of the stage output, e.g. domains_nameservers
+        table(StringTable): String table to decode with, opened read-only if not given
+        directory(str): Directory holding the columnar files
+        '''
+        path = os.path.join(directory, stem)
+        with open(f'{path}.meta.json', 'r') as meta_file:
+            meta = json.load(meta_file)
+        self.table = table if table is not None else StringTable(directory)
+        self.scalar : bool = meta['scalar']
+        # Only expose complete records, a writer may still be appending
+        self.key_ids : np.ndarray = _memmap(f'{path}.keys.bin', np.int32)[:meta['records']]
+        value_offsets = _memmap(f'{path}.value_offsets.bin', np.int64)
+        if meta.get('indptr', False):
+            self.value_indptr : np.ndarray = value_offsets[:meta['records'] + 1]
+        else:
+            # outputs written before the offsets started with a 0 are copied once to prepend it
+            self.value_indptr = np.concatenate(([0], value_offsets[:meta['records']]))
+        self.value_ids : np.ndarray = _memmap(f'{path}.values.bin', np.int32)[:meta['values']]
+        self._positions : Dict[str, int] = None
+
+
+    def __len__(self) -> int:
+        return len(self.key_ids)
+
+
+    def __iter__(self) -> Iterator[str]:
+        table = self.table
+        return (table[key_id] for key_id in self.key_ids.tolist())
+
+
+    def __value_at(self, position : int):
+        '''
+        Private function decoding the value of the record at a position
+
+        @Keyword arguments:
+        position(int): Position of the record in the stage output
+        '''
+        value_ids = self.value_ids[self.value_indptr[position]:self.value_indptr[position + 1]].tolist()
+        if self.scalar:
+            return self.table[value_ids[0]]
+        return [self.table[value_id] for value_id in value_ids]
+
+
+    def __getitem__(self, key : str):
+        if self._positions is None:
+            self._positions = {key: position for position, key in enumerate(self)}
+        return self.__value_at(self._positions[key])
+
+
+    def items(self):
+        return ((key, self.__value_at(position)) for position, key in enumerate(self))
+
+
+    def values(self):
+        return (self.__value_at(position) for position in range(len(self)))
+
+
+def write_columnar(stem : str, mapping : Dict, scalar : bool, table : StringTable = None):
+    '''
+    Writes a whole stage output in the columnar layout
+
+    @Keyword arguments:
+    stem(str): Name of the stage output, e.g. domains_nameservers
+    mapping(Dict): The stage output
+    scalar(bool): Whether each key maps to a single value instead of a list
+    table(StringTable): Writable string table, opened from COLUMNS_DIRECTORY if not given
+    '''
+    writer = ColumnarWriter(stem, table if table is not None else StringTable(writable=True), scalar)
+    for key, values in mapping.items():
+        writer.append(key, values)
+    writer.close()
@@ -0,0 +1,242 @@
+import asyncio
+import threading
+from collections import deque
+from typing import Dict
+
+# Outcomes that mean the upstream is overloaded or rate-limiting us
+CONGESTION_OUTCOMES = ('timeout', 'SERVFAIL', 'REFUSED')
+# Seconds after which dnspython retransmits an unanswered query, dns.resolver.Resolver's per-try timeout
+RETRANSMIT_AFTER = 2.0
+
+'''
+AIMD window of in-flight queries for one upstream.
+The window doubles every round trip until the first congestion signal (slow start), then grows by one
+query per window of successful queries. After every window worth of completed queries it is cut by backoff
+if more than error_threshold of them timed out or got SERVFAIL/REFUSED, or if smoothed latency climbed
+past latency_tolerance times its baseline, so it is cut at most once per round trip.
+Queries that took longer than the per-try timeout were retransmitted after a lost packet, so their
+latency is not a round trip time and is left out of the smoothed latency.
+'''
+class AdaptiveLimiter:
+    def __init__(self, name : str, initial : int = 25, minimum : int = 1, maximum : int = 1000,
+                 backoff : float = 0.5, latency_tolerance : float = 2.0, error_threshold : float = 0.05,
+                 retransmit_after : float = RETRANSMIT_AFTER):
+        '''
+        @Keyword arguments:
+        name(str): Name of the upstream, used in stats
+        initial(int): Starting window of in-flight queries
+        minimum(int): Smallest window the limiter shrinks to
+        maximum(int): Largest window the limiter grows to
+        backoff(float): Factor the window is multiplied by on congestion
+        latency_tolerance(float): Ratio of smoothed to baseline latency treated as congestion
+        error_threshold(float): Fraction of timeouts, SERVFAIL and REFUSED per window treated as congestion
+        retransmit_after(float): Per-try timeout of the resolver, longer queries were retransmitted
+        '''
+        self.name = name
+        self.minimum = minimum
+        self.maximum = maximum
+        self._backoff = backoff
+        self._latency_tolerance = latency_tolerance
+        self._error_threshold = error_threshold
+        self._retransmit_after = retransmit_after
+        self._limit = float(min(max(initial, minimum), maximum))
+        self._slow_start = True
+        self._in_flight = 0
+        self._round_completed = 0
+        self._round_errors = 0
+        self._smoothed_latency = None
+        self._baseline_latency = None
+        self._lock = threading.Lock()
+        # threading.Event for blocked threads, (loop, future) for awaiting coroutines
+        self._waiters = deque()
+        self._completed = 0
+        self._outcomes : Dict[str, int] = {}
+        self._decreases = 0
+        self._retransmitted = 0
+        self._peak_limit = self._limit
+
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+
+    def acquire(self):
+        '''Blocks the calling thread until the window has room for one more query'''
+        with self._lock:
+            if self._in_flight < int(self._limit) and not self._waiters:
+                self._in_flight += 1
+                return
+            waiter = threading.Event()
+            self._waiters.append(waiter)
+        # release() hands the slot over before waking us
+        waiter.wait()
+
+
+    async def acquire_async(self):
+        '''Asyncio counterpart of acquire'''
+        with self._lock:
+            if self._in_flight < int(self._limit) and not self._waiters:
+                self._in_flight += 1
+                return
+            loop = asyncio.get_running_loop()
+            waiter = loop.create_future()
+            self._waiters.append((loop, waiter))
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            with self._lock:
+                if (loop, waiter) in self._waiters:
+                    self._waiters.remove((loop, waiter))
+                    raise
+            # release() already took a slot for us. If the hand over is still pending, the waiter was
+            # cancelled with us and __hand_over gives the slot back, otherwise it is ours to give back.
+            if not waiter.cancelled():
+                self.release('cancelled', None)
+            raise
+
+
+    def release(self, outcome : str, latency : float):
+        '''
+        Frees the slot of a completed query and adjusts the window to its outcome
+
+        @Keyword arguments:
+        outcome(str): Outcome of the query, as classified by ResolverMetrics
+        latency(float): Seconds the query took upstream, None if it never completed
+        '''
+        with self._lock:
+            self._in_flight -= 1
+            if latency is not None:
+                self.__adjust(outcome, latency)
+            while self._waiters and self._in_flight < int(self._limit):
+                self._in_flight += 1
+                waiter = self._waiters.popleft()
+                if isinstance(waiter, threading.Event):
+                    waiter.set()
+                else:
+                    loop, future = waiter
+                    loop.call_soon_threadsafe(self.__hand_over, future)
+
+
+    def __hand_over(self, future : asyncio.Future):
+        '''
+        Private function waking an awaiting coroutine on its own event loop
+
+        @Keyword arguments:
+        future(asyncio.Future): The future the coroutine awaits
+        '''
+        if future.cancelled():
+            # cancelled before the slot arrived
+            self.release('cancelled', None)
+        else:
+            future.set_result(None)
+
+
+    def __adjust(self, outcome : str, latency : float):
+        '''
+        Private function applying AIMD to the window. Caller holds the lock.
+
+        @Keyword arguments:
+        outcome(str): Outcome of the query
+        latency(float): Seconds the query took upstream
+        '''
+        self._completed += 1
+        self._round_completed += 1
+        self._outcomes[outcome] = self._outcomes.get(outcome, 0) + 1
+        if outcome in CONGESTION_OUTCOMES:
+            self._round_errors += 1
+        elif latency >= self._retransmit_after:
+            # answered after a retransmission: packet loss, not queueing, so it says nothing about the window
+            self._retransmitted += 1
+        else:
+            # Baseline is the lowest smoothed latency seen, drifting up slowly so it follows lasting changes.
+            # Samples are clamped so one slow query cannot trip the latency signal on its own.
+            if self._smoothed_latency is None:
+                self._smoothed_latency = latency
+            else:
+                latency = min(latency, 2 * self._latency_tolerance * self._baseline_latency)
+                self._smoothed_latency = 0.9 * self._smoothed_latency + 0.1 * latency
+            self._baseline_latency = self._smoothed_latency if self._baseline_latency is None else min(
+                self._baseline_latency * 1.001, self._smoothed_latency
+            )
+        latency_congested = self._smoothed_latency is not None and \
+            self._smoothed_latency > self._latency_tolerance * self._baseline_latency
+
+        cut = False
+        if self._round_completed >= self._limit:
+            if latency_congested or self._round_errors > self._error_threshold * self._round_completed:
+                self._limit = max(self.minimum, self._limit * self._backoff)
+                self._slow_start = False
+                self._decreases += 1
+                cut = True
+            self._round_completed = 0
+            self._round_errors = 0
+        # A round of one query ends on every completion, so growth must not wait for a round to be open
+        if not cut and outcome not in CONGESTION_OUTCOMES and not latency_congested \
+                and self._in_flight + 1 >= self._limit / 2:
+            # Only grow a window that is actually being used
+            self._limit = min(self.maximum, self._limit + (1 if self._slow_start else 1 / self._limit))
+            self._peak_limit = max(self._peak_limit, self._limit)
+
+
+    def stats(self) -> Dict:
+        '''Returns the window, outcome counts and error rates of this upstream'''
+        with self._lock:
+            completed = max(self._completed, 1)
+            return {
+                'limit': int(self._limit),
+                'peak_limit': int(self._peak_limit),
+                'decreases': self._decreases,
+                'retransmitted': self._retransmitted,
+                'completed': self._completed,
+                'outcomes': dict(self._outcomes),
+                'timeout_rate': self._outcomes.get('timeout', 0) / completed,
+                'servfail_rate': self._outcomes.get('SERVFAIL', 0) / completed,
+                'smoothed_latency_ms': (self._smoothed_latency or 0) * 1000,
+                'baseline_latency_ms': (self._baseline_latency or 0) * 1000
+            }
+
+
+'''
+Adaptive concurrency shared by every DNSResolver of a run, with one AdaptiveLimiter per upstream:
+Team Cymru ('cymru', every *.cymru.com query) and the recursive resolver ('recursive', everything else).
+'''
+class ConcurrencyController:
+    def __init__(self, initial : int = 25, minimum : int = 1, maximum : int = 1000,
+                 backoff : float = 0.5, latency_tolerance : float = 2.0, error_threshold : float = 0.05,
+                 retransmit_after : float = RETRANSMIT_AFTER):
+        '''
+        @Keyword arguments:
+        initial(int): Starting window of each upstream
+        minimum(int): Smallest window of each upstream
+        maximum(int): Largest window of each upstream
+        backoff(float): Factor a window is multiplied by on congestion
+        latency_tolerance(float): Ratio of smoothed to baseline latency treated as congestion
+        error_threshold(float): Fraction of timeouts, SERVFAIL and REFUSED per window treated as congestion
+        retransmit_after(float): Per-try timeout of the resolvers, longer queries were retransmitted
+        '''
+        self.maximum = maximum
+        self._limiters = {
+            upstream: AdaptiveLimiter(
+                upstream, initial, minimum, maximum, backoff, latency_tolerance, error_threshold, retransmit_after
+            )
+            for upstream in ('recursive', 'cymru')
+        }
+
+
+    def limiter_for(self, query : str) -> AdaptiveLimiter:
+        '''
+        Returns the limiter of the upstream that answers a query
+
+        @Keyword arguments:
+        query(str): The DNS query
+        '''
+        if query.rstrip('.').endswith('.cymru.com'):
+            return self._limiters['cymru']
+        return self._limiters['recursive']
+
+
+    def stats(self) -> Dict[str, Dict]:
+        '''Returns the stats of every upstream that received queries'''
+        stats = {name: limiter.stats() for name, limiter in self._limiters.items()}
+        return {name: upstream for name, upstream in stats.items() if upstream['completed']}
@@ -0,0 +1,166 @@
+import ipaddress
+import random
+import socket
+import threading
+import time
+from typing import Iterable, List, Dict, Tuple
+from .resolver_metrics import ResolverMetrics
+
+'''
+Client of Team Cymru's bulk whois interface (whois.cymru.com, port 43), an alternative to one DNS TXT
+query per IP or ASN. Keys are streamed to the server in begin/verbose ... end sessions of up to
+batch_size keys by a writer thread while the pipe-delimited response lines are parsed as they arrive,
+so a whole step takes a handful of round trips. The server closes the connection after every 'end',
+so each batch gets its own connection.
+
+Answers are returned in the same text layout as the TXT records of the DNS interface:
+'<ASNs> | <prefix> | <CC> | <registry> | <allocated>' for IPs and
+'<ASN> | <CC> | <registry> | <allocated> | <AS name>' for ASNs.
+AS names that came along with IP answers are remembered, and ASNs whose name is already known are
+answered as '<ASN> | <AS name>' without asking the server again.
+'''
+class CymruWhoisClient:
+    def __init__(self, host : str = 'whois.cymru.com', port : int = 43, batch_size : int = 10000,
+                 timeout : float = 60.0, attempts : int = 3, metrics : ResolverMetrics = None):
+        '''
+        @Keyword arguments:
+        host(str): Bulk whois server
+        port(int): Bulk whois port
+        batch_size(int): Maximum number of keys per begin/end session
+        timeout(float): Seconds without any data from the server before a session is given up on
+        attempts(int): Sessions tried per batch before its keys are reported as failed
+        metrics(ResolverMetrics): Instrumentation every session is recorded into as a 'WHOIS' lookup, None to disable
+        '''
+        self._host = host
+        self._port = port
+        self._batch_size = batch_size
+        self._timeout = timeout
+        self._attempts = attempts
+        self._metrics = metrics
+        self._lock = threading.Lock()
+        self._as_names : Dict[str, str] = {}
+
+
+    def __session(self, keys : List[str]) -> List[List[str]]:
+        '''
+        Private function running one begin/verbose ... end session, returning the fields of every answer line
+
+        @Keyword arguments:
+        keys(List[str]): IPs or AS<number>s to look up
+        '''
+        rows : List[List[str]] = []
+        with socket.create_connection((self._host, self._port), timeout=self._timeout) as connection:
+            def send():
+                # The server answers while we are still sending, so requests are written from their own thread
+                try:
+                    connection.sendall(('begin\nverbose\n' + ''.join(f'{key}\n' for key in keys) + 'end\n').encode())
+                except OSError:
+                    pass
+
+            writer = threading.Thread(target=send, daemon=True)
+            writer.start()
+            with connection.makefile('r', encoding='utf-8', errors='replace') as response:
+                for line in response:
+                    if '|' not in line or line.startswith('Bulk mode'):
+                        continue
+                    rows.append([field.strip() for field in line.split('|')])
+            writer.join()
+        return rows
+
+
+    def __run_batches(self, keys : List[str]) -> Tuple[List[List[str]], Dict[str, str]]:
+        '''
+        Private function running a session per batch of keys, retrying failed sessions with backoff.
+        Returns the fields of every answer line, and the reason every key of a batch that kept failing is missing.
+
+        @Keyword arguments:
+        keys(List[str]): IPs or AS<number>s to look up
+        '''
+        rows : List[List[str]] = []
+        failures : Dict[str, str] = {}
+        for start in range(0, len(keys), self._batch_size):
+            batch = keys[start:start + self._batch_size]
+            for attempt in range(1, self._attempts + 1):
+                started = self._metrics.start('WHOIS') if self._metrics is not None else None
+                outcome = 'NOERROR'
+                try:
+                    rows += self.__session(batch)
+                    break
+                except Exception as e:
+                    outcome = ResolverMetrics.classify(e)
+                    if attempt == self._attempts:
+                        failures.update({key: outcome for key in batch})
+                    else:
+                        time.sleep(random.uniform(0, 2 ** attempt))
+                finally:
+                    if started is not None:
+                        self._metrics.finish('WHOIS', started, outcome)
+        return rows, failures
+
+
+    def lookup_ips(self, ips : Iterable[str]) -> Tuple[Dict[str, str], Dict[str, str]]:
+        '''
+        Looks up the origin ASNs of IPv4 and IPv6 addresses.
+        Returns the answer of every IP that has one, and the reason every other IP is missing.
+
+        @Keyword arguments:
+        ips(Iterable[str]): The IPs to look up
+        '''
+        ips = list(dict.fromkeys(ips))
+        rows, failures = self.__run_batches(ips)
+        # A prefix announced by several ASNs comes back as one line per origin
+        origins : Dict[str, List[List[str]]] = {}
+        for row in rows:
+            if len(row) < 7:
+                continue
+            asn, ip, prefix, country, registry, allocated, as_name = row[:7]
+            try:
+                ip = str(ipaddress.ip_address(ip))
+            except ValueError:
+                continue
+            if asn == 'NA':
+                failures.setdefault(ip, 'not announced')
+                continue
+            origins.setdefault(ip, []).append([asn, prefix, country, registry, allocated])
+            with self._lock:
+                self._as_names.setdefault(asn, as_name)
+
+        answers : Dict[str, str] = {}
+        for ip in ips:
+            if ip not in origins:
+                failures.setdefault(ip, 'no answer')
+                continue
+            asns = ' '.join(dict.fromkeys(origin[0] for origin in origins[ip]))
+            _, prefix, country, registry, allocated = origins[ip][0]
+            answers[ip] = f'{asns} | {prefix} | {country} | {registry} | {allocated}'
+            failures.pop(ip, None)
+        return answers, failures
+
+
+    def lookup_asns(self, asns : Iterable[str]) -> Tuple[Dict[str, str], Dict[str, str]]:
+        '''
+        Looks up the AS names of ASNs, only asking the server for those not seen in an IP answer.
+        Returns the answer of every ASN that has one, and the reason every other ASN is missing.
+
+        @Keyword arguments:
+        asns(Iterable[str]): The ASNs to look up, as numbers without the AS prefix
+        '''
+        asns = list(dict.fromkeys(asns))
+        with self._lock:
+            answers = {asn: f'{asn} | {self._as_names[asn]}' for asn in asns if asn in self._as_names}
+        unknown = [asn for asn in asns if asn not in answers]
+        rows, failures = self.__run_batches([f'AS{asn}' for asn in unknown])
+        failures = {key[2:]: reason for key, reason in failures.items()}
+        for row in rows:
+            if len(row) < 5 or row[0] == 'NA':
+                continue
+            asn, country, registry, allocated, as_name = row[:5]
+            answers[asn] = f'{asn} | {country} | {registry} | {allocated} | {as_name}'
+            with self._lock:
+                self._as_names.setdefault(asn, as_name)
+        for asn in unknown:
+            if asn not in answers:
+                failures.setdefault(asn, 'no answer')
+            else:
+                failures.pop(asn, None)
+        return answers, failures
@@ -0,0 +1,477 @@
+import json
+from array import array
+from collections.abc import Mapping
+from itertools import accumulate, chain
+from typing import Iterator, List, Dict, Sequence, Tuple
+
+# Node layers of the chain, each stage output holds the edges from one layer to the next
+LAYERS = ('domain', 'nameserver', 'ip', 'asn', 'organization')
+STAGES = ('domains_nameservers', 'nameserver_ips', 'ip_to_asn_mapping', 'asn_to_org_mapping')
+
+
+'''
+Dependency graph of the domain -> nameserver -> IP -> ASN -> organization chain, built from the
+stage outputs. Every distinct name of a layer is stored once in a shared string table and nodes only
+hold string ids, so a nameserver or organization used by thousands of domains is stored once.
+The edges from each layer to the next are CSR offset and node id arrays.
+
+Building from the JSON outputs only uses the array module, so the resolvers can read it without
+NumPy. A columnar output is re-indexed from its memory-mapped string ids without decoding any string.
+Queries import NumPy on first use: they walk the edges with array operations and cache the
+(node, dependency) pairs and reverse indexes, e.g. organization -> domains, they are answered from.
+'''
+class DependencyGraph:
+    __slots__ = ('_strings', '_first', '_names', '_indptr', '_indices', '_ids', '_pairs', '_reverse')
+
+    def __init__(self, strings : Sequence[str], names : List, indptr : List, indices : List, first : int = 0):
+        '''
+        @Keyword arguments:
+        strings(Sequence[str]): Interned strings, indexed by string id
+        names(List): String ids of the nodes of every layer built, in node id order
+        indptr(List): CSR offsets of the edges out of every layer but the last, len(nodes) + 1 each
+        indices(List): CSR node ids of the next layer every edge leads to
+        first(int): Index in LAYERS of the first layer built
+        '''
+        self._strings = strings
+        self._first = first
+        self._names = names
+        self._indptr = indptr
+        self._indices = indices
+        # built on first use: name -> node id of every layer, and (source, target) pairs and their reverse
+        self._ids : Dict[str, Dict[str, int]] = {}
+        self._pairs : Dict[Tuple[int, int], Tuple] = {}
+        self._reverse : Dict[Tuple[int, int], Tuple] = {}
+
+
+    @classmethod
+    def from_outputs(cls, outputs : List[Mapping], layer : str = 'domain') -> 'DependencyGraph':
+        '''
+        Builds the graph from consecutive stage outputs, in order, e.g. just nameserver_ips for the
+        IPs of Step 2. Outputs may be the dicts loaded from JSON or ColumnarStores.
+
+        @Keyword arguments:
+        outputs(List[Mapping]): Stage outputs, in the order of STAGES
+        layer(str): Layer the keys of the first output are nodes of
+        '''
+        first = LAYERS.index(layer) if layer in LAYERS else -1
+        if first < 0 or not 0 < len(outputs) <= len(STAGES) - first:
+            raise Exception(f'Dependency graph: {len(outputs)} stage outputs from the {layer} layer do not fit {STAGES}.')
+        # columnar stores expose the string ids they are interned into
+        if all(hasattr(output, 'value_ids') for output in outputs):
+            return cls.__from_columnar(outputs, first)
+        return cls.__from_mappings(outputs, first)
+
+
+    @classmethod
+    def read(cls, output_format : str = 'json', stages : int = len(STAGES), directory : str = 'outputs') -> 'DependencyGraph':
+        '''
+        Builds the graph from the stage outputs on disk
+
+        @Keyword arguments:
+        output_format(str): 'json' to parse the JSON stage outputs, anything else memory-maps the columnar layout
+        stages(int): Number of stages to read, from Step 1
+        directory(str): Directory holding the stage outputs
+        '''
+        if output_format == 'json':
+            outputs = []
+            for stem in STAGES[:stages]:
+                with open(f'{directory}/{stem}.json', 'r') as jsonfile:
+                    outputs.append(json.load(jsonfile))
+            return cls.from_outputs(outputs)
+        from .columnar_store import ColumnarStore, StringTable
+        table = StringTable(f'{directory}/columns')
+        return cls.from_outputs([ColumnarStore(stem, table, f'{directory}/columns') for stem in STAGES[:stages]])
+
+
+    @classmethod
+    def __from_mappings(cls, outputs : List[Mapping], first : int) -> 'DependencyGraph':
+        '''
+        Private function building the graph from stage outputs keyed by name. Nodes of every layer
+        are numbered in first-seen order, walking the previous layer in node order.
+
+        @Keyword arguments:
+        outputs(List[Mapping]): Stage outputs, in the order of STAGES
+        first(int): Index in LAYERS of the layer the keys of the first output are nodes of
+        '''
+        strings : List[str] = []
+
+        def intern(nodes : List[str]) -> array:
+            # names are unique within a layer, so each layer appends its own run of strings
+            strings.extend(nodes)
+            return array('i', range(len(strings) - len(nodes), len(strings)))
+
+        nodes = list(outputs[0].keys())
+        names, indptrs, indices = [intern(nodes)], [], []
+        for stage, output in enumerate(outputs):
+            values = output.values() if stage == 0 else map(output.get, nodes)
+            # org mappings, and nameserver IPs written by earlier runs, hold one string, and keys missing from a stage hold None
+            edges = [[] if value is None else [value] if isinstance(value, str) else value for value in values]
+            flattened = list(chain.from_iterable(edges))
+            nodes = list(dict.fromkeys(flattened))
+            node_ids = dict(zip(nodes, range(len(nodes))))
+            indptrs.append(array('q', accumulate(map(len, edges), initial=0)))
+            indices.append(array('i', map(node_ids.__getitem__, flattened)))
+            names.append(intern(nodes))
+        return cls(strings, names, indptrs, indices, first)
+
+
+    @classmethod
+    def __from_columnar(cls, outputs : List[Mapping], first : int) -> 'DependencyGraph':
+        '''
+        Private function building the graph from columnar stores sharing one string table. Nodes
+        after the domains are numbered in string id order, which is the order they were first written in.
+
+        @Keyword arguments:
+        outputs(List[Mapping]): ColumnarStores, in the order of STAGES
+        first(int): Index in LAYERS of the layer the keys of the first output are nodes of
+        '''
+        import numpy as np
+        nodes = np.asarray(outputs[0].key_ids, dtype=np.int32)
+        names, indptrs, indices = [nodes], [], []
+        for stage, store in enumerate(outputs):
+            value_indptr = np.asarray(store.value_indptr, dtype=np.int64)
+            if stage == 0:
+                records = np.arange(len(nodes), dtype=np.int64)
+                found = np.ones(len(nodes), dtype=bool)
+            else:
+                # the record of every node, the first one if a key was written twice
+                order = np.argsort(store.key_ids, kind='stable')
+                sorted_keys = np.asarray(store.key_ids)[order]
+                positions = np.minimum(np.searchsorted(sorted_keys, nodes), max(len(sorted_keys) - 1, 0))
+                found = sorted_keys[positions] == nodes if len(sorted_keys) else np.zeros(len(nodes), dtype=bool)
+                records = np.where(found, order[positions] if len(order) else 0, 0).astype(np.int64)
+            counts = np.where(found, value_indptr[records + 1] - value_indptr[records], 0)
+            offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+            targets = np.asarray(store.value_ids)[np.repeat(value_indptr[records], counts) + offsets]
+            nodes, node_ids = np.unique(targets, return_inverse=True)
+            indptrs.append(np.concatenate(([0], np.cumsum(counts))))
+            indices.append(node_ids.astype(np.int32))
+            names.append(nodes.astype(np.int32))
+        return cls(outputs[0].table, names, indptrs, indices, first)
+
+
+    def __layer(self, layer : str) -> int:
+        '''
+        Private function returning the index of a layer among the layers built, raising if it was not built
+
+        @Keyword arguments:
+        layer(str): One of LAYERS
+        '''
+        if layer not in LAYERS:
+            raise Exception(f'Dependency graph: {layer} is not one of {LAYERS}.')
+        index = LAYERS.index(layer) - self._first
+        if not 0 <= index < len(self._names):
+            raise Exception(f'Dependency graph: {layer} nodes were not built, the stage outputs given start at {LAYERS[self._first]}.')
+        return index
+
+
+    def __len__(self) -> int:
+        '''Number of nodes of the first layer built, the domains unless the graph starts lower'''
+        return len(self._names[0])
+
+
+    def node_count(self, layer : str) -> int:
+        '''
+        Gets the number of distinct nodes of a layer
+
+        @Keyword arguments:
+        layer(str): One of LAYERS
+        '''
+        return len(self._names[self.__layer(layer)])
+
+
+    def name(self, layer : str, node : int) -> str:
+        '''
+        Gets the name of a node
+
+        @Keyword arguments:
+        layer(str): One of LAYERS
+        node(int): The node id
+        '''
+        return self._strings[self._names[self.__layer(layer)][node]]
+
+
+    def names(self, layer : str) -> List[str]:
+        '''
+        Gets the names of every node of a layer, in node id order. Nameservers, IPs and ASNs are each
+        listed once however many domains depend on them.
+
+        @Keyword arguments:
+        layer(str): One of LAYERS
+        '''
+        strings = self._strings
+        return [strings[string_id] for string_id in self.__string_ids(self.__layer(layer))]
+
+
+    def __string_ids(self, index : int) -> List[int]:
+        '''
+        Private function returning the string ids of the nodes of a layer as a list
+
+        @Keyword arguments:
+        index(int): Index of the layer
+        '''
+        names = self._names[index]
+        return names.tolist() if hasattr(names, 'tolist') else list(names)
+
+
+    def node(self, layer : str, name : str) -> int:
+        '''
+        Gets the id of a node, None if the layer has no node of that name
+
+        @Keyword arguments:
+        layer(str): One of LAYERS
+        name(str): The node name
+        '''
+        ids = self._ids.get(layer, None)
+        if ids is None:
+            names = self.names(layer)
+            ids = self._ids[layer] = dict(zip(names, range(len(names))))
+        return ids.get(name, None)
+
+
+    def targets(self, layer : str, name : str) -> List[str]:
+        '''
+        Gets the names of the next layer a node depends on directly, e.g. the IPs of a nameserver
+
+        @Keyword arguments:
+        layer(str): One of LAYERS but the last layer built
+        name(str): The node name
+        '''
+        index = self.__layer(layer)
+        node = self.node(layer, name)
+        if node is None or index >= len(self._indptr):
+            return []
+        indptr, indices, next_names = self._indptr[index], self._indices[index], self._names[index + 1]
+        return [self._strings[next_names[target]] for target in indices[int(indptr[node]):int(indptr[node + 1])].tolist()]
+
+
+    def adjacency(self, layer : str = 'domain') -> Mapping:
+        '''
+        Gets a read-only mapping of every node of a layer to the names it depends on directly,
+        e.g. the domains_nameservers stage output for 'domain'
+
+        @Keyword arguments:
+        layer(str): One of LAYERS but the last layer built
+        '''
+        index = self.__layer(layer)
+        if index >= len(self._indptr):
+            raise Exception(f'Dependency graph: {layer} nodes have no edges.')
+        return _Adjacency(self, index)
+
+
+    def __edges(self, index : int):
+        '''
+        Private function returning the edges out of a layer as NumPy (indptr, indices) arrays
+
+        @Keyword arguments:
+        index(int): Index of the layer
+        '''
+        import numpy as np
+        indptr, indices = self._indptr[index], self._indices[index]
+        if isinstance(indptr, array):
+            return np.frombuffer(indptr, dtype=np.int64), np.frombuffer(indices, dtype=np.int32).astype(np.int64)
+        return indptr, indices.astype(np.int64)
+
+
+    def __unique_pairs(self, owners, nodes, owner_count : int, node_count : int):
+        '''
+        Private function keeping each (owner, node) pair once, sorted by owner then node,
+        as the CSR (indptr, nodes) arrays of the owners
+
+        @Keyword arguments:
+        owners(np.ndarray): Owner id of each pair
+        nodes(np.ndarray): Node id of each pair
+        owner_count(int): Number of distinct owner ids
+        node_count(int): Number of distinct node ids
+        '''
+        import numpy as np
+        node_count = max(node_count, 1)
+        pairs = np.sort(owners * node_count + nodes)
+        pairs = pairs[np.concatenate(([True], pairs[1:] != pairs[:-1]))]
+        return np.concatenate(([0], np.cumsum(np.bincount(pairs // node_count, minlength=owner_count)))), pairs % node_count
+
+
+    def __pairs(self, source : int, target : int):
+        '''
+        Private function returning every (source node, target node) pair where the source depends on the
+        target through any path, each pair once, as the CSR (indptr, targets) arrays of the source layer.
+        Pairs are composed from the layer below, so every layer between is walked once however many
+        sources share it, and cached.
+
+        @Keyword arguments:
+        source(int): Index of the source layer
+        target(int): Index of a layer below the source layer
+        '''
+        import numpy as np
+        pairs = self._pairs.get((source, target), None)
+        if pairs is not None:
+            return pairs
+        indptr, indices = self.__edges(source)
+        if target > source + 1:
+            # follow every edge out of each source node to the targets of the node it leads to
+            next_indptr, next_targets = self.__pairs(source + 1, target)
+            counts = next_indptr[indices + 1] - next_indptr[indices]
+            offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+            owners = np.repeat(np.repeat(np.arange(len(self._names[source]), dtype=np.int64), np.diff(indptr)), counts)
+            indices = next_targets[np.repeat(next_indptr[indices], counts) + offsets]
+        else:
+            owners = np.repeat(np.arange(len(self._names[source]), dtype=np.int64), np.diff(indptr))
+        pairs = self._pairs[(source, target)] = self.__unique_pairs(owners, indices, len(self._names[source]), len(self._names[target]))
+        return pairs
+
+
+    def pairs(self, source : str = 'domain', target : str = 'organization'):
+        '''
+        Gets every (source node, target node) pair where the source depends on the target, each pair once,
+        sorted by source then target, as two NumPy arrays of node ids
+
+        @Keyword arguments:
+        source(str): One of LAYERS
+        target(str): One of LAYERS below the source
+        '''
+        import numpy as np
+        source_index, target_index = self.__layer(source), self.__layer(target)
+        if target_index <= source_index:
+            raise Exception(f'Dependency graph: {source} nodes do not depend on {target} nodes.')
+        indptr, targets = self.__pairs(source_index, target_index)
+        return np.repeat(np.arange(len(indptr) - 1, dtype=np.int64), np.diff(indptr)), targets
+
+
+    def __reverse_index(self, source : int, target : int):
+        '''
+        Private function returning the source nodes depending on every target node,
+        as the CSR (indptr, sources) arrays of the target layer, built on first use
+
+        @Keyword arguments:
+        source(int): Index of the source layer
+        target(int): Index of a layer below the source layer
+        '''
+        import numpy as np
+        reverse = self._reverse.get((source, target), None)
+        if reverse is None:
+            indptr, targets = self.__pairs(source, target)
+            sources = np.repeat(np.arange(len(indptr) - 1, dtype=np.int64), np.diff(indptr))
+            order = np.argsort(targets, kind='stable')
+            counts = np.bincount(targets, minlength=len(self._names[target]))
+            reverse = self._reverse[(source, target)] = (np.concatenate(([0], np.cumsum(counts))), sources[order])
+        return reverse
+
+
+    def dependents(self, layer : str, name : str, source : str = 'domain') -> List[str]:
+        '''
+        Gets the names of every node of a source layer depending on a node, directly or not,
+        in source node order
+
+        @Keyword arguments:
+        layer(str): Layer of the node, one of LAYERS
+        name(str): The node name
+        source(str): Layer of the dependents, one of LAYERS above the node's
+        '''
+        source_index, target_index = self.__layer(source), self.__layer(layer)
+        if target_index <= source_index:
+            raise Exception(f'Dependency graph: {source} nodes do not depend on {layer} nodes.')
+        node = self.node(layer, name)
+        if node is None:
+            return []
+        indptr, sources = self.__reverse_index(source_index, target_index)
+        names, strings = self._names[source_index], self._strings
+        return [strings[names[dependent]] for dependent in sources[indptr[node]:indptr[node + 1]].tolist()]
+
+
+    def domains_of(self, organization : str) -> List[str]:
+        '''
+        Gets the domains with a nameserver hosted by an organization
+
+        @Keyword arguments:
+        organization(str): The organization name
+        '''
+        return self.dependents('organization', organization)
+
+
+    def nameservers_of(self, asn : str) -> List[str]:
+        '''
+        Gets the nameservers with an IP announced by an ASN
+
+        @Keyword arguments:
+        asn(str): The ASN
+        '''
+        return self.dependents('asn', asn, 'nameserver')
+
+
+    def outage(self, names : List[str], layer : str = 'organization') -> Dict[str, List[str]]:
+        '''
+        Gets the domains that break if some nodes go down, in domain order. A domain is unreachable
+        when every node of the layer it depends on is down, and affected when at least one is, like the
+        unreachable and affected counts of the results. Only the domains depending on a failed node are visited.
+
+        @Keyword arguments:
+        names(List[str]): Names of the failed nodes, e.g. organizations
+        layer(str): Layer of the failed nodes, one of LAYERS below 'domain'
+        '''
+        import numpy as np
+        source, target = self.__layer('domain'), self.__layer(layer)
+        if target == source:
+            raise Exception('Dependency graph: an outage is given as nodes domains depend on.')
+        failed = np.array(sorted({node for node in map(lambda name: self.node(layer, name), names) if node is not None}), dtype=np.int64)
+        indptr, sources = self.__reverse_index(source, target)
+        counts = indptr[failed + 1] - indptr[failed]
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        # each (domain, node) pair is listed once, so a domain is unreachable when all of its pairs are failed ones
+        domains, failed_counts = np.unique(sources[np.repeat(indptr[failed], counts) + offsets], return_counts=True)
+        pair_indptr, _ = self.__pairs(source, target)
+        unreachable = domains[failed_counts == (pair_indptr[domains + 1] - pair_indptr[domains])]
+        names, strings = self._names[source], self._strings
+        return {
+            'unreachable': [strings[names[domain]] for domain in unreachable.tolist()],
+            'affected': [strings[names[domain]] for domain in domains.tolist()]
+        }
+
+
+'''Read-only view of the edges out of one layer that behaves like the stage output they were built from'''
+class _Adjacency(Mapping):
+    __slots__ = ('_graph', '_layer', '_positions')
+
+    def __init__(self, graph : DependencyGraph, layer : int):
+        '''
+        @Keyword arguments:
+        graph(DependencyGraph): The graph
+        layer(int): Index of the layer
+        '''
+        self._graph = graph
+        self._layer = layer
+        self._positions : Dict[str, int] = None
+
+
+    def __len__(self) -> int:
+        return len(self._graph._names[self._layer])
+
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._graph.names(LAYERS[self._graph._first + self._layer]))
+
+
+    def __getitem__(self, key : str) -> List[str]:
+        if self._positions is None:
+            self._positions = {key: position for position, key in enumerate(self)}
+        return self.__targets_at(self._positions[key])
+
+
+    def __targets_at(self, position : int) -> List[str]:
+        '''
+        Private function decoding the names a node depends on directly
+
+        @Keyword arguments:
+        position(int): The node id
+        '''
+        graph = self._graph
+        indptr, indices = graph._indptr[self._layer], graph._indices[self._layer]
+        next_names, strings = graph._names[self._layer + 1], graph._strings
+        return [strings[next_names[target]] for target in indices[int(indptr[position]):int(indptr[position + 1])].tolist()]
+
+
+    def items(self):
+        return zip(self, self.values())
+
+
+    def values(self):
+        return (self.__targets_at(position) for position in range(len(self)))
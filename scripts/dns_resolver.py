@@ -1,46 +1,626 @@
-import csv
+import asyncio
 import json
-from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 import dns.resolver
-from typing import List, Dict
+from typing import Awaitable, Callable, List, Dict, Tuple
+from .resolution_cache import ResolutionCache
+from .run_journal import RunJournal
+from .resolver_metrics import ResolverMetrics
+from .concurrency_controller import ConcurrencyController
+from .retry_policy import RetryPolicy, RetryScheduler
+from .upstream_pool import UpstreamPool
+from .tranco_list import TrancoList
+
+'''Token bucket used to cap the number of queries sent per second by the async engine'''
+class RateLimiter:
+    def __init__(self, rate : float = 0):
+        '''
+        @Keyword arguments:
+        rate(float): maximum queries per second, 0 disables the cap
+        '''
+        self._rate = rate
+        self._tokens = rate
+        self._last_refill = time.monotonic()
+        self._lock = asyncio.Lock()
+
+
+    async def acquire(self):
+        '''Waits until a token is available, then consumes it'''
+        if self._rate <= 0:
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self._rate, self._tokens + (now - self._last_refill) * self._rate)
+                self._last_refill = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self._rate)
+
 
 '''Base Class for all DNS Resolvers to replicate experiment'''
 class DNSResolver:
-    def __init__(self, record_type : str):
+    ENGINES = ('thread', 'async')
+    OUTPUT_FORMATS = ('json', 'columnar', 'both')
+
+    def __init__(self, record_type : str, max_threads : int = 25, engine : str = 'thread',
+                 concurrency : int = 1000, rate_limit : float = 0, cache : ResolutionCache = None,
+                 output_format : str = 'json', journal : RunJournal = None, metrics : ResolverMetrics = None,
+                 upstreams : UpstreamPool = None, controller : ConcurrencyController = None,
+                 retry_policy : RetryPolicy = None):
         '''When initalized, must specify a record type that is being parsed for experiment
         
         @Keyword arguments: 
         record_type(str): specifies type of record type
-        
+        max_threads(int): number of worker threads used by the 'thread' engine
+        engine(str): 'thread' for a ThreadPoolExecutor, 'async' for an asyncio event loop
+        concurrency(int): maximum number of in-flight queries for the 'async' engine
+        rate_limit(float): maximum queries per second for the 'async' engine, 0 for no cap
+        cache(ResolutionCache): persistent cache consulted before every query, None to disable
+        output_format(str): 'json', 'columnar' or 'both', the layout stage outputs are written in
+        journal(RunJournal): checkpoint journal results are appended to, None to disable
+        metrics(ResolverMetrics): instrumentation shared across resolvers, a private one if None
+        upstreams(UpstreamPool): recursive resolvers queries are spread across, 127.0.0.1:8053 if None
+        controller(ConcurrencyController): adaptive per-upstream windows of in-flight queries, None for fixed concurrency
+        retry_policy(RetryPolicy): when transient failures are retried at the tail of a stage, None to never retry
         '''
-        self._resolver = dns.resolver.Resolver()
-        self._resolver.nameservers = ['127.0.0.1']
-        self._resolver.port = 8053
+        if engine not in self.ENGINES:
+            raise Exception(f'Engine: {engine} not supported.')
+        if output_format not in self.OUTPUT_FORMATS:
+            raise Exception(f'Output Format: {output_format} not supported.')
+        self._upstreams = upstreams if upstreams is not None else UpstreamPool(['127.0.0.1'], 8053)
         self._resolution_failed_counter = 0
+        self._failed_counter_lock = threading.Lock()
+        # Outcome and time of the first failure of every query that failed and has not succeeded since
+        self._failures : Dict[str, Tuple[str, float]] = {}
+        # Reason every key of a stage was given up on, by stage output
+        self._stage_failures : Dict[str, Dict[str, str]] = {}
         self._record_type = record_type
+        self._max_threads = max_threads
+        self._engine = engine
+        self._concurrency = concurrency
+        self._rate_limit = rate_limit
+        self._cache = cache
+        self._cache_hits = 0
+        self._cache_misses = 0
+        self._output_format = output_format
+        self._journal = journal
+        self._metrics = metrics if metrics is not None else ResolverMetrics()
+        self._controller = controller
+        self._retry_policy = retry_policy
+
+        # Pending lookups by query, so concurrent callers for the same query share one lookup
+        self._inflight : Dict[str, Future] = {}
+        self._inflight_lock = threading.Lock()
+        self._async_inflight : Dict[str, asyncio.Future] = {}
+
+
+    def parse_answer(self, records : List[str]):
+        '''
+        Converts the text of a DNS answer's records into the value stored for self._record_type
+
+        @Keyword arguments:
+        records(List[str]): The text of every record in the answer
+        '''
+        if self._record_type in ('NS', 'A', 'AAAA'):
+            return list(records)
+        elif self._record_type == 'TXT':
+            return records[0]
+        else:
+            raise Exception(f'Record Type: {self._record_type} not supported.')
+
 
-    
     def resolve(self, query : str) -> str:
         '''
         General Resolve Function. Query parameter will vary based 
         on what sub class functionality is & what self._record_type is.
+        Concurrent calls for the same query wait on the first caller's lookup.
         
         @Keyword arguments:
         query(str): The DNS query to resolve
         '''
+        with self._inflight_lock:
+            pending = self._inflight.get(query)
+            owner = pending is None
+            if owner:
+                pending = self._inflight[query] = Future()
+        if not owner:
+            return pending.result()
+
+        result = None
         try:
-            answer = self._resolver.resolve(query, self._record_type)
-            if self._record_type == 'NS':
-                return [str(a) for a in answer]
-            elif self._record_type == 'A' or self._record_type == 'TXT':
-                return str(answer[0])
-            else:
-                raise Exception(f'Record Type: {self._record_type} not supported.')
+            result = self._lookup(query)
+        finally:
+            with self._inflight_lock:
+                del self._inflight[query]
+            pending.set_result(result)
+        return result
+
+
+    def _lookup(self, query : str) -> str:
+        '''
+        Answers the query from the cache or sends it to the resolver,
+        returning None if resolution failed
+
+        @Keyword arguments:
+        query(str): The DNS query to resolve
+        '''
+        started = self._metrics.start(self._record_type)
+        outcome = 'CACHED'
+        try:
+            records = self._cached_records(query)
+            if records is None:
+                outcome = 'NOERROR'
+                answer = self._query(query)
+                records = self._store_records(query, answer)
+            result = self.parse_answer(records)
+            self._failures.pop(query, None)
+            return result
         except Exception as e:
-            self._resolution_failed_counter += 1
+            outcome = self._metrics.classify(e)
+            self._record_failure(query, outcome)
             return None
+        finally:
+            self._metrics.finish(self._record_type, started, outcome)
+
+
+    async def resolve_async(self, query : str) -> str:
+        '''
+        Asyncio counterpart of resolve, used by the 'async' engine.
+        Concurrent calls for the same query await the first caller's lookup.
+
+        @Keyword arguments:
+        query(str): The DNS query to resolve
+        '''
+        pending = self._async_inflight.get(query)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        pending = self._async_inflight[query] = asyncio.get_running_loop().create_future()
+        result = None
+        try:
+            result = await self._lookup_async(query)
+        finally:
+            del self._async_inflight[query]
+            pending.set_result(result)
+        return result
+
+
+    async def _lookup_async(self, query : str) -> str:
+        '''
+        Asyncio counterpart of _lookup
+
+        @Keyword arguments:
+        query(str): The DNS query to resolve
+        '''
+        started = self._metrics.start(self._record_type)
+        outcome = 'CACHED'
+        try:
+            records = self._cached_records(query)
+            if records is None:
+                outcome = 'NOERROR'
+                answer = await self._query_async(query)
+                records = self._store_records(query, answer)
+            result = self.parse_answer(records)
+            self._failures.pop(query, None)
+            return result
+        except Exception as e:
+            outcome = self._metrics.classify(e)
+            self._record_failure(query, outcome)
+            return None
+        finally:
+            self._metrics.finish(self._record_type, started, outcome)
+
+
+    def _query(self, query : str) -> dns.resolver.Answer:
+        '''
+        Sends the query upstream, holding a slot of the upstream's adaptive window if there is a controller
+
+        @Keyword arguments:
+        query(str): The DNS query to send
+        '''
+        if self._controller is None:
+            return self._upstreams.resolve(query, self._record_type)
+        limiter = self._controller.limiter_for(query)
+        limiter.acquire()
+        started = time.perf_counter()
+        outcome = 'NOERROR'
+        try:
+            return self._upstreams.resolve(query, self._record_type)
+        except Exception as e:
+            outcome = self._metrics.classify(e)
+            raise
+        finally:
+            limiter.release(outcome, time.perf_counter() - started)
+
+
+    async def _query_async(self, query : str) -> dns.resolver.Answer:
+        '''
+        Asyncio counterpart of _query
+
+        @Keyword arguments:
+        query(str): The DNS query to send
+        '''
+        if self._controller is None:
+            return await self._upstreams.resolve_async(query, self._record_type)
+        limiter = self._controller.limiter_for(query)
+        await limiter.acquire_async()
+        started = time.perf_counter()
+        outcome = 'NOERROR'
+        try:
+            return await self._upstreams.resolve_async(query, self._record_type)
+        except Exception as e:
+            outcome = self._metrics.classify(e)
+            raise
+        finally:
+            limiter.release(outcome, time.perf_counter() - started)
+
+
+    def _cached_records(self, query : str) -> List[str]:
+        '''
+        Returns the cached records for the query, or None on a cache miss
+
+        @Keyword arguments:
+        query(str): The DNS query to look up
+        '''
+        if self._cache is None:
+            return None
+        records = self._cache.get(query, self._record_type)
+        with self._failed_counter_lock:
+            if records is None:
+                self._cache_misses += 1
+            else:
+                self._cache_hits += 1
+        return records
+
+
+    def _store_records(self, query : str, answer : dns.resolver.Answer) -> List[str]:
+        '''
+        Converts an answer into the text of its records and stores them in the cache
+
+        @Keyword arguments:
+        query(str): The DNS query that was resolved
+        answer(dns.resolver.Answer): The answer returned by the resolver
+        '''
+        records = [str(a) for a in answer]
+        if self._cache is not None:
+            self._cache.put(query, self._record_type, records, answer.rrset.ttl)
+        self._harvest_additional(answer)
+        return records
+
+
+    def _given_up(self, query : str) -> str:
+        '''
+        Called for every query that still failed once its retries were given up on, so a subclass
+        can keep the part of its answer that did resolve. Returns None, the query failed, by default.
+
+        @Keyword arguments:
+        query(str): The DNS query that failed
+        '''
+        return None
+
+
+    def _harvest_additional(self, answer : dns.resolver.Answer):
+        '''
+        Called with every answer received from upstream, so a subclass can keep
+        records from its additional section. Does nothing by default.
+
+        @Keyword arguments:
+        answer(dns.resolver.Answer): The answer returned by the resolver
+        '''
+        pass
+
+
+    def _count_failures(self, count : int = 1):
+        '''
+        Thread-safe increment of the failed resolutions counter
+
+        @Keyword arguments:
+        count(int): Number of failed resolutions to add
+        '''
+        with self._failed_counter_lock:
+            self._resolution_failed_counter += count
+
+
+    def _record_failure(self, query : str, outcome : str):
+        '''
+        Remembers the outcome of a failed query, and when it first failed
+
+        @Keyword arguments:
+        query(str): The DNS query that failed
+        outcome(str): Outcome of the query, as classified by ResolverMetrics
+        '''
+        with self._failed_counter_lock:
+            previous = self._failures.get(query, None)
+            self._failures[query] = (outcome, time.monotonic() if previous is None else previous[1])
+
+
+    def _record_stage_failure(self, stem : str, key : str, reason : str):
+        '''
+        Records why a key is missing from a stage output, written next to it by write_stage
+
+        @Keyword arguments:
+        stem(str): Name of the stage output
+        key(str): The key that failed
+        reason(str): Why it failed, e.g. NXDOMAIN
+        '''
+        with self._failed_counter_lock:
+            self._stage_failures.setdefault(stem, {})[key] = reason
+
+
+    def __retry_at(self, query : str, attempts : int) -> float:
+        '''
+        Private function returning when to retry a failed query, or None to give up on it
+
+        @Keyword arguments:
+        query(str): The DNS query that failed
+        attempts(int): Number of attempts made so far
+        '''
+        if self._retry_policy is None or query not in self._failures:
+            return None
+        outcome, first_failed = self._failures[query]
+        return self._retry_policy.retry_at(outcome, attempts, first_failed)
+
+
+    def __retry_failed(self, executor : ThreadPoolExecutor, queries : List[str], results : List,
+                       on_result : Callable[[int, str], None] = None):
+        '''
+        Private function that retries transient failures at the tail of a stage,
+        submitting each one to the pool once its backoff is due
+
+        @Keyword arguments:
+        executor(ThreadPoolExecutor): Pool the stage ran on
+        queries(List[str]): The DNS queries of the stage
+        results(List): Results of the stage, updated in place
+        on_result(Callable): Optional callback receiving (index, result) as soon as a retry succeeds
+        '''
+        scheduler = RetryScheduler()
+        for index, result in enumerate(results):
+            retry_at = self.__retry_at(queries[index], 1) if result is None else None
+            if retry_at is not None:
+                scheduler.defer(retry_at, index, 1)
+
+        running : Dict[Future, Tuple[int, int]] = {}
+        while scheduler or running:
+            for index, attempts in scheduler.pop_due():
+                running[executor.submit(self.resolve, queries[index])] = (index, attempts + 1)
+            if not running:
+                time.sleep(scheduler.seconds_until_due())
+                continue
+            done, _ = wait(running, timeout=scheduler.seconds_until_due(), return_when=FIRST_COMPLETED)
+            for future in done:
+                index, attempts = running.pop(future)
+                results[index] = future.result()
+                if results[index] is not None:
+                    if on_result is not None:
+                        on_result(index, results[index])
+                    continue
+                retry_at = self.__retry_at(queries[index], attempts)
+                if retry_at is not None:
+                    scheduler.defer(retry_at, index, attempts)
+
+
+    async def _retry_async(self, query : str, resolve_once : Callable[[], Awaitable[str]]) -> str:
+        '''
+        Retries a failed query with backoff until it succeeds or the retry policy gives up on it
+
+        @Keyword arguments:
+        query(str): The DNS query that failed once
+        resolve_once(Callable): Makes one attempt at the query, returning None on failure
+        '''
+        attempts = 1
+        while True:
+            retry_at = self.__retry_at(query, attempts)
+            if retry_at is None:
+                return None
+            await asyncio.sleep(retry_at - time.monotonic())
+            result = await resolve_once()
+            attempts += 1
+            if result is not None:
+                return result
+
+
+    def get_metrics(self) -> ResolverMetrics:
+        '''Gets the instrumentation this resolver records into'''
+        return self._metrics
+
+
+    def get_cache_counters(self) -> Tuple[int, int]:
+        '''Gets the number of cache hits and misses of this resolver'''
+        with self._failed_counter_lock:
+            return self._cache_hits, self._cache_misses
+
+
+    def get_failure(self, query : str) -> str:
+        '''
+        Gets the outcome of the last attempt at a query that has not succeeded since, None if it did not fail
+
+        @Keyword arguments:
+        query(str): The DNS query
+        '''
+        with self._failed_counter_lock:
+            failure = self._failures.get(query, None)
+        return None if failure is None else failure[0]
+
+
+    def resolve_all(self, queries : List[str], on_result : Callable[[int, str], None] = None) -> List:
+        '''
+        Resolves every query with the configured engine,
+        returning results in the same order as the queries
+
+        @Keyword arguments:
+        queries(List[str]): The DNS queries to resolve
+        on_result(Callable): Optional callback receiving (index, result) as soon as each query completes
+        '''
+        if self._engine == 'async':
+            results = asyncio.run(self.__resolve_all_async(queries, on_result))
+        else:
+            def resolve_and_report(indexed_query):
+                index, query = indexed_query
+                result = self.resolve(query)
+                if on_result is not None:
+                    on_result(index, result)
+                return result
+
+            # with a controller, the adaptive windows bound the in-flight queries instead of the pool size
+            max_workers = self._max_threads if self._controller is None else max(self._max_threads, self._concurrency)
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                results = list(executor.map(resolve_and_report, enumerate(queries)))
+                self.__retry_failed(executor, queries, results, on_result)
+        for index, query in enumerate(queries):
+            if results[index] is None:
+                results[index] = self._given_up(query)
+                if results[index] is not None and on_result is not None:
+                    on_result(index, results[index])
+        self._count_failures(sum(result is None for result in results))
+        if self._cache is not None:
+            self._cache.commit()
+        return results
+
+
+    async def __resolve_all_async(self, queries : List[str], on_result : Callable[[int, str], None] = None) -> List:
+        '''
+        Private function that keeps up to self._concurrency queries in flight
+        by running that many workers over a shared iterator of queries
+
+        @Keyword arguments:
+        queries(List[str]): The DNS queries to resolve
+        on_result(Callable): Optional callback receiving (index, result) as soon as each query completes
+        '''
+        results : List = [None] * len(queries)
+        pending = iter(enumerate(queries))
+        rate_limiter = RateLimiter(self._rate_limit)
+
+        async def worker():
+            for index, query in pending:
+                await rate_limiter.acquire()
+                results[index] = await self.resolve_async(query)
+                if on_result is not None:
+                    on_result(index, results[index])
+
+        workers = min(self._concurrency, len(queries))
+        await asyncio.gather(*(worker() for _ in range(workers)))
+
+        # Transient failures are retried at the tail of the stage, each sleeping out its own backoff
+        semaphore = asyncio.Semaphore(self._concurrency)
+
+        async def resolve_once(query):
+            async with semaphore:
+                await rate_limiter.acquire()
+                return await self.resolve_async(query)
+
+        async def retry(index):
+            results[index] = await self._retry_async(queries[index], lambda: resolve_once(queries[index]))
+            if results[index] is not None and on_result is not None:
+                on_result(index, results[index])
+
+        await asyncio.gather(*(retry(index) for index, result in enumerate(results) if result is None))
+        return results
+
+
+    def resolve_journaled(self, stem : str, keys : List[str], queries : List[str]) -> List:
+        '''
+        Resolves the query of every key that is not already in the run journal,
+        journaling each result as soon as it completes. Returns results in key order,
+        recording why every key that failed was given up on.
+
+        @Keyword arguments:
+        stem(str): Name of the stage output the results belong to
+        keys(List[str]): The keys being resolved, e.g. domains or IPs
+        queries(List[str]): The DNS query of each key
+        '''
+        if self._journal is None:
+            results = self.resolve_all(queries)
+        else:
+            resolved = self._journal.load(stem)
+            pending = [index for index, key in enumerate(keys) if key not in resolved]
+            self.resolve_all(
+                [queries[index] for index in pending],
+                on_result = lambda index, result: self._journal.record(stem, keys[pending[index]], result)
+            )
+            results = [resolved.get(key, None) for key in keys]
+        for key, query, result in zip(keys, queries, results):
+            if result is None:
+                self._record_stage_failure(stem, key, self._failures.get(query, ('unknown',))[0])
+        return results
+
+
+    def resolve_journaled_bulk(self, stem : str, keys : List[str],
+                               lookup : Callable[[List[str]], Tuple[Dict[str, str], Dict[str, str]]]) -> List:
+        '''
+        Counterpart of resolve_journaled for backends that answer a whole list of keys at once,
+        such as CymruWhoisClient. Keys already in the run journal are not looked up again.
+
+        @Keyword arguments:
+        stem(str): Name of the stage output the results belong to
+        keys(List[str]): The keys being resolved
+        lookup(Callable): Returns the answer of every key it resolved, and why every other key failed
+        '''
+        resolved = self._journal.load(stem) if self._journal is not None else {}
+        pending = [key for key in keys if key not in resolved]
+        answers, failures = lookup(pending) if pending else ({}, {})
+        if self._journal is not None:
+            for key in pending:
+                self._journal.record(stem, key, answers.get(key, None))
+        results = [resolved.get(key, answers.get(key, None)) for key in keys]
+        for key, result in zip(keys, results):
+            if result is None:
+                self._record_stage_failure(stem, key, failures.get(key, 'unknown'))
+        self._count_failures(sum(result is None for result in results))
+        return results
+
+
+    async def resolve_journaled_async(self, stem : str, key : str, query : str, rate_limiter : RateLimiter = None,
+                                      in_flight : asyncio.Semaphore = None,
+                                      defer : Callable[[Awaitable[str]], None] = None) -> str:
+        '''
+        Asyncio counterpart of resolve_journaled for a single key. A rate limiter token and an in-flight
+        permit are taken for every attempt, so a key sleeping out a retry backoff holds neither.
+
+        @Keyword arguments:
+        stem(str): Name of the stage output the result belongs to
+        key(str): The key being resolved
+        query(str): The DNS query of the key
+        rate_limiter(RateLimiter): Optional cap on the queries sent per second, shared with other lookups
+        in_flight(asyncio.Semaphore): Optional bound on the lookups in flight, shared with other lookups
+        defer(Callable): Optional, receives the retries of a key whose first attempt failed as an awaitable
+        of the final result, and None is returned right away instead of waiting for them
+        '''
+        if self._journal is not None:
+            resolved = self._journal.load(stem)
+            if key in resolved:
+                return resolved[key]
+
+        async def resolve_once() -> str:
+            if rate_limiter is not None:
+                await rate_limiter.acquire()
+            if in_flight is None:
+                return await self.resolve_async(query)
+            async with in_flight:
+                return await self.resolve_async(query)
+
+        async def finish(result : str) -> str:
+            if result is None:
+                result = await self._retry_async(query, resolve_once)
+            if result is None:
+                result = self._given_up(query)
+            if result is None:
+                self._count_failures()
+                self._record_stage_failure(stem, key, self._failures.get(query, ('unknown',))[0])
+            if self._journal is not None:
+                self._journal.record(stem, key, result)
+            return result
+
+        result = await resolve_once()
+        if result is None and defer is not None:
+            defer(finish(result))
+            return None
+        return await finish(result)
+
 
-    
     def drop_failed_resolutions(self, domain_pairs: List[tuple]) -> List[tuple]:
         '''
         Helper function to drop any failed resolutions 
@@ -62,14 +642,7 @@ class DNSResolver:
         output_file_name(str): Name of requested file to unpack
         limit(int): Number of lines to read and store
         '''
-        results : List[str] = []
-        with open(output_file_name, 'r', newline='') as csvfile:
-            csvreader = csv.reader(csvfile)
-            for i, row in enumerate(csvreader):
-                if i >= limit: 
-                    break
-                results.append(row[1])
-        return results
+        return list(TrancoList(output_file_name, last_rank = limit).domains())
 
     
     def read_json(self, output_file_name : str) -> Dict:
@@ -81,4 +654,43 @@ class DNSResolver:
         '''
         with open(output_file_name, 'r') as jsonfile:
             data = json.load(jsonfile)
-        return data
\ No newline at end of file
+        return data
+
+    
+    def read_stage(self, stem : str) -> Dict:
+        '''
+        Reads the output of a previous stage. Unless only JSON is written,
+        the columnar layout is memory-mapped instead of parsing JSON.
+        
+        @Keyword arguments:
+        stem(str): Name of the stage output, e.g. domains_nameservers
+        '''
+        if self._output_format == 'json':
+            return self.read_json(f'outputs/{stem}.json')
+        # NumPy is only imported for the columnar layout
+        from .columnar_store import ColumnarStore
+        return ColumnarStore(stem)
+
+    
+    def write_stage(self, stem : str, output : Dict, scalar : bool, resolved : bool = True):
+        '''
+        Writes the output of a stage in the configured layout(s), and for a stage
+        that resolves keys the reason every failed key is missing from it to outputs/<stem>_failures.json
+        
+        @Keyword arguments:
+        stem(str): Name of the stage output, e.g. domains_nameservers
+        output(Dict): The stage output
+        scalar(bool): Whether each key maps to a single value instead of a list
+        resolved(bool): Whether the keys were resolved, False for outputs harvested along the way like nameserver_glue
+        '''
+        if self._output_format != 'columnar':
+            with open(f'outputs/{stem}.json', 'w') as jsonfile:
+                json.dump(output, jsonfile, indent=4)
+        if self._output_format != 'json':
+            from .columnar_store import write_columnar
+            write_columnar(stem, output, scalar)
+        if resolved:
+            with open(f'outputs/{stem}_failures.json', 'w') as jsonfile:
+                json.dump(self._stage_failures.get(stem, {}), jsonfile, indent=4)
+        if self._journal is not None:
+            self._journal.complete(stem)
@@ -0,0 +1,200 @@
+import os
+from scripts import (
+    PrefixTable, CymruWhoisClient, TrancoList, json, NameserverResolver, IPResolver, ASNResolver, AS_ORG_Resolver
+)
+from .columnar_store import ColumnarStore
+from typing import Callable, List, Dict
+
+'''
+INCREMENTAL MODE OF RESEARCH
+Re-measures a new Tranco snapshot against the outputs of a previous run. Only domains that are new
+(or whose cached NS answer expired) are resolved, and only nameservers, IPs and ASNs missing from the
+previous run are looked up. Every unchanged domain -> nameserver -> IP -> ASN -> organization chain is reused.
+'''
+class IncrementalResolver:
+    def __init__(self, previous_directory : str, entry_limit : int = 10000, max_threads : int = 25,
+                 prefix_table : PrefixTable = None, offline : bool = False, whois : CymruWhoisClient = None,
+                 tranco : TrancoList = None, **resolver_options):
+        '''
+        @Keyword arguments:
+        previous_directory(str): outputs directory of the previous run, with JSON or columns/ stage outputs
+        entry_limit(int): Number of Tranco records to resolve from outputs/top-1m.csv
+        max_threads(int): Passed through to each stage resolver
+        prefix_table(PrefixTable): offline prefix -> origin table consulted before team-cymru
+        offline(bool): never query team-cymru for IP -> ASN
+        whois(CymruWhoisClient): look IPs and ASNs up in bulk over team-cymru's whois interface
+        tranco(TrancoList): the list and rank range to resolve instead of the top entry_limit records
+        resolver_options: engine options shared by every stage resolver
+        '''
+        self._nameserver_resolver = NameserverResolver(entry_limit, max_threads, tranco, **resolver_options)
+        self._ip_resolver = IPResolver(max_threads, **resolver_options)
+        self._asn_resolver = ASNResolver(max_threads, prefix_table, offline, whois, **resolver_options)
+        self._as_org_resolver = AS_ORG_Resolver(max_threads, whois, **resolver_options)
+        # glue from the NS answers of Step 1 saves the lookups of the record types it covers
+        self._ip_resolver.use_glue(self._nameserver_resolver.glue_for)
+        self._previous_directory = previous_directory
+        self._entry_limit = entry_limit
+        self._offline = offline
+        self._cache = resolver_options.get('cache', None)
+        self._report : Dict = {'domains': {}, 'stages': {}}
+
+
+    def __read_previous(self, stem : str) -> Dict:
+        '''
+        Private function reading a stage output of the previous run, in whichever layout it was written
+
+        @Keyword arguments:
+        stem(str): Name of the stage output, e.g. domains_nameservers
+        '''
+        json_path = os.path.join(self._previous_directory, f'{stem}.json')
+        if os.path.exists(json_path):
+            return self._nameserver_resolver.read_json(json_path)
+        return dict(ColumnarStore(stem, directory = os.path.join(self._previous_directory, 'columns')).items())
+
+
+    def __is_fresh(self, domain : str) -> bool:
+        '''
+        Private function checking whether the previous NS answer of a domain is still valid.
+        Without a resolution cache there is no TTL to go by, so previous answers are always reused.
+
+        @Keyword arguments:
+        domain(str): The domain to check
+        '''
+        if self._cache is None:
+            return True
+        return self._cache.get(domain, 'NS') is not None
+
+
+    def __reuse_or_resolve(self, stem : str, resolver, keys : List[str], previous : Dict,
+                           to_query : Callable, clean : Callable, local_lookup : Callable = None,
+                           query_missing : bool = True) -> Dict:
+        '''
+        Private function that reuses every key of the previous run and resolves the rest
+
+        @Keyword arguments:
+        stem(str): Name of the stage output
+        resolver(DNSResolver): The stage resolver
+        keys(List[str]): Every key the new snapshot needs
+        previous(Dict): The stage output of the previous run
+        to_query(Callable): Turns a key into its DNS query
+        clean(Callable): Turns a raw resolution into the stored value
+        local_lookup(Callable): Optional offline lookup tried before querying, returning None on a miss
+        query_missing(bool): Whether keys missing locally are queried at all
+        '''
+        missing = [key for key in keys if key not in previous]
+        found = {}
+        if local_lookup is not None:
+            found = {key: value for key, value in ((key, local_lookup(key)) for key in missing) if value is not None}
+        if query_missing:
+            unresolved = [key for key in missing if key not in found]
+            results = resolver.resolve_journaled(stem, unresolved, [to_query(key) for key in unresolved])
+            found.update({key: clean(result) for key, result in zip(unresolved, results) if result is not None})
+        self._report['stages'][stem] = {
+            'reused': len(keys) - len(missing),
+            'resolved': len(found),
+            'failed': len(missing) - len(found)
+        }
+        output = {}
+        for key in keys:
+            if key in previous:
+                output[key] = previous[key]
+            elif key in found:
+                output[key] = found[key]
+        resolver.write_stage(stem, output, scalar = stem == 'asn_to_org_mapping')
+        return output
+
+
+    def execute_incremental_resolution(self) -> Dict[str, int]:
+        '''
+        Executes Steps 1 through 3.5 incrementally against the previous run,
+        writes the full stage outputs for the new snapshot and returns the failed resolutions per stage
+        '''
+        previous_domains = self.__read_previous('domains_nameservers')
+        self._nameserver_resolver.load_journaled_glue()
+        domains = list(self._nameserver_resolver.read_domains())
+
+        # Step 1: only new domains and domains whose cached NS answer expired are resolved
+        stale_domains = [domain for domain in domains if domain not in previous_domains or not self.__is_fresh(domain)]
+        results = self._nameserver_resolver.resolve_journaled('domains_nameservers', stale_domains, stale_domains)
+        resolved = {domain: nameservers for domain, nameservers in zip(stale_domains, results) if nameservers is not None}
+        domains_to_nameservers : Dict[str, List[str]] = {}
+        for domain in domains:
+            # an expired domain that fails to re-resolve keeps its previous answer
+            nameservers = resolved.get(domain, previous_domains.get(domain, None))
+            if nameservers is not None:
+                domains_to_nameservers[domain] = nameservers
+        self._nameserver_resolver.write_stage('domains_nameservers', domains_to_nameservers, scalar = False)
+        # glue of the nameservers of the resolved domains, journaled as it is harvested, like Step 1 writes it
+        self._nameserver_resolver.write_stage('nameserver_glue', self._nameserver_resolver.get_glue(), scalar = False, resolved = False)
+
+        snapshot = set(domains)
+        self._report['domains'] = {
+            'added': [domain for domain in domains if domain not in previous_domains],
+            'removed': [domain for domain in previous_domains if domain not in snapshot],
+            'nameservers_changed': [
+                domain for domain, nameservers in resolved.items()
+                if domain in previous_domains and set(nameservers) != set(previous_domains[domain])
+            ]
+        }
+        self._report['stages']['domains_nameservers'] = {
+            'reused': len(domains_to_nameservers) - len(resolved),
+            'resolved': len(resolved),
+            'failed': len(stale_domains) - len(resolved)
+        }
+
+        # Steps 2 through 3.5: only keys the previous run never resolved are looked up
+        nameservers = list(dict.fromkeys(ns for nss in domains_to_nameservers.values() for ns in nss))
+        # earlier runs kept a single IPv4 address per nameserver
+        previous_ips = {
+            nameserver: [ips] if isinstance(ips, str) else ips
+            for nameserver, ips in self.__read_previous('nameserver_ips').items()
+        }
+        nameservers_to_ips = self.__reuse_or_resolve(
+            'nameserver_ips', self._ip_resolver, nameservers, previous_ips,
+            to_query = lambda nameserver: nameserver, clean = lambda ips: ips,
+            # only glue covering both A and AAAA answers a nameserver, the IP resolver looks up what the rest lacks
+            local_lookup = self._ip_resolver.full_glue
+        )
+        ips = self._asn_resolver.unique_ips(nameservers_to_ips.values())
+        ips_to_asns = self.__reuse_or_resolve(
+            'ip_to_asn_mapping', self._asn_resolver, ips, self.__read_previous('ip_to_asn_mapping'),
+            to_query = self._asn_resolver.ip_to_query, clean = self._asn_resolver.clean_for_asn_number,
+            local_lookup = self._asn_resolver.lookup_prefix_table, query_missing = not self._offline
+        )
+        asns = list(dict.fromkeys(asn for asn_list in ips_to_asns.values() for asn in asn_list))
+        self.__reuse_or_resolve(
+            'asn_to_org_mapping', self._as_org_resolver, asns, self.__read_previous('asn_to_org_mapping'),
+            to_query = self._as_org_resolver.asn_to_query, clean = self._as_org_resolver.clean_for_organization
+        )
+        if self._cache is not None:
+            self._cache.commit()
+
+        return {stem: stage['failed'] for stem, stage in self._report['stages'].items()}
+
+
+    def write_delta_report(self):
+        '''
+        Writes outputs/delta_report.json: domains added, removed or with changed nameservers,
+        how many keys each stage reused or resolved, and how each organization's unreachable and
+        affected counts moved between the previous results.json and the new one
+        '''
+        results_path = os.path.join(self._previous_directory, 'results.json')
+        previous_results = self._nameserver_resolver.read_json(results_path) if os.path.exists(results_path) else {}
+        results = self._nameserver_resolver.read_json('outputs/results.json')
+        organizations : Dict[str, Dict[str, List[int]]] = {}
+        for key in ('top_unreachable_numbers', 'top_affected_numbers'):
+            previous_counts = dict(map(tuple, previous_results.get(key, [])))
+            counts = dict(map(tuple, results.get(key, [])))
+            for organization in dict.fromkeys(list(counts) + list(previous_counts)):
+                organizations.setdefault(organization, {})[key] = [
+                    previous_counts.get(organization, None), counts.get(organization, None)
+                ]
+
+        report = dict(self._report)
+        report['results'] = {
+            'inbailwick_result': [previous_results.get('inbailwick_result', None), results['inbailwick_result']],
+            'inbailwick_partial_percent': [previous_results.get('inbailwick_partial_percent', None), results['inbailwick_partial_percent']],
+            'organizations': organizations
+        }
+        with open('outputs/delta_report.json', 'w') as jsonfile:
+            json.dump(report, jsonfile, indent=4)
@@ -1,34 +1,227 @@
-from scripts import DNSResolver, ThreadPoolExecutor, json
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, List, Dict, Tuple
+from scripts import DNSResolver, DependencyGraph, TRANSIENT_OUTCOMES
 
 '''
 STEP 2 OF RESEARCH
-Convert Name Server --> IP Address
+Convert Name Server --> IP Addresses
+Every A and AAAA record of a nameserver is kept, both record types are looked up side by side.
+When the A or AAAA lookup of a nameserver fails transiently, the nameserver is retried instead of silently
+keeping the addresses of only one record type. The record type that succeeded is kept, so a retry only
+looks up the one that failed, and if retries give up the nameserver keeps the addresses it got.
+Glue from Step 1 answers the record types it covers, only the others are looked up.
 '''
 class IPResolver(DNSResolver):
-    def __init__(self, max_threads : int = 25):
-        super().__init__(record_type = 'A')
-        self._max_threads = max_threads
+    def __init__(self, max_threads : int = 25, **resolver_options):
+        super().__init__(record_type = 'A', max_threads = max_threads, **resolver_options)
+        # Shares the cache, metrics, upstreams and controller, but not the journal: results are journaled per nameserver
+        ipv6_options = dict(resolver_options, journal = None)
+        self._ipv6_resolver = DNSResolver(record_type = 'AAAA', max_threads = max_threads, **ipv6_options)
+        self._ipv6_executor : ThreadPoolExecutor = None
+        self._glue_for : Callable[[str], List[str]] = None
+        self._glue_counter = 0
+        # IPv4 and IPv6 addresses of nameservers whose other record type failed transiently, None for that one
+        self._partial : Dict[str, Tuple[List[str], List[str]]] = {}
+        self._partial_lock = threading.Lock()
+        self._partial_counter = 0
+
+
+    def use_glue(self, glue_for : Callable[[str], List[str]]):
+        '''
+        Answers the record types covered by the glue of a nameserver from its glue instead of looking them up
+
+        @Keyword arguments:
+        glue_for(Callable): Returns the IPv4 and IPv6 glue of a nameserver, None if it came without glue
+        '''
+        self._glue_for = glue_for
+
+
+    def __split_glue(self, query : str) -> Tuple[List[str], List[str]]:
+        '''
+        Private function returning the IPv4 and the IPv6 glue of a nameserver, each empty if the glue lacks it
+
+        @Keyword arguments:
+        query(str): The nameserver
+        '''
+        glue = (self._glue_for(query) if self._glue_for is not None else None) or []
+        return [ip for ip in glue if ':' not in ip], [ip for ip in glue if ':' in ip]
+
+
+    def full_glue(self, nameserver : str) -> List[str]:
+        '''
+        Gets the glue of a nameserver if it covers both A and AAAA, so neither has to be looked up, else None
+
+        @Keyword arguments:
+        nameserver(str): The nameserver
+        '''
+        ipv4, ipv6 = self.__split_glue(nameserver)
+        return ipv4 + ipv6 if ipv4 and ipv6 else None
+
+
+    def __known(self, query : str) -> Tuple[List[str], List[str]]:
+        '''
+        Private function returning the IPv4 and IPv6 addresses of a nameserver that need no lookup,
+        from its glue or kept from an earlier attempt, each None if it has to be looked up
+
+        @Keyword arguments:
+        query(str): The nameserver
+        '''
+        ipv4_glue, ipv6_glue = self.__split_glue(query)
+        with self._partial_lock:
+            ipv4_kept, ipv6_kept = self._partial.get(query, (None, None))
+        return ipv4_glue or ipv4_kept, ipv6_glue or ipv6_kept
+
+
+    def __combine(self, query : str, ipv4 : List[str], ipv6 : List[str]) -> List[str]:
+        '''
+        Private function joining the addresses of both record types,
+        None if the nameserver has none or either lookup failed transiently, keeping the other one for a retry
+
+        @Keyword arguments:
+        query(str): The nameserver that was resolved
+        ipv4(List[str]): Addresses of the A records, None if the lookup failed
+        ipv6(List[str]): Addresses of the AAAA records, None if the lookup failed
+        '''
+        outcomes = [
+            resolver.get_failure(query) if addresses is None else None
+            for addresses, resolver in ((ipv4, self), (ipv6, self._ipv6_resolver))
+        ]
+        transient = [outcome in TRANSIENT_OUTCOMES for outcome in outcomes]
+        if any(transient):
+            with self._partial_lock:
+                self._partial[query] = (None if transient[0] else ipv4 or [], None if transient[1] else ipv6 or [])
+            # recorded as a failure of this resolver, whose retries and failure report cover the nameserver
+            self._record_failure(query, next(outcome for outcome, failed in zip(outcomes, transient) if failed))
+            return None
+        with self._partial_lock:
+            self._partial.pop(query, None)
+        with self._failed_counter_lock:
+            self._failures.pop(query, None)
+        addresses = (ipv4 or []) + (ipv6 or [])
+        return addresses if addresses else None
+
+
+    def _given_up(self, query : str) -> List[str]:
+        '''
+        Keeps the addresses of the record type that succeeded for a nameserver whose other record type
+        kept failing transiently until its retries were given up on, None if it has none
+
+        @Keyword arguments:
+        query(str): The nameserver
+        '''
+        with self._partial_lock:
+            ipv4, ipv6 = self._partial.pop(query, (None, None))
+            addresses = (ipv4 or []) + (ipv6 or [])
+            if addresses:
+                self._partial_counter += 1
+        return addresses if addresses else None
+
+
+    def resolve(self, query : str) -> List[str]:
+        '''
+        Resolves every IPv4 and IPv6 address of a nameserver, the AAAA lookup running
+        on a second pool while resolve_all is running
+
+        @Keyword arguments:
+        query(str): The nameserver to resolve
+        '''
+        ipv4, ipv6 = self.__known(query)
+        if ipv6 is not None or ipv4 is not None or self._ipv6_executor is None:
+            ipv4 = ipv4 if ipv4 is not None else super().resolve(query)
+            return self.__combine(query, ipv4, ipv6 if ipv6 is not None else self._ipv6_resolver.resolve(query))
+        ipv6 = self._ipv6_executor.submit(self._ipv6_resolver.resolve, query)
+        return self.__combine(query, super().resolve(query), ipv6.result())
+
+
+    async def resolve_async(self, query : str) -> List[str]:
+        '''
+        Asyncio counterpart of resolve
+
+        @Keyword arguments:
+        query(str): The nameserver to resolve
+        '''
+        async def known_or(known : List[str], resolve_async : Callable[[str], Awaitable[List[str]]]) -> List[str]:
+            return known if known is not None else await resolve_async(query)
+
+        ipv4, ipv6 = self.__known(query)
+        ipv4, ipv6 = await asyncio.gather(
+            known_or(ipv4, super().resolve_async), known_or(ipv6, self._ipv6_resolver.resolve_async)
+        )
+        return self.__combine(query, ipv4, ipv6)
+
+
+    def resolve_all(self, queries : List[str], on_result : Callable[[int, List[str]], None] = None) -> List:
+        '''
+        Resolves every nameserver with the configured engine, giving the thread engine
+        a second pool of the same size for the AAAA lookups
+
+        @Keyword arguments:
+        queries(List[str]): The nameservers to resolve
+        on_result(Callable): Optional callback receiving (index, result) as soon as each query completes
+        '''
+        if self._engine == 'async':
+            return super().resolve_all(queries, on_result)
+        max_workers = self._max_threads if self._controller is None else max(self._max_threads, self._concurrency)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            self._ipv6_executor = executor
+            try:
+                return super().resolve_all(queries, on_result)
+            finally:
+                self._ipv6_executor = None
+
+
+    def read_glue(self) -> Dict[str, List[str]]:
+        '''Reads the glue harvested by Nameserver Resolution, empty if it was run without harvesting any'''
+        try:
+            return dict(self.read_stage('nameserver_glue').items())
+        except FileNotFoundError:
+            return {}
+
+
+    def get_glue_counter(self) -> int:
+        '''Gets the number of nameservers answered from glue instead of queried'''
+        return self._glue_counter
+
+
+    def get_partial_counter(self) -> int:
+        '''Gets the number of nameservers kept with the addresses of only the record type that did not keep failing'''
+        with self._partial_lock:
+            return self._partial_counter
+
+
+    def get_cache_counters(self) -> Tuple[int, int]:
+        '''Gets the number of cache hits and misses of the A and AAAA lookups'''
+        hits, misses = super().get_cache_counters()
+        ipv6_hits, ipv6_misses = self._ipv6_resolver.get_cache_counters()
+        return hits + ipv6_hits, misses + ipv6_misses
+
 
-    
     def execute_ip_resolution(self):
         '''Executes IP Resolution from results of Nameserver Resolution'''
-        # cleans output of json so we just have list of nameservers.
-        nameservers : List[List[str]] = list(self.read_json(output_file_name = 'outputs/domains_nameservers.json').values())
+        # interns the nameservers of Step 1 into the unique nameservers, keeping first-seen order,
+        # since popular nameservers are shared by thousands of domains.
+        unique_nameservers : List[str] = DependencyGraph.from_outputs([self.read_stage('domains_nameservers')]).names('nameserver')
 
-        # flattens the space of nameservers so we have one giant list of all nameservers.
-        flattened_nameservers : List[str] = [ns for sublist in nameservers for ns in sublist]
+        # nameservers that came with A and AAAA glue in Step 1 are not queried again,
+        # those with glue for only one record type are queried for the other one
+        self.use_glue(self.read_glue().get)
+        missing_nameservers = [nameserver for nameserver in unique_nameservers if self.full_glue(nameserver) is None]
+        self._glue_counter = len(unique_nameservers) - len(missing_nameservers)
 
-        # create thread pool executor to resolve ip of each nameserver
-        with ThreadPoolExecutor(max_workers=self._max_threads) as executor:
-            results = list(executor.map(self.resolve, flattened_nameservers))
+        # resolve ips of every other nameserver with the configured engine
+        results = self.resolve_journaled('nameserver_ips', missing_nameservers, missing_nameservers)
 
         # Clean results of IP resolution from nameservers.
-        cleaned_results = self.drop_failed_resolutions(zip(flattened_nameservers, results))
+        resolved = dict(self.drop_failed_resolutions(zip(missing_nameservers, results)))
 
-        # Create a dictionary from the cleaned results
-        nameserver_to_ip = {nameserver: ip for nameserver, ip in cleaned_results}
+        # Create a dictionary from the glue and cleaned results, in first-seen order
+        nameserver_to_ips = {
+            nameserver: self.full_glue(nameserver) or resolved[nameserver]
+            for nameserver in unique_nameservers if nameserver in resolved or self.full_glue(nameserver)
+        }
 
         # Write to JSON the output of IP resolutions
-        with open('outputs/nameserver_ips.json', 'w') as jsonfile:
-            json.dump(nameserver_to_ip, jsonfile, indent=4)
+        self.write_stage('nameserver_ips', nameserver_to_ips, scalar = False)
         return self._resolution_failed_counter
@@ -1,30 +1,103 @@
-from scripts import DNSResolver, ThreadPoolExecutor, json
+import threading
+from typing import Iterator, List, Dict
+import dns.rdatatype
+import dns.resolver
+from scripts import DNSResolver, TrancoList
 '''
 STEP 1 OF RESEARCH
 Convert Domain name (from top 10k) --> NameServer
+A and AAAA glue for the nameservers in the additional section of each answer is kept as well,
+so Step 2 only has to look up the nameservers that came without glue.
 '''
 class NameserverResolver(DNSResolver):
-    def __init__(self, entry_limit : int = 10000, max_threads : int = 25):
-        super().__init__(record_type = 'NS')
+    def __init__(self, entry_limit : int = 10000, max_threads : int = 25, tranco : TrancoList = None, **resolver_options):
+        super().__init__(record_type = 'NS', max_threads = max_threads, **resolver_options)
         self._entry_limit = entry_limit
-        self._max_threads = max_threads
-    
-    
+        # the top entry_limit domains of outputs/top-1m.csv unless another list or rank range is given
+        self._tranco = tranco if tranco is not None else TrancoList(last_rank = entry_limit)
+        # Addresses of every nameserver that came with glue, by record type
+        self._glue : Dict[str, Dict[str, List[str]]] = {}
+        self._glue_lock = threading.Lock()
+
+
+    def _harvest_additional(self, answer : dns.resolver.Answer):
+        '''
+        Keeps the A and AAAA records of the additional section that belong to a nameserver of the answer,
+        caching them like answers to A and AAAA queries and journaling them with the stage
+
+        @Keyword arguments:
+        answer(dns.resolver.Answer): The NS answer returned by the resolver
+        '''
+        nameservers = {str(rdata) for rdata in answer}
+        for rrset in answer.response.additional:
+            nameserver = str(rrset.name)
+            if rrset.rdtype not in (dns.rdatatype.A, dns.rdatatype.AAAA) or nameserver not in nameservers:
+                continue
+            record_type = dns.rdatatype.to_text(rrset.rdtype)
+            addresses = [str(rdata) for rdata in rrset]
+            with self._glue_lock:
+                glue = self._glue.setdefault(nameserver, {})
+                if glue.get(record_type) == addresses:
+                    continue
+                glue[record_type] = addresses
+                ips = glue.get('A', []) + glue.get('AAAA', [])
+            if self._cache is not None:
+                self._cache.put(nameserver, record_type, addresses, rrset.ttl)
+            if self._journal is not None:
+                self._journal.record('nameserver_glue', nameserver, ips)
+
+
+    def glue_for(self, nameserver : str) -> List[str]:
+        '''
+        Gets the IPv4 and IPv6 glue of a nameserver, None if it came without glue
+
+        @Keyword arguments:
+        nameserver(str): The nameserver, as found in the NS answers
+        '''
+        with self._glue_lock:
+            glue = self._glue.get(nameserver, None)
+            return None if glue is None else glue.get('A', []) + glue.get('AAAA', [])
+
+
+    def get_glue(self) -> Dict[str, List[str]]:
+        '''Gets the IPv4 and IPv6 addresses of every nameserver that came with glue'''
+        with self._glue_lock:
+            return {nameserver: glue.get('A', []) + glue.get('AAAA', []) for nameserver, glue in self._glue.items()}
+
+
+    def load_journaled_glue(self):
+        '''Restores the glue harvested by a resumed run, whose answers are not received again'''
+        if self._journal is None:
+            return
+        with self._glue_lock:
+            for nameserver, ips in self._journal.load('nameserver_glue').items():
+                self._glue.setdefault(nameserver, {
+                    'A': [ip for ip in ips if ':' not in ip], 'AAAA': [ip for ip in ips if ':' in ip]
+                })
+
+
+    def read_domains(self) -> Iterator[str]:
+        '''Lazily yields the domains to resolve from the Tranco list, in rank order'''
+        return self._tranco.domains()
+
+
     def execute_nameserver_resolution(self):
         '''Executes Name Server Resolution'''
         # get top 10k domains from tranco list
-        domains = self.read_csv(output_file_name = 'outputs/top-1m.csv', limit = self._entry_limit)
-        
-        # create thread pool executor to resolve name server for each domain
-        with ThreadPoolExecutor(max_workers=self._max_threads) as executor:
-            results = list(executor.map(self.resolve, domains))
-        
+        domains = list(self.read_domains())
+        self.load_journaled_glue()
+
+        # resolve name server for each domain with the configured engine
+        results = self.resolve_journaled('domains_nameservers', domains, domains)
+
         # We want to clean the results that returned 'None', which happens if error during resolution
         cleaned_results = self.drop_failed_resolutions(zip(domains, results))
 
         # write to JSON the output of our 10k nameserver resolutions.
         output_dict = {domain: nameservers for domain, nameservers in cleaned_results}
-        with open('outputs/domains_nameservers.json', 'w') as jsonfile:
-            json.dump(output_dict, jsonfile, indent=4)
+        self.write_stage('domains_nameservers', output_dict, scalar = False)
+
+        # and the glue of their nameservers, which Step 2 uses instead of querying them
+        self.write_stage('nameserver_glue', self.get_glue(), scalar = False, resolved = False)
 
-        return self._resolution_failed_counter    
\ No newline at end of file
+        return self._resolution_failed_counter
@@ -0,0 +1,230 @@
+import asyncio
+from scripts import (
+    RateLimiter, PrefixTable, CymruWhoisClient, TrancoList, NameserverResolver, IPResolver, ASNResolver, AS_ORG_Resolver
+)
+from typing import Awaitable, Callable, Iterable, List, Dict, Tuple
+
+'''
+STREAMING MODE OF RESEARCH
+Runs Steps 1 through 3.5 at the same time. Each resolved NS set feeds A and AAAA lookups,
+each new IP feeds an ASN lookup and each new ASN feeds an Org lookup through bounded queues.
+With a bulk whois client, IPs and ASNs are instead looked up in bulk once every IP is known.
+'''
+class StreamingPipeline:
+    def __init__(self, entry_limit : int = 10000, max_threads : int = 25, queue_size : int = 10000,
+                 prefix_table : PrefixTable = None, offline : bool = False, whois : CymruWhoisClient = None,
+                 tranco : TrancoList = None, **resolver_options):
+        '''
+        @Keyword arguments:
+        entry_limit(int): Number of Tranco records to resolve
+        max_threads(int): Passed through to each stage resolver
+        queue_size(int): Maximum number of pending items between two stages
+        prefix_table(PrefixTable): offline prefix -> origin table consulted before team-cymru
+        offline(bool): never query team-cymru for IP -> ASN
+        whois(CymruWhoisClient): look IPs and ASNs up in bulk over team-cymru's whois interface
+        tranco(TrancoList): the list and rank range to resolve instead of the top entry_limit records
+        resolver_options: engine options shared by every stage resolver
+        '''
+        self._nameserver_resolver = NameserverResolver(entry_limit, max_threads, tranco, **resolver_options)
+        self._ip_resolver = IPResolver(max_threads, **resolver_options)
+        self._ip_resolver.use_glue(self._nameserver_resolver.glue_for)
+        self._asn_resolver = ASNResolver(max_threads, prefix_table, offline, whois, **resolver_options)
+        self._as_org_resolver = AS_ORG_Resolver(max_threads, whois, **resolver_options)
+        self._whois = whois
+        self._entry_limit = entry_limit
+        self._queue_size = queue_size
+        self._offline = offline
+        self._concurrency = resolver_options.get('concurrency', 1000)
+        self._rate_limit = resolver_options.get('rate_limit', 0)
+        self._cache = resolver_options.get('cache', None)
+
+        # Prep storage variables, filled in as results stream through the stages
+        self._domains : List[str] = []
+        self._domains_to_nameservers : List = []
+        self._nameservers_to_ips : Dict[str, List[str]] = {}
+        self._ips_to_asns : Dict[str, List[str]] = {}
+        self._asns_to_org : Dict[str, str] = {}
+
+
+    async def __stream(self, domains : Iterable[str]):
+        '''
+        Private function that runs all four stages concurrently.
+        Every stage gets self._concurrency workers, but they share one bound of self._concurrency
+        lookups in flight. A key whose first attempt failed is retried in its own task, so its workers
+        move on instead of sleeping out its backoff. A stage only finishes once the stage feeding it has
+        finished, its queue has drained and its retries are done, and the first worker to raise fails
+        the whole pipeline.
+
+        @Keyword arguments:
+        domains(Iterable[str]): Domains to resolve in rank order, pulled lazily as workers free up
+        '''
+        nameserver_queue = asyncio.Queue(maxsize=self._queue_size)
+        ip_queue = asyncio.Queue(maxsize=self._queue_size)
+        asn_queue = asyncio.Queue(maxsize=self._queue_size)
+        rate_limiter = RateLimiter(self._rate_limit)
+        # Held only around each attempt of a lookup, never around a queue put or a retry backoff,
+        # so neither a full queue nor keys waiting to be retried can starve the other lookups
+        in_flight = asyncio.Semaphore(self._concurrency)
+        seen_nameservers, seen_ips, seen_asns = set(), set(), set()
+        self._domains, self._domains_to_nameservers = [], []
+        pending_domains = iter(domains)
+        # retry tasks of every stage, in stage order
+        retries : List[List[asyncio.Task]] = [[], [], [], []]
+
+        def retry_later(stage : int, found : Callable[[str], Awaitable[None]]) -> Callable[[Awaitable[str]], None]:
+            async def retry(retried : Awaitable[str]):
+                await found(await retried)
+            return lambda retried: retries[stage].append(asyncio.create_task(retry(retried)))
+
+        async def lookup(stage : int, resolver, stem : str, key : str, query : str,
+                         found : Callable[[str], Awaitable[None]]):
+            result = await resolver.resolve_journaled_async(
+                stem, key, query, rate_limiter, in_flight, retry_later(stage, found)
+            )
+            if result is not None:
+                await found(result)
+
+        async def resolve_domains():
+            for domain in pending_domains:
+                # slots are taken in rank order, so every domain keeps its rank in the outputs
+                index = len(self._domains)
+                self._domains.append(domain)
+                self._domains_to_nameservers.append(None)
+
+                async def found(nameservers, index=index):
+                    if nameservers is None:
+                        return
+                    self._domains_to_nameservers[index] = nameservers
+                    for nameserver in nameservers:
+                        if nameserver not in seen_nameservers:
+                            seen_nameservers.add(nameserver)
+                            await nameserver_queue.put(nameserver)
+                await lookup(0, self._nameserver_resolver, 'domains_nameservers', domain, domain, found)
+
+        async def resolve_nameservers():
+            while True:
+                nameserver = await nameserver_queue.get()
+                try:
+                    async def found(ips, nameserver=nameserver):
+                        if ips is None:
+                            return
+                        self._nameservers_to_ips[nameserver] = ips
+                        for ip in ips:
+                            if ip not in seen_ips:
+                                seen_ips.add(ip)
+                                if self._whois is None:
+                                    await ip_queue.put(ip)
+                    # glue from the NS answer saves the lookups of the record types it covers
+                    ips = self._ip_resolver.full_glue(nameserver)
+                    if ips is not None:
+                        await found(ips)
+                    else:
+                        await lookup(1, self._ip_resolver, 'nameserver_ips', nameserver, nameserver, found)
+                finally:
+                    nameserver_queue.task_done()
+
+        async def resolve_ips():
+            while True:
+                ip = await ip_queue.get()
+                try:
+                    async def found_asns(asns, ip=ip):
+                        self._ips_to_asns[ip] = asns
+                        for asn in asns:
+                            if asn not in seen_asns:
+                                seen_asns.add(asn)
+                                await asn_queue.put(asn)
+
+                    async def found(response):
+                        if response is not None:
+                            await found_asns(self._asn_resolver.clean_for_asn_number(response))
+                    asns = self._asn_resolver.lookup_prefix_table(ip)
+                    if asns is None and self._offline:
+                        self._asn_resolver._count_failures()
+                        self._asn_resolver._record_stage_failure('ip_to_asn_mapping', ip, 'not in prefix table')
+                    elif asns is not None:
+                        await found_asns(asns)
+                    else:
+                        await lookup(2, self._asn_resolver, 'ip_to_asn_mapping', ip, self._asn_resolver.ip_to_query(ip), found)
+                finally:
+                    ip_queue.task_done()
+
+        async def resolve_asns():
+            while True:
+                asn = await asn_queue.get()
+                try:
+                    async def found(response, asn=asn):
+                        if response is not None:
+                            self._asns_to_org[asn] = self._as_org_resolver.clean_for_organization(response)
+                    await lookup(3, self._as_org_resolver, 'asn_to_org_mapping', asn, self._as_org_resolver.asn_to_query(asn), found)
+                finally:
+                    asn_queue.task_done()
+
+        consumers = [
+            asyncio.create_task(consumer())
+            for consumer in (resolve_nameservers, resolve_ips, resolve_asns)
+            for _ in range(self._concurrency)
+        ]
+        async def drain():
+            # Drain each stage in order, the upstream stage is complete once its queue has joined
+            # and its retries, which can still feed the next queue, are done
+            await asyncio.gather(*(resolve_domains() for _ in range(self._concurrency)))
+            for stage, queue in enumerate((nameserver_queue, ip_queue, asn_queue, None)):
+                await asyncio.gather(*retries[stage])
+                if queue is not None:
+                    await queue.join()
+
+        drained = asyncio.create_task(drain())
+        # Consumers only return by raising, and a stage whose consumers died would never drain
+        done, _ = await asyncio.wait([drained] + consumers, return_when=asyncio.FIRST_COMPLETED)
+        tasks = [drained] + consumers + [task for stage in retries for task in stage]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for task in done:
+            if task.exception() is not None:
+                raise task.exception()
+
+
+    def get_cache_counters(self) -> Dict[str, Tuple[int, int]]:
+        '''Gets the number of cache hits and misses of every stage'''
+        return {
+            'NS': self._nameserver_resolver.get_cache_counters(),
+            'A/AAAA': self._ip_resolver.get_cache_counters(),
+            'ASN TXT': self._asn_resolver.get_cache_counters(),
+            'Org TXT': self._as_org_resolver.get_cache_counters()
+        }
+
+
+    def execute_streaming_resolution(self) -> Dict[str, int]:
+        '''
+        Executes Steps 1 through 3.5 as one streaming pipeline, writes the
+        same outputs as the individual stages and returns the failed resolutions per stage
+        '''
+        self._nameserver_resolver.load_journaled_glue()
+        asyncio.run(self.__stream(self._nameserver_resolver.read_domains()))
+        if self._whois is not None:
+            # every IP is known now, look them and their ASNs up in bulk
+            ips = self._asn_resolver.unique_ips(self._nameservers_to_ips.values())
+            self._ips_to_asns = self._asn_resolver.resolve_ips(ips)
+            self._asns_to_org = self._as_org_resolver.resolve_asns(
+                list(dict.fromkeys(asn for asns in self._ips_to_asns.values() for asn in asns))
+            )
+        if self._cache is not None:
+            self._cache.commit()
+
+        # Keep domains in rank order and drop the ones that failed, like NameserverResolver does
+        cleaned_results = self._nameserver_resolver.drop_failed_resolutions(zip(self._domains, self._domains_to_nameservers))
+        self._nameserver_resolver.write_stage(
+            'domains_nameservers', {domain: nameservers for domain, nameservers in cleaned_results}, scalar = False
+        )
+        self._nameserver_resolver.write_stage('nameserver_glue', self._nameserver_resolver.get_glue(), scalar = False, resolved = False)
+        self._ip_resolver.write_stage('nameserver_ips', self._nameservers_to_ips, scalar = False)
+        self._asn_resolver.write_stage('ip_to_asn_mapping', self._ips_to_asns, scalar = False)
+        self._as_org_resolver.write_stage('asn_to_org_mapping', self._asns_to_org, scalar = True)
+
+        return {
+            'NS': self._nameserver_resolver._resolution_failed_counter,
+            'A/AAAA': self._ip_resolver._resolution_failed_counter,
+            'ASN TXT': self._asn_resolver._resolution_failed_counter,
+            'Org TXT': self._as_org_resolver._resolution_failed_counter
+        }
@@ -0,0 +1,107 @@
+import gzip
+import ipaddress
+import re
+from array import array
+from typing import List, Dict, Tuple
+
+'''
+Offline IP -> Autonomous System Number table.
+Bulk-loads a routeviews pfx2as or pyasn style prefix -> origin file into one binary radix trie
+per address family, answering longest-prefix-match lookups in memory.
+'''
+class PrefixTable:
+    def __init__(self, file_name : str = None):
+        '''
+        @Keyword arguments:
+        file_name(str): Optional prefix -> origin file to load, may be gzip compressed
+        '''
+        # One trie per address family. Node i has children at 2i and 2i + 1 of _children
+        # and the index of its origin list (or -1) at i of _origins.
+        self._children : Dict[int, array] = {4: array('I', [0, 0]), 6: array('I', [0, 0])}
+        self._origins : Dict[int, array] = {4: array('i', [-1]), 6: array('i', [-1])}
+        # Interned origin lists, most prefixes share one of a few thousand origins
+        self._origin_lists : List[Tuple[str, ...]] = []
+        self._origin_index : Dict[Tuple[str, ...], int] = {}
+        self._prefix_count = 0
+        if file_name is not None:
+            self.load(file_name)
+
+
+    def __len__(self) -> int:
+        return self._prefix_count
+
+
+    def load(self, file_name : str):
+        '''
+        Loads every prefix of a routeviews pfx2as file ("1.0.0.0<TAB>24<TAB>13335")
+        or a pyasn file ("1.0.0.0/24<TAB>13335"). Multi-origin (13335_4826) and
+        AS-set ({13335,4826}) origins are kept as a list of ASNs, like Team Cymru returns them.
+
+        @Keyword arguments:
+        file_name(str): Name of the prefix -> origin file, may be gzip compressed
+        '''
+        opener = gzip.open if file_name.endswith('.gz') else open
+        with opener(file_name, 'rt') as prefix_file:
+            for line in prefix_file:
+                fields = line.split()
+                if not fields or fields[0].startswith(';') or fields[0].startswith('#'):
+                    continue
+                if '/' in fields[0]:
+                    prefix, origin = fields[0], fields[1]
+                else:
+                    prefix, origin = f'{fields[0]}/{fields[1]}', fields[2]
+                asns = tuple(asn for asn in re.split('[_,{}]', origin) if asn)
+                self.insert(prefix, asns)
+
+
+    def insert(self, prefix : str, asns : Tuple[str, ...]):
+        '''
+        Adds a single prefix to the trie
+
+        @Keyword arguments:
+        prefix(str): Network in CIDR notation
+        asns(Tuple[str, ...]): Origin ASNs announcing the prefix
+        '''
+        network = ipaddress.ip_network(prefix, strict=False)
+        children, origins = self._children[network.version], self._origins[network.version]
+        address, bits = int(network.network_address), network.max_prefixlen
+        node = 0
+        for depth in range(network.prefixlen):
+            branch = 2 * node + ((address >> (bits - 1 - depth)) & 1)
+            if children[branch] == 0:
+                children[branch] = len(origins)
+                children.extend((0, 0))
+                origins.append(-1)
+            node = children[branch]
+
+        if asns not in self._origin_index:
+            self._origin_index[asns] = len(self._origin_lists)
+            self._origin_lists.append(asns)
+        if origins[node] == -1:
+            self._prefix_count += 1
+        origins[node] = self._origin_index[asns]
+
+
+    def lookup(self, ip : str) -> List[str]:
+        '''
+        Returns the origin ASNs of the longest prefix covering the IP, or None if no prefix covers it
+
+        @Keyword arguments:
+        ip(str): IPv4 or IPv6 address
+        '''
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            return None
+        children, origins = self._children[address.version], self._origins[address.version]
+        value, bits = int(address), address.max_prefixlen
+        node, match = 0, origins[0]
+        for depth in range(bits):
+            node = children[2 * node + ((value >> (bits - 1 - depth)) & 1)]
+            if node == 0:
+                break
+            if origins[node] != -1:
+                match = origins[node]
+        if match == -1:
+            return None
+        return list(self._origin_lists[match])
@@ -1,31 +1,62 @@
-import matplotlib.pyplot as plt
-import numpy as np
-from typing import List, Dict, Tuple
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict
+import hashlib
 import json
 import os
 
+# Every chart, by the ResultPresenter method that renders it
+CHARTS = {
+    'bar_chart.png': 'create_bar_chart',
+    'result_table.png': 'create_table',
+    'inbailwick_table.png': 'create_inbailwick_table'
+}
+
+
+def new_figure():
+    '''
+    Returns a Figure drawn on the Agg canvas, importing matplotlib on first use.
+    The figure is never registered with pyplot, so it is released as soon as it is dropped.
+    '''
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    figure = Figure()
+    FigureCanvasAgg(figure)
+    return figure
+
+
+def render_chart(method_name : str):
+    '''
+    Renders one chart in a worker process
+
+    @Keyword arguments:
+    method_name(str): The ResultPresenter method rendering the chart
+    '''
+    getattr(ResultPresenter(), method_name)()
+
 
 class ResultPresenter():
-    
-  
+
+
     def __init__(self):
       script_dir = os.path.dirname(os.path.abspath(__file__))
       project_root = os.path.dirname(script_dir)
-      results_path = os.path.join(project_root, 'outputs', 'results.json')
-      self._results: Dict[str, List[str]] = self.__read_json(results_path)
+      self._results_path = os.path.join(project_root, 'outputs', 'results.json')
+      self._graphics_dir = os.path.join(project_root, 'graphics')
+      self._results: Dict[str, List[str]] = self.__read_json(self._results_path)
       self._inbailwick_result = self._results["inbailwick_result"]
       self._inbailwick_partial_result = self._results['inbailwick_partial_percent']
+      self._inbailwick_same_registrable_result = self._results.get('inbailwick_same_registrable_percent', None)
       self._companies = [self.clean_name(item[0]) for item in self._results.get("top_unreachable_percents", [])]
       self._top_unreachable_percents = [item[1] for item in self._results.get("top_unreachable_percents", [])]
       self._top_unreachable_numbers = [item[1] for item in self._results.get("top_unreachable_numbers", [])]
       self._top_affected_percents = [item[1] for item in self._results.get("top_affected_percents", [])]
       self._top_affected_numbers = [item[1] for item in self._results.get("top_affected_numbers", [])]
-    
-    
+
+
     def clean_name(self, item):
       '''
       Converts names into human readable format
-        
+
       Keyword arguments:
       item(str): word to clean
       '''
@@ -34,11 +65,11 @@ class ResultPresenter():
           if item[i] in '- ,':
               return item[:i]
       return item
-   
+
     def __read_json(self, file_name: str) -> Dict:
         '''
         Private function to read json
-        
+
         @Keyword arguments:
         file_name(str): Name of requested file to unpack
         '''
@@ -46,36 +77,38 @@ class ResultPresenter():
             data = json.load(jsonfile)
         return data
 
-    
-    def save_image(self, filename):
+
+    def save_image(self, figure, filename):
         '''
-        saves the image in the proper folder, even when calling from this script directly
-        
+        saves the figure in the proper folder, even when calling from this script directly, then clears it
+
         Keyword arguments:
+        figure(Figure): the figure to save
         filename(str): desired file export name
         '''
-        script_dir = os.path.dirname(__file__)
-        graphics_dir = os.path.join(script_dir, '..', 'graphics')
-        file_path = os.path.join(graphics_dir, f'{filename}')
-        plt.savefig(file_path)
-    
-    
+        figure.savefig(os.path.join(self._graphics_dir, f'{filename}'))
+        figure.clear()
+
+
     def create_bar_chart(self):
         '''Creates the bar chart for top unreachable and affected company numbers'''
         x, y_1, y_2 = self._companies, self._top_unreachable_numbers, self._top_affected_numbers
-        plt.grid(True)
-        plt.gca().set_axisbelow(True)
-        plt.bar(x, y_1, label = "Unreachable")
+        figure = new_figure()
+        ax = figure.subplots()
+        ax.grid(True)
+        ax.set_axisbelow(True)
+        ax.bar(x, y_1, label = "Unreachable")
         y_2 = [b-a for a, b in zip(y_1,y_2)]
-        plt.bar(x, y_2, bottom = y_1, label = "Affected")
-        plt.xlabel('Categories')
-        plt.ylabel('Number of Domains')
-        plt.xticks(rotation = 45, fontsize = 7, ha = 'right')
-        plt.legend()
-        plt.tight_layout()
-        self.save_image("bar_chart.png")
-    
-    
+        ax.bar(x, y_2, bottom = y_1, label = "Affected")
+        ax.set_xlabel('Categories')
+        ax.set_ylabel('Number of Domains')
+        for label in ax.get_xticklabels():
+            label.set(rotation = 45, fontsize = 7, ha = 'right')
+        ax.legend()
+        figure.tight_layout()
+        self.save_image(figure, "bar_chart.png")
+
+
     def create_table(self):
         '''Creates the table for top unreachable and affected company percentages'''
         data = list(zip(self._companies, self._top_unreachable_percents, self._top_affected_percents))
@@ -83,7 +116,8 @@ class ResultPresenter():
         total_affected = round(sum(self._top_affected_percents), 2)
         data.append(["Total", total_unreachable, total_affected])
         columns = ('', '% Unreachable', "% Affected")
-        fig, ax = plt.subplots()
+        figure = new_figure()
+        ax = figure.subplots()
         ax.axis('tight')
         ax.axis('off')
         colors = [["#f2f2f2", "#f2f2f2", "#f2f2f2"] if i % 2 == 0 else ["#ffffff", "#ffffff", "#ffffff"] for i in range(len(data))]
@@ -92,20 +126,23 @@ class ResultPresenter():
         for key, cell in table.get_celld().items():
             if key[0] != total_rows:
                 cell.set_edgecolor('none')
-        self.save_image("result_table.png")
+        self.save_image(figure, "result_table.png")
+
 
 
-    
     def create_inbailwick_table(self):
-        '''Creates the full/partial inbailwick percentage table'''
+        '''Creates the full/partial/same registrable domain inbailwick percentage table'''
         data = [
             ["Full Inbailwick Domain %", self._inbailwick_result],
             ["Partial Inbailwick Domain %", self._inbailwick_partial_result]
         ]
-        fig, ax = plt.subplots()
+        if self._inbailwick_same_registrable_result is not None:
+            data.append(["Same Registrable Domain %", self._inbailwick_same_registrable_result])
+        figure = new_figure()
+        ax = figure.subplots()
         ax.axis('tight')
         ax.axis('off')
-        colors = [["#f2f2f2", "#f2f2f2"], ["#ffffff", "#ffffff"]]
+        colors = [["#f2f2f2", "#f2f2f2"] if i % 2 == 0 else ["#ffffff", "#ffffff"] for i in range(len(data))]
         table = ax.table(cellText=data, loc='center', cellColours=colors)
         for key, cell in table.get_celld().items():
             cell.set_text_props(horizontalalignment='center')
@@ -113,4 +150,44 @@ class ResultPresenter():
                 cell.set_text_props(fontweight='bold')
             cell.set_edgecolor('none')
         table.scale(1, 1.5)
-        self.save_image('inbailwick_table.png')
+        self.save_image(figure, 'inbailwick_table.png')
+
+
+    def __results_hash(self) -> str:
+        '''Private function returning the SHA-256 of results.json, which every chart is drawn from, and of the code drawing them'''
+        digest = hashlib.sha256()
+        for file_name in (self._results_path, os.path.abspath(__file__)):
+            with open(file_name, 'rb') as hashed_file:
+                digest.update(hashed_file.read())
+        return digest.hexdigest()
+
+
+    def create_all(self, processes : int = None, force : bool = False) -> bool:
+        '''
+        Creates every chart, each in its own worker process, unless results.json is unchanged since the charts
+        were last created. Returns whether the charts were rendered.
+
+        @Keyword arguments:
+        processes(int): Number of worker processes, the number of CPUs by default. 1 renders in this process.
+        force(bool): Render even if results.json is unchanged
+        '''
+        hash_path = os.path.join(self._graphics_dir, '.results.sha256')
+        results_hash = self.__results_hash()
+        if not force and os.path.exists(hash_path) and all(os.path.exists(os.path.join(self._graphics_dir, chart)) for chart in CHARTS):
+            with open(hash_path, 'r') as hash_file:
+                if hash_file.read().strip() == results_hash:
+                    return False
+
+        os.makedirs(self._graphics_dir, exist_ok=True)
+        processes = min(len(CHARTS), processes or os.cpu_count() or 1)
+        if processes > 1:
+            with ProcessPoolExecutor(max_workers=processes) as executor:
+                list(executor.map(render_chart, CHARTS.values()))
+        else:
+            for method_name in CHARTS.values():
+                getattr(self, method_name)()
+
+        # Only recorded once every chart is written, so an interrupted render is redone
+        with open(hash_path, 'w') as hash_file:
+            hash_file.write(results_hash)
+        return True
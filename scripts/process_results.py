@@ -1,89 +1,106 @@
 from typing import List, Dict, Tuple
 import json
+import numpy as np
+from .dependency_graph import DependencyGraph
+from .rank_statistics import RankStatistics
+from .bailiwick import BailiwickClassifier, PublicSuffixList
+from .tranco_list import TrancoList
+
+RANK_CUTOFFS = (1000, 10000, 100000, 1000000)
 
 class ResultProcessor():
-    def __init__(self):
-        # Prep JSON
-        self._domains_to_nameservers : Dict[str, List[str]] = self.__read_json('outputs/domains_nameservers.json')
-        self._nameservers_to_ips : Dict[str, str] = self.__read_json('outputs/nameserver_ips.json')
-        self._ips_to_asns : Dict[str, List[str]] = self.__read_json('outputs/ip_to_asn_mapping.json')
-        self._asns_to_org : Dict[str, str] = self.__read_json('outputs/asn_to_org_mapping.json')
+    def __init__(self, output_format : str = 'json', tranco : TrancoList = None,
+                 cutoffs : List[int] = RANK_CUTOFFS, resamples : int = 1000, public_suffix_list : str = None):
+        '''
+        @Keyword arguments:
+        output_format(str): 'json' to parse the JSON stage outputs, anything else memory-maps the columnar layout
+        tranco(TrancoList): The resolved Tranco list, for the rank of every domain. Domains are ranked by output order if None
+        cutoffs(List[int]): Ranks the rank statistics are summarized up to
+        resamples(int): Number of bootstrap resamples behind every confidence interval, 0 to skip them
+        public_suffix_list(str): public_suffix_list.dat the registrable domains come from, the default list if None
+        '''
+        self._tranco = tranco
+        self._cutoffs = cutoffs
+        self._resamples = resamples
+        self._public_suffix_list = public_suffix_list
+
+        # Prep the dependency graph of every stage output, each name interned once,
+        # and a view of its domain -> nameservers edges shaped like the Step 1 output
+        self._graph = DependencyGraph.read(output_format)
+        self._domains_to_nameservers = self._graph.adjacency('domain')
 
         # Store total # of domains
-        self._total_domains = len(self._domains_to_nameservers)
+        self._total_domains = len(self._graph)
 
         # Prep storage variables
-        self._unreachable_organizations, self._affected_organizations = self.__process_results_unreachable()
-        self._inbailwick_domains, self._inbailwick_partial_domains = self.__process_results_inbailwick()
+        self._unreachable_organizations, self._affected_organizations, self._rank_statistics = self.__process_results_unreachable()
+        self._inbailwick_domains, self._inbailwick_partial_domains, self._same_registrable_domains = self.__process_results_inbailwick()
    
     
-    def __read_json(self, file_name: str) -> Dict:
+    def __domain_ranks(self) -> np.ndarray:
         '''
-        Private function to read json
-        
-        @Keyword arguments:
-        file_name(str): Name of requested file to unpack
+        Private function returning the Tranco rank of every domain, in output order.
+        Without the Tranco list, domains are ranked by output order. A domain missing from the list
+        means the outputs were resolved from another list or rank range, and raises.
         '''
-        with open(file_name, 'r') as jsonfile:
-            data = json.load(jsonfile)
-        return data
+        if self._tranco is None:
+            return np.arange(1, self._total_domains + 1, dtype=np.int64)
+        rank_of = {domain: rank for rank, domain in self._tranco.rows()}
+        domains = self._graph.names('domain')
+        ranks = np.fromiter((rank_of.get(domain, 0) for domain in domains), dtype=np.int64, count=self._total_domains)
+        missing = np.flatnonzero(ranks == 0)
+        if len(missing):
+            raise Exception(
+                f'Domains: {len(missing)} resolved domains, e.g. {domains[missing[0]]}, are not in ranks '
+                f'{self._tranco.first_rank} to {self._tranco.last_rank} of {self._tranco.path}. '
+                'Process with the Tranco list and rank range the outputs were resolved from.'
+            )
+        return ranks
 
-    
-    def __process_results_unreachable(self) -> Dict[str, int]:
+
+    def __process_results_unreachable(self) -> Tuple[Dict[str, int], Dict[str, int], RankStatistics]:
         '''
         Private function to analyze data and returns Dictionary of 
         Organization Name -> # Full-Controlled Domains in Top 10k
+        and Organization Name -> # Affected Domains, with the RankStatistics of every (domain, organization) pair
+        
+        The dependency graph walks every domain down to the organizations hosting its nameservers
+        with NumPy array operations, keeping each (domain, organization) pair once.
         '''
-        unreachable_organizations : Dict[str, int] = {}
-        affected_organizations : Dict[str, int] = {}
-        for domain, nameservers in self._domains_to_nameservers.items():
-            # create 'set' of organizations that the domain is reliant on for hosting its nameservers
-            organizations = set()
-            # iterate over all nameservers for that domain
-            for nameserver in nameservers:
-                # get corresponding IP
-                nameserver_ip = self._nameservers_to_ips.get(nameserver, None)
-                if nameserver_ip == None:
-                    continue
-                # get corresponding asns
-                asns = self._ips_to_asns.get(nameserver_ip, None)
-                if asns == None:
-                    continue
-                # in the event its a multi-org ASN
-                for asn in asns:
-                    organization = self._asns_to_org.get(asn, None)
-                    if organization == None:
-                        continue
-                    # add organization to set
-                    organizations.add(organization)
-            # if its only the one organization running all of the domains nameservers, add it to unreachable orgs dictionary
-            if len(organizations) == 1:
-                for org in organizations:
-                    unreachable_organizations[org] = unreachable_organizations.get(org, 0) + 1
-            for org in organizations:
-                affected_organizations[org] = affected_organizations.get(org, 0) + 1
-        return unreachable_organizations, affected_organizations
+        organizations = self._graph.names('organization')
+        domains, orgs = self._graph.pairs('domain', 'organization')
+
+        # if its only the one organization running all of the domains nameservers, it is unreachable
+        organizations_per_domain = np.bincount(domains, minlength=self._total_domains)
+        sole = organizations_per_domain[domains] == 1
+        sole_orgs = orgs[sole]
+        unreachable_counts = np.bincount(sole_orgs, minlength=len(organizations))
+        affected_counts = np.bincount(orgs, minlength=len(organizations))
+
+        # order unreachable organizations by the first domain they control, like a per-domain loop would
+        first_seen = np.full(len(organizations), len(sole_orgs), dtype=np.int64)
+        np.minimum.at(first_seen, sole_orgs, np.arange(len(sole_orgs)))
+        unreachable_ids = np.flatnonzero(unreachable_counts)
+        unreachable_ids = unreachable_ids[np.argsort(first_seen[unreachable_ids], kind='stable')]
+        unreachable_organizations : Dict[str, int] = {
+            organizations[org]: count for org, count in zip(unreachable_ids.tolist(), unreachable_counts[unreachable_ids].tolist())
+        }
+        affected_ids = np.flatnonzero(affected_counts)
+        affected_organizations : Dict[str, int] = {
+            organizations[org]: count for org, count in zip(affected_ids.tolist(), affected_counts[affected_ids].tolist())
+        }
+        rank_statistics = RankStatistics(self.__domain_ranks(), domains, orgs, sole, organizations)
+        return unreachable_organizations, affected_organizations, rank_statistics
     
     
-    def __process_results_inbailwick(self) -> List[str]:
+    def __process_results_inbailwick(self) -> Tuple[List[str], List[str], List[str]]:
         '''
-        Private function to analyze data and returns List of 
-        Domains whose Nameservers are exclusively in-bailiwick
+        Private function to analyze data and returns Lists of Domains whose Nameservers are
+        exclusively in-bailiwick, partially in-bailiwick, and only under the same registrable domain
         '''
-        inbailwick_domains : List[str] = []
-        inbailwick_partial_domains : List[str] = []
-        for domain, nameservers in self._domains_to_nameservers.items():
-            inbailwick_count = 0
-            for nameserver in nameservers:
-                if domain in nameserver:
-                    inbailwick_count += 1
-            # captures full inbailwick for all nameservers
-            if inbailwick_count == len(nameservers):
-                inbailwick_domains.append(domain)
-            # captures partial inbailwick
-            elif inbailwick_count > 0:
-                inbailwick_partial_domains.append(domain)
-        return inbailwick_domains, inbailwick_partial_domains
+        classifier = BailiwickClassifier(PublicSuffixList(self._public_suffix_list))
+        buckets = classifier.classify(self._domains_to_nameservers)
+        return buckets['full'], buckets['partial'], buckets['same_registrable']
 
     
     def get_top_unreachable_as_numbers(self) -> List[Tuple[str, int]]:
@@ -133,11 +150,27 @@ class ResultProcessor():
         return round((len(self._inbailwick_partial_domains)/self._total_domains)*100, 2)
 
     
+    def get_dependency_graph(self) -> DependencyGraph:
+        '''Gets the dependency graph of every domain, e.g. to find the domains an organization outage breaks'''
+        return self._graph
+
+
+    def get_rank_statistics(self) -> RankStatistics:
+        '''Gets the rank-weighted statistics engine over every (domain, organization) pair'''
+        return self._rank_statistics
+
+
+    def get_inbailwick_same_registrable_percent(self) -> float:
+        '''Gets Percentage of Domains whose Nameservers are not in-bailiwick but share its registrable domain'''
+        return round((len(self._same_registrable_domains)/self._total_domains)*100, 2)
+
+
     def execute_process_all_results(self):
         '''Processes all results'''
         # Obtain the results
         inbailwick_percent = self.get_inbailwick_percent()
         inbailwick_partial_percent = self.get_inbailwick_partial_percent()
+        inbailwick_same_registrable_percent = self.get_inbailwick_same_registrable_percent()
         top_unreachable_percents = self.get_top_unreachable_as_percents()
         top_unreachable_numbers = self.get_top_unreachable_as_numbers()
         top_affected_percents = self.get_top_affected_as_percents()
@@ -147,6 +180,7 @@ class ResultProcessor():
         results_to_write = {
             "inbailwick_result": inbailwick_percent,
             "inbailwick_partial_percent": inbailwick_partial_percent,
+            "inbailwick_same_registrable_percent": inbailwick_same_registrable_percent,
             "top_unreachable_percents": top_unreachable_percents,
             "top_unreachable_numbers": top_unreachable_numbers,
             "top_affected_percents" : top_affected_percents,
@@ -157,4 +191,12 @@ class ResultProcessor():
         with open('outputs/results.json', 'w') as json_file:
             json.dump(results_to_write, json_file, indent=4)
 
+        # Summarize the top organizations at every rank cutoff, and their curves over every rank
+        rank_summary = self._rank_statistics.summarize(self._cutoffs, resamples=self._resamples)
+        with open('outputs/rank_statistics.json', 'w') as json_file:
+            json.dump(rank_summary, json_file, indent=4)
+        self._rank_statistics.write_curves(
+            'outputs/rank_curves.npz', self._rank_statistics.top_organizations(self._rank_statistics.max_rank)
+        )
+
 
@@ -0,0 +1,214 @@
+from typing import List, Dict, Tuple
+import numpy as np
+
+'''
+Rank-weighted statistics over one resolved dataset. Every (domain, organization) pair found by
+ResultProcessor is keyed by organization id and Tranco rank into one sorted array, so the number of
+domains an organization makes unreachable or affects up to any rank is a pair of binary searches.
+Counts at every cutoff for every organization, and cumulative curves over every rank, come from
+vectorized searches over those arrays instead of a rerun of the pipeline per cutoff.
+
+Confidence intervals are percentile bootstraps over domains. Resampling the n domains up to a cutoff
+with replacement only changes how many of each organization's domains are drawn, so a resample is
+drawn directly as counts: multinomial for unreachable domains, which belong to at most one
+organization, and binomial per organization for affected domains, which can belong to several.
+'''
+class RankStatistics:
+    def __init__(self, ranks : np.ndarray, domains : np.ndarray, orgs : np.ndarray, sole : np.ndarray,
+                 organizations : List[str], seed : int = 0):
+        '''
+        @Keyword arguments:
+        ranks(np.ndarray): Tranco rank of every domain id
+        domains(np.ndarray): Domain id of every (domain, organization) pair, each pair present once
+        orgs(np.ndarray): Organization id of every pair
+        sole(np.ndarray): Whether the organization of each pair is the only one behind its domain
+        organizations(List[str]): Name of every organization id
+        seed(int): Seed of the bootstrap resamples, so reruns give the same intervals
+        '''
+        ranks = np.asarray(ranks, dtype=np.int64)
+        self._ranks = np.sort(ranks)
+        self._organizations = organizations
+        self._organization_count = len(organizations)
+        self._seed = seed
+        # one past the highest rank, so (organization, rank) pairs sort by organization then rank
+        self._rank_base = int(self._ranks[-1]) + 1 if len(self._ranks) else 1
+        keys = np.asarray(orgs, dtype=np.int64) * self._rank_base + ranks[np.asarray(domains, dtype=np.int64)]
+        self._affected_keys = np.sort(keys)
+        self._unreachable_keys = np.sort(keys[np.asarray(sole, dtype=bool)])
+
+
+    @property
+    def max_rank(self) -> int:
+        '''Highest rank of a resolved domain'''
+        return self._rank_base - 1
+
+
+    def name(self, organization : int) -> str:
+        '''
+        Gets the name of an organization id
+
+        @Keyword arguments:
+        organization(int): The organization id
+        '''
+        return self._organizations[organization]
+
+
+    def domains_at(self, cutoffs : np.ndarray) -> np.ndarray:
+        '''
+        Gets the number of resolved domains ranked at or above every cutoff
+
+        @Keyword arguments:
+        cutoffs(np.ndarray): Ranks to count up to
+        '''
+        return np.searchsorted(self._ranks, np.asarray(cutoffs, dtype=np.int64), side='right')
+
+
+    def __count(self, keys : np.ndarray, organizations : np.ndarray, cutoffs : np.ndarray) -> np.ndarray:
+        '''
+        Private function counting the pairs of every organization ranked at or above every cutoff,
+        as an (organizations, cutoffs) array
+
+        @Keyword arguments:
+        keys(np.ndarray): Sorted organization * rank base + rank keys of the pairs
+        organizations(np.ndarray): Organization ids to count
+        cutoffs(np.ndarray): Ranks to count up to
+        '''
+        base = organizations[:, None] * self._rank_base
+        cutoffs = np.clip(cutoffs, 0, self.max_rank)[None, :]
+        return np.searchsorted(keys, base + cutoffs, side='right') - np.searchsorted(keys, base, side='left')
+
+
+    def counts_at(self, cutoffs : np.ndarray, organizations : np.ndarray = None) -> Tuple[np.ndarray, np.ndarray]:
+        '''
+        Gets the number of domains each organization makes unreachable and affects up to every cutoff,
+        as two (organizations, cutoffs) arrays
+
+        @Keyword arguments:
+        cutoffs(np.ndarray): Ranks to count up to
+        organizations(np.ndarray): Organization ids to count, every organization if None
+        '''
+        if organizations is None:
+            organizations = np.arange(self._organization_count, dtype=np.int64)
+        organizations = np.asarray(organizations, dtype=np.int64)
+        cutoffs = np.asarray(cutoffs, dtype=np.int64)
+        return self.__count(self._unreachable_keys, organizations, cutoffs), self.__count(self._affected_keys, organizations, cutoffs)
+
+
+    def top_organizations(self, cutoff : int, count : int = 10) -> np.ndarray:
+        '''
+        Gets the ids of the organizations making the most domains unreachable up to a cutoff
+
+        @Keyword arguments:
+        cutoff(int): Rank to count up to
+        count(int): Number of organizations
+        '''
+        unreachable, _ = self.counts_at([cutoff])
+        unreachable = unreachable[:, 0]
+        top = np.argsort(-unreachable, kind='stable')[:count]
+        return top[unreachable[top] > 0]
+
+
+    def cumulative_counts(self, organization : int) -> Dict[str, np.ndarray]:
+        '''
+        Gets the number of domains an organization makes unreachable and affects up to every rank
+        of a resolved domain, next to those ranks and the number of domains up to each of them
+
+        @Keyword arguments:
+        organization(int): The organization id
+        '''
+        start, stop = organization * self._rank_base, (organization + 1) * self._rank_base
+        curves = {'ranks': self._ranks, 'domains': np.arange(1, len(self._ranks) + 1)}
+        for name, keys in (('unreachable', self._unreachable_keys), ('affected', self._affected_keys)):
+            pair_ranks = keys[np.searchsorted(keys, start):np.searchsorted(keys, stop)] - start
+            curves[name] = np.searchsorted(pair_ranks, self._ranks, side='right')
+        return curves
+
+
+    def bootstrap(self, cutoff : int, organizations : np.ndarray, resamples : int = 1000,
+                  confidence : float = 0.95) -> Tuple[np.ndarray, np.ndarray]:
+        '''
+        Gets percentile bootstrap intervals of the share of domains up to a cutoff each organization
+        makes unreachable and affects, as two (organizations, 2) arrays of lower and upper bounds
+
+        @Keyword arguments:
+        cutoff(int): Rank to count up to
+        organizations(np.ndarray): Organization ids
+        resamples(int): Number of bootstrap resamples
+        confidence(float): Coverage of the intervals
+        '''
+        organizations = np.asarray(organizations, dtype=np.int64)
+        domains = int(self.domains_at([cutoff])[0])
+        if domains == 0 or len(organizations) == 0:
+            empty = np.zeros((len(organizations), 2))
+            return empty, empty
+        unreachable, affected = (counts[:, 0] for counts in self.counts_at([cutoff], organizations))
+        generator = np.random.default_rng(self._seed)
+        # the last category holds every domain none of these organizations makes unreachable
+        shares = np.append(unreachable, domains - unreachable.sum()) / domains
+        unreachable_draws = generator.multinomial(domains, shares, size=resamples)[:, :-1] / domains
+        affected_draws = generator.binomial(domains, affected / domains, size=(resamples, len(organizations))) / domains
+        quantiles = [(1 - confidence) / 2, (1 + confidence) / 2]
+        return np.quantile(unreachable_draws, quantiles, axis=0).T, np.quantile(affected_draws, quantiles, axis=0).T
+
+
+    def summarize(self, cutoffs : List[int], count : int = 10, resamples : int = 1000, confidence : float = 0.95) -> Dict:
+        '''
+        Summarizes the top organizations at every cutoff up to the highest resolved rank, with
+        counts, percentages, bootstrap intervals, and the share of domains the top organizations make unreachable
+
+        @Keyword arguments:
+        cutoffs(List[int]): Ranks to summarize up to, the highest resolved rank is always added
+        count(int): Number of top organizations, taken at the highest cutoff
+        resamples(int): Number of bootstrap resamples, 0 to skip the intervals
+        confidence(float): Coverage of the intervals
+        '''
+        cutoffs = sorted({cutoff for cutoff in cutoffs if cutoff < self.max_rank} | {self.max_rank})
+        cutoffs = [cutoff for cutoff in cutoffs if self.domains_at([cutoff])[0] > 0]
+        domains = self.domains_at(cutoffs)
+        top = self.top_organizations(self.max_rank, count)
+        unreachable, affected = self.counts_at(cutoffs, top)
+
+        organizations : Dict[str, Dict] = {}
+        for row, organization in enumerate(top.tolist()):
+            organizations[self.name(organization)] = {
+                'unreachable': unreachable[row].tolist(),
+                'unreachable_percents': np.round(unreachable[row] / domains * 100, 2).tolist(),
+                'affected': affected[row].tolist(),
+                'affected_percents': np.round(affected[row] / domains * 100, 2).tolist()
+            }
+        if resamples > 0:
+            for column, cutoff in enumerate(cutoffs):
+                unreachable_intervals, affected_intervals = self.bootstrap(cutoff, top, resamples, confidence)
+                for row, organization in enumerate(top.tolist()):
+                    summary = organizations[self.name(organization)]
+                    summary.setdefault('unreachable_percent_intervals', []).append(np.round(unreachable_intervals[row] * 100, 2).tolist())
+                    summary.setdefault('affected_percent_intervals', []).append(np.round(affected_intervals[row] * 100, 2).tolist())
+
+        # concentration: share of domains made unreachable by whichever organizations are the top ones at each cutoff
+        all_unreachable, _ = self.counts_at(cutoffs)
+        top_unreachable = -np.sort(-all_unreachable, axis=0)[:count].sum(axis=0) if len(all_unreachable) else np.zeros(len(cutoffs))
+        return {
+            'cutoffs': cutoffs,
+            'domains': domains.tolist(),
+            'resamples': resamples,
+            'confidence': confidence,
+            'organizations': organizations,
+            'top_concentration_percents': np.round(top_unreachable / domains * 100, 2).tolist()
+        }
+
+
+    def write_curves(self, output_file_name : str, organizations : np.ndarray):
+        '''
+        Writes the cumulative curves of organizations over every resolved rank as a compressed NumPy archive,
+        holding ranks, domains, and <name>.unreachable / <name>.affected arrays per organization
+
+        @Keyword arguments:
+        output_file_name(str): Name of the .npz file
+        organizations(np.ndarray): Organization ids
+        '''
+        arrays = {'ranks': self._ranks, 'domains': np.arange(1, len(self._ranks) + 1)}
+        for organization in np.asarray(organizations, dtype=np.int64).tolist():
+            curves = self.cumulative_counts(organization)
+            arrays[f'{self.name(organization)}.unreachable'] = curves['unreachable']
+            arrays[f'{self.name(organization)}.affected'] = curves['affected']
+        np.savez_compressed(output_file_name, **arrays)
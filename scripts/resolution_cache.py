@@ -0,0 +1,152 @@
+import json
+import sqlite3
+import threading
+import time
+from typing import List, Dict, Tuple
+
+'''
+Persistent on-disk cache of DNS answers shared by every stage.
+Entries are keyed by (qname, rdtype), expire with the record TTL (capped by max_age)
+and the least recently used entries are evicted once the cache grows past max_size bytes.
+
+One cache file can be shared by several processes, e.g. the shards of a sharded run. Every put is
+committed in its own short transaction, SQLite waits up to busy_timeout seconds for another process's
+transaction, and reads do not write: the times entries were used are kept in memory and written in
+one batch with the LRU eviction. A cache that cannot be read or written, e.g. because the database is
+locked, only misses or skips storing, so it never fails a resolution. Such errors are counted.
+'''
+class ResolutionCache:
+    def __init__(self, path : str, max_age : float = 30 * 24 * 3600, max_size : int = 512 * 1024 * 1024,
+                 evict_interval : int = 1000, busy_timeout : float = 30.0):
+        '''
+        @Keyword arguments:
+        path(str): Location of the SQLite database file
+        max_age(float): Maximum number of seconds an entry is served, even if its TTL is longer
+        max_size(int): Maximum number of bytes of cached records before LRU eviction
+        evict_interval(int): Number of puts between evictions, which also write the batched access times
+        busy_timeout(float): Seconds to wait for another connection's write transaction before giving up
+        '''
+        self._max_age = max_age
+        self._max_size = max_size
+        self._evict_interval = evict_interval
+        self._pending_puts = 0
+        self._errors = 0
+        # (qname, rdtype) -> time.time() of the last read, not yet written to the database
+        self._accessed : Dict[Tuple[str, str], float] = {}
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=busy_timeout, check_same_thread=False)
+        self._connection.execute(f'PRAGMA busy_timeout={int(busy_timeout * 1000)}')
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.execute('''
+            CREATE TABLE IF NOT EXISTS entries (
+                qname TEXT NOT NULL,
+                rdtype TEXT NOT NULL,
+                records TEXT NOT NULL,
+                expires REAL NOT NULL,
+                accessed REAL NOT NULL,
+                size INTEGER NOT NULL,
+                PRIMARY KEY (qname, rdtype)
+            )
+        ''')
+        self._connection.execute('CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)')
+        self._connection.commit()
+
+
+    def get(self, qname : str, rdtype : str) -> List[str]:
+        '''
+        Returns the cached records for a query, or None if missing, expired or the cache cannot be read
+
+        @Keyword arguments:
+        qname(str): The DNS query name
+        rdtype(str): The record type of the query
+        '''
+        now = time.time()
+        with self._lock:
+            try:
+                row = self._connection.execute(
+                    'SELECT records, expires FROM entries WHERE qname = ? AND rdtype = ?', (qname, rdtype)
+                ).fetchone()
+            except sqlite3.Error:
+                self._errors += 1
+                return None
+            # expired entries are left to the next eviction
+            if row is None or row[1] <= now:
+                return None
+            self._accessed[(qname, rdtype)] = now
+        return json.loads(row[0])
+
+
+    def put(self, qname : str, rdtype : str, records : List[str], ttl : float):
+        '''
+        Stores the records of an answer until its TTL (or max_age) runs out, skipped if the cache cannot be written
+
+        @Keyword arguments:
+        qname(str): The DNS query name
+        rdtype(str): The record type of the query
+        records(List[str]): The text of every record in the answer
+        ttl(float): The TTL of the answer
+        '''
+        now = time.time()
+        serialized = json.dumps(records)
+        with self._lock:
+            try:
+                with self._connection:
+                    self._connection.execute(
+                        'INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)',
+                        (qname, rdtype, serialized, now + min(ttl, self._max_age), now, len(qname) + len(serialized))
+                    )
+            except sqlite3.Error:
+                self._errors += 1
+                return
+            self._accessed.pop((qname, rdtype), None)
+            self._pending_puts += 1
+            if self._pending_puts >= self._evict_interval:
+                self.__flush()
+
+
+    def __flush(self):
+        '''Private function that writes the batched access times and evicts, in one transaction. Caller holds the lock.'''
+        self._pending_puts = 0
+        accessed, self._accessed = self._accessed, {}
+        try:
+            with self._connection:
+                self._connection.executemany(
+                    'UPDATE entries SET accessed = MAX(accessed, ?) WHERE qname = ? AND rdtype = ?',
+                    [(time_used, qname, rdtype) for (qname, rdtype), time_used in accessed.items()]
+                )
+                self.__evict()
+        except sqlite3.Error:
+            self._errors += 1
+
+
+    def __evict(self):
+        '''Private function that drops expired entries, then least recently used ones until under max_size'''
+        self._connection.execute('DELETE FROM entries WHERE expires <= ?', (time.time(),))
+        total_size = self._connection.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+        if total_size <= self._max_size:
+            return
+        excess = total_size - self._max_size
+        for accessed, size in self._connection.execute('SELECT accessed, size FROM entries ORDER BY accessed'):
+            excess -= size
+            if excess <= 0:
+                break
+        self._connection.execute('DELETE FROM entries WHERE accessed <= ?', (accessed,))
+
+
+    def commit(self):
+        '''Writes the batched access times to disk and evicts'''
+        with self._lock:
+            self.__flush()
+
+
+    def get_error_counter(self) -> int:
+        '''Gets the number of reads and writes that failed, e.g. because another process held the database locked'''
+        with self._lock:
+            return self._errors
+
+
+    def close(self):
+        '''Commits pending changes and closes the database'''
+        self.commit()
+        self._connection.close()
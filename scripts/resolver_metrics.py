@@ -0,0 +1,262 @@
+import json
+import threading
+import time
+from array import array
+from typing import Callable, List, Dict
+import dns.exception
+import dns.message
+import dns.rcode
+import dns.resolver
+
+# Values below 2^SUB_BUCKET_BITS microseconds get one bucket each, larger values get
+# 2^(SUB_BUCKET_BITS - 1) buckets per power of two, so every bucket is within 1/64 of its value
+SUB_BUCKET_BITS = 7
+SUB_BUCKET_HALF = 1 << (SUB_BUCKET_BITS - 1)
+
+OUTCOMES = ('NOERROR', 'CACHED', 'NXDOMAIN', 'NoAnswer', 'timeout', 'SERVFAIL', 'REFUSED', 'network', 'other')
+QUANTILES = (('p50', 0.5), ('p90', 0.9), ('p99', 0.99), ('p999', 0.999))
+
+'''
+HDR-style log-linear histogram of latencies in microseconds.
+Recording is O(1) into a fixed bucket array and quantiles are within 1/64 of the recorded value.
+'''
+class LatencyHistogram:
+    def __init__(self):
+        self._counts = array('q')
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+
+    def record(self, microseconds : int):
+        '''
+        Counts one latency
+
+        @Keyword arguments:
+        microseconds(int): The latency to record
+        '''
+        magnitude = max(microseconds.bit_length() - SUB_BUCKET_BITS, 0)
+        index = magnitude * SUB_BUCKET_HALF + (microseconds >> magnitude)
+        if index >= len(self._counts):
+            self._counts.extend([0] * (index + 1 - len(self._counts)))
+        self._counts[index] += 1
+        self.count += 1
+        self.total += microseconds
+        self.max = max(self.max, microseconds)
+
+
+    def __bucket_value(self, index : int) -> int:
+        '''
+        Private function returning the midpoint of a bucket in microseconds
+
+        @Keyword arguments:
+        index(int): Index of the bucket
+        '''
+        magnitude = 0 if index < 2 * SUB_BUCKET_HALF else (index - 2 * SUB_BUCKET_HALF) // SUB_BUCKET_HALF + 1
+        lower = (index - magnitude * SUB_BUCKET_HALF) << magnitude
+        return lower + ((1 << magnitude) >> 1)
+
+
+    def quantile(self, quantile : float) -> int:
+        '''
+        Returns the latency in microseconds at or below which the given fraction of latencies fall
+
+        @Keyword arguments:
+        quantile(float): Fraction between 0 and 1
+        '''
+        if self.count == 0:
+            return 0
+        rank = max(1, int(quantile * self.count + 0.5))
+        seen = 0
+        for index, bucket_count in enumerate(self._counts):
+            seen += bucket_count
+            if seen >= rank:
+                return min(self.__bucket_value(index), self.max)
+        return self.max
+
+
+'''
+Thread-safe instrumentation shared by every DNSResolver of a run: per record type latency
+histograms of upstream queries, lookups by outcome, in-flight gauges and a per-second timeline
+of completed and failed lookups.
+'''
+class ResolverMetrics:
+    def __init__(self, interval : float = 1.0):
+        '''
+        @Keyword arguments:
+        interval(float): Width in seconds of each timeline bucket
+        '''
+        self._interval = interval
+        self._started = time.monotonic()
+        self._lock = threading.Lock()
+        self._latencies : Dict[str, LatencyHistogram] = {}
+        self._outcomes : Dict[str, Dict[str, int]] = {}
+        self._in_flight : Dict[str, int] = {}
+        self._peak_in_flight : Dict[str, int] = {}
+        # timeline bucket -> [completed, failed, peak in-flight across record types]
+        self._timeline : Dict[int, List[int]] = {}
+        self._total_in_flight = 0
+        self._sections : Dict[str, Callable[[], Dict]] = {}
+
+
+    @staticmethod
+    def classify(error : Exception) -> str:
+        '''
+        Maps a resolution error to its outcome
+
+        @Keyword arguments:
+        error(Exception): The error raised while resolving
+        '''
+        if isinstance(error, dns.resolver.NXDOMAIN):
+            return 'NXDOMAIN'
+        if isinstance(error, dns.resolver.NoAnswer):
+            return 'NoAnswer'
+        if isinstance(error, dns.exception.Timeout):
+            return 'timeout'
+        if isinstance(error, dns.resolver.NoNameservers):
+            # Every upstream failed, report the rcode of the last response if there was one
+            for *_, response in reversed(error.kwargs.get('errors', [])):
+                if isinstance(response, dns.message.Message) and response.rcode() == dns.rcode.REFUSED:
+                    return 'REFUSED'
+            return 'SERVFAIL'
+        if isinstance(error, OSError):
+            return 'network'
+        return 'other'
+
+
+    def start(self, record_type : str) -> float:
+        '''
+        Marks a lookup as in flight, returning its start time for finish
+
+        @Keyword arguments:
+        record_type(str): Record type of the lookup
+        '''
+        with self._lock:
+            in_flight = self._in_flight[record_type] = self._in_flight.get(record_type, 0) + 1
+            self._peak_in_flight[record_type] = max(self._peak_in_flight.get(record_type, 0), in_flight)
+            self._total_in_flight += 1
+        return time.perf_counter()
+
+
+    def finish(self, record_type : str, started : float, outcome : str):
+        '''
+        Records the outcome of a lookup. Latency is only recorded for upstream queries, not cache hits.
+
+        @Keyword arguments:
+        record_type(str): Record type of the lookup
+        started(float): Value returned by start
+        outcome(str): One of OUTCOMES
+        '''
+        microseconds = int((time.perf_counter() - started) * 1000000)
+        bucket = int((time.monotonic() - self._started) / self._interval)
+        with self._lock:
+            if outcome != 'CACHED':
+                if record_type not in self._latencies:
+                    self._latencies[record_type] = LatencyHistogram()
+                self._latencies[record_type].record(microseconds)
+            outcomes = self._outcomes.setdefault(record_type, {})
+            outcomes[outcome] = outcomes.get(outcome, 0) + 1
+            timeline = self._timeline.setdefault(bucket, [0, 0, 0])
+            timeline[0] += 1
+            if outcome not in ('NOERROR', 'CACHED'):
+                timeline[1] += 1
+            timeline[2] = max(timeline[2], self._total_in_flight)
+            self._in_flight[record_type] -= 1
+            self._total_in_flight -= 1
+
+
+    def add_section(self, name : str, section : Callable[[], Dict]):
+        '''
+        Adds the stats of another component to the summary
+
+        @Keyword arguments:
+        name(str): Key of the section in the summary
+        section(Callable): Returns the stats of the component
+        '''
+        self._sections[name] = section
+
+
+    def summary(self) -> Dict:
+        '''Returns every metric as a JSON-serializable dict, latencies in milliseconds'''
+        with self._lock:
+            record_types = {}
+            for record_type in sorted(set(self._outcomes) | set(self._in_flight)):
+                histogram = self._latencies.get(record_type, LatencyHistogram())
+                latency = {'count': histogram.count, 'mean': histogram.total / histogram.count / 1000 if histogram.count else 0}
+                latency.update({name: histogram.quantile(quantile) / 1000 for name, quantile in QUANTILES})
+                latency['max'] = histogram.max / 1000
+                record_types[record_type] = {
+                    'lookups': sum(self._outcomes.get(record_type, {}).values()),
+                    'outcomes': dict(self._outcomes.get(record_type, {})),
+                    'latency_ms': latency,
+                    'in_flight': self._in_flight.get(record_type, 0),
+                    'peak_in_flight': self._peak_in_flight.get(record_type, 0)
+                }
+            timeline = [
+                {'second': bucket * self._interval, 'completed': completed,
+                 'per_second': completed / self._interval, 'failed': failed, 'peak_in_flight': peak}
+                for bucket, (completed, failed, peak) in sorted(self._timeline.items())
+            ]
+        elapsed = time.monotonic() - self._started
+        lookups = sum(record_type['lookups'] for record_type in record_types.values())
+        return {
+            'elapsed_seconds': elapsed,
+            'lookups': lookups,
+            'lookups_per_second': lookups / elapsed if elapsed > 0 else 0,
+            'record_types': record_types,
+            'timeline': timeline,
+            **{name: section() for name, section in self._sections.items()}
+        }
+
+
+    def write_json(self, output_file_name : str = 'outputs/metrics.json'):
+        '''
+        Writes the summary of every metric
+
+        @Keyword arguments:
+        output_file_name(str): Name of the metrics JSON file
+        '''
+        with open(output_file_name, 'w') as jsonfile:
+            json.dump(self.summary(), jsonfile, indent=4)
+
+
+    def write_prometheus(self, output_file_name : str, summary : Dict = None):
+        '''
+        Writes every metric in the Prometheus text exposition format,
+        e.g. for the node_exporter textfile collector
+
+        @Keyword arguments:
+        output_file_name(str): Name of the Prometheus text file
+        summary(Dict): Summary to write instead of this instance's, e.g. one combined from several processes
+        '''
+        if summary is None:
+            summary = self.summary()
+        lines = [
+            '# HELP dns_lookups_total DNS lookups by record type and outcome.',
+            '# TYPE dns_lookups_total counter'
+        ]
+        for record_type, metrics in summary['record_types'].items():
+            for outcome, count in metrics['outcomes'].items():
+                lines.append(f'dns_lookups_total{{rdtype="{record_type}",outcome="{outcome}"}} {count}')
+        lines += [
+            '# HELP dns_query_latency_seconds Latency of upstream DNS queries.',
+            '# TYPE dns_query_latency_seconds summary'
+        ]
+        for record_type, metrics in summary['record_types'].items():
+            latency = metrics['latency_ms']
+            for name, quantile in QUANTILES:
+                lines.append(f'dns_query_latency_seconds{{rdtype="{record_type}",quantile="{quantile}"}} {latency[name] / 1000}')
+            lines.append(f'dns_query_latency_seconds_sum{{rdtype="{record_type}"}} {latency["mean"] * latency["count"] / 1000}')
+            lines.append(f'dns_query_latency_seconds_count{{rdtype="{record_type}"}} {latency["count"]}')
+        for name, key, help_text in (('dns_lookups_in_flight', 'in_flight', 'DNS lookups currently in flight.'),
+                                     ('dns_lookups_in_flight_peak', 'peak_in_flight', 'Most DNS lookups in flight at once.')):
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} gauge']
+            for record_type, metrics in summary['record_types'].items():
+                lines.append(f'{name}{{rdtype="{record_type}"}} {metrics[key]}')
+        lines += [
+            '# HELP dns_lookups_per_second Average DNS lookups completed per second.',
+            '# TYPE dns_lookups_per_second gauge',
+            f'dns_lookups_per_second {summary["lookups_per_second"]}'
+        ]
+        with open(output_file_name, 'w') as prometheus_file:
+            prometheus_file.write('\n'.join(lines) + '\n')
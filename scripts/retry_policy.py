@@ -0,0 +1,83 @@
+import heapq
+import random
+import time
+from typing import List, Tuple
+
+# Outcomes worth asking again, every other failure (NXDOMAIN, NoAnswer, ...) is permanent
+TRANSIENT_OUTCOMES = ('timeout', 'SERVFAIL', 'REFUSED', 'network')
+
+'''
+When and how often failed queries are retried: transient failures are retried up to max_attempts
+times in total, after a full-jitter exponential backoff, until deadline seconds after the first failure.
+'''
+class RetryPolicy:
+    def __init__(self, max_attempts : int = 4, base_delay : float = 0.5, max_delay : float = 8.0,
+                 deadline : float = 30.0):
+        '''
+        @Keyword arguments:
+        max_attempts(int): Total attempts per query including the first, 1 disables retries
+        base_delay(float): Upper bound in seconds of the first backoff, doubled on every attempt
+        max_delay(float): Largest backoff upper bound in seconds
+        deadline(float): Seconds after its first failure that a query is given up on
+        '''
+        self._max_attempts = max_attempts
+        self._base_delay = base_delay
+        self._max_delay = max_delay
+        self._deadline = deadline
+
+
+    def retry_at(self, outcome : str, attempts : int, first_failed : float) -> float:
+        '''
+        Returns the time.monotonic() at which to retry a failed query, or None to give up on it
+
+        @Keyword arguments:
+        outcome(str): Outcome of the last attempt, as classified by ResolverMetrics
+        attempts(int): Number of attempts made so far
+        first_failed(float): time.monotonic() of the query's first failure
+        '''
+        if outcome not in TRANSIENT_OUTCOMES or attempts >= self._max_attempts:
+            return None
+        backoff = random.uniform(0, min(self._max_delay, self._base_delay * 2 ** (attempts - 1)))
+        retry_at = time.monotonic() + backoff
+        if retry_at > first_failed + self._deadline:
+            return None
+        return retry_at
+
+
+'''Deferred queue of failed queries, ordered by the time they are due to be retried'''
+class RetryScheduler:
+    def __init__(self):
+        self._heap : List[Tuple[float, int, int]] = []
+
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+
+    def defer(self, retry_at : float, index : int, attempts : int):
+        '''
+        Queues a query for a retry
+
+        @Keyword arguments:
+        retry_at(float): time.monotonic() the retry is due
+        index(int): Index of the query
+        attempts(int): Number of attempts made so far
+        '''
+        heapq.heappush(self._heap, (retry_at, index, attempts))
+
+
+    def pop_due(self) -> List[Tuple[int, int]]:
+        '''Removes and returns (index, attempts) of every query that is due'''
+        now = time.monotonic()
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            _, index, attempts = heapq.heappop(self._heap)
+            due.append((index, attempts))
+        return due
+
+
+    def seconds_until_due(self) -> float:
+        '''Returns how long until the next query is due, None if the queue is empty'''
+        if not self._heap:
+            return None
+        return max(0, self._heap[0][0] - time.monotonic())
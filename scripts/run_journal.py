@@ -0,0 +1,174 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+from typing import Dict, List
+
+JOURNAL_DIRECTORY = 'outputs/journal'
+
+'''
+Checkpoint journal of a run. Every stage appends each resolved key to its own
+JSON-lines journal as soon as it completes, and a manifest records the run settings
+and the progress of every stage so an interrupted run can be resumed.
+'''
+class RunJournal:
+    def __init__(self, tranco_file : str, records : int, resume : bool = False, first_rank : int = 1,
+                 directory : str = JOURNAL_DIRECTORY, flush_interval : int = 1000, stages : List[str] = None):
+        '''
+        @Keyword arguments:
+        tranco_file(str): The Tranco list being resolved, hashed into the manifest
+        records(int): Number of Tranco records being resolved
+        resume(bool): Keep the journal of a previous run with the same settings instead of starting over
+        first_rank(int): Rank of the first Tranco record being resolved
+        directory(str): Directory holding the manifest and stage journals
+        flush_interval(int): Number of journaled results between flushes to disk
+        stages(List[str]): Stages this run journals, None for every stage. Without resume only their
+        journals are started over, the others are kept for a later resume of the same settings.
+        '''
+        self._directory = directory
+        self._flush_interval = flush_interval
+        self._manifest_path = os.path.join(directory, 'manifest.json')
+        self._lock = threading.Lock()
+        self._entries : Dict[str, Dict] = {}
+        self._files : Dict = {}
+        self._unflushed = 0
+
+        manifest = {
+            'tranco_file': tranco_file, 'tranco_sha256': self.__hash_file(tranco_file),
+            'first_rank': first_rank, 'records': records, 'stages': {}
+        }
+        previous = None
+        if os.path.exists(self._manifest_path):
+            with open(self._manifest_path, 'r') as manifest_file:
+                previous = json.load(manifest_file)
+        same_run = previous is not None and \
+            (previous['tranco_sha256'], previous.get('first_rank', 1), previous['records']) == (manifest['tranco_sha256'], first_rank, records)
+        if resume and previous is not None:
+            if not same_run:
+                raise Exception(f'Cannot resume: journal in {directory} was recorded for a different Tranco list or rank range.')
+            manifest = previous
+        elif stages is not None and same_run:
+            manifest = previous
+            for stem in stages:
+                manifest['stages'].pop(stem, None)
+                journal_path = os.path.join(directory, f'{stem}.jsonl')
+                if os.path.exists(journal_path):
+                    os.remove(journal_path)
+        elif os.path.exists(directory):
+            # journals of other settings can never be resumed
+            shutil.rmtree(directory)
+        os.makedirs(directory, exist_ok=True)
+        self._manifest = manifest
+        self.__write_manifest()
+
+
+    def __hash_file(self, file_name : str) -> str:
+        '''
+        Private function returning the SHA-256 of a file
+
+        @Keyword arguments:
+        file_name(str): Name of the file to hash
+        '''
+        digest = hashlib.sha256()
+        with open(file_name, 'rb') as hashed_file:
+            for chunk in iter(lambda: hashed_file.read(1 << 20), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+
+    def __write_manifest(self):
+        '''Private function that atomically rewrites the manifest'''
+        temporary_path = f'{self._manifest_path}.tmp'
+        with open(temporary_path, 'w') as manifest_file:
+            json.dump(self._manifest, manifest_file, indent=4)
+        os.replace(temporary_path, self._manifest_path)
+
+
+    def load(self, stem : str) -> Dict:
+        '''
+        Returns every key already resolved by a stage. The returned dict keeps growing as results are recorded.
+
+        @Keyword arguments:
+        stem(str): Name of the stage output, e.g. domains_nameservers
+        '''
+        with self._lock:
+            if stem not in self._entries:
+                entries = {}
+                journal_path = os.path.join(self._directory, f'{stem}.jsonl')
+                if os.path.exists(journal_path):
+                    with open(journal_path, 'r') as journal_file:
+                        for line in journal_file:
+                            try:
+                                key, value = json.loads(line)
+                            except ValueError:
+                                # last line of an interrupted run may be partial
+                                continue
+                            entries[key] = value
+                self._entries[stem] = entries
+                self._manifest['stages'].setdefault(stem, {'status': 'running', 'resolved': len(entries)})
+            return self._entries[stem]
+
+
+    def record(self, stem : str, key : str, value):
+        '''
+        Appends a resolved key to the stage journal. Failed resolutions (None) are not journaled, so a resume retries them.
+
+        @Keyword arguments:
+        stem(str): Name of the stage output
+        key(str): The resolved key
+        value: The resolution result
+        '''
+        if value is None:
+            return
+        entries = self.load(stem)
+        with self._lock:
+            if stem not in self._files:
+                self._files[stem] = open(os.path.join(self._directory, f'{stem}.jsonl'), 'a')
+            self._files[stem].write(json.dumps([key, value]) + '\n')
+            entries[key] = value
+            self._unflushed += 1
+            if self._unflushed >= self._flush_interval:
+                self.__flush()
+
+
+    def __flush(self):
+        '''Private function that flushes the stage journals and updates stage progress. Caller holds the lock.'''
+        for journal_file in self._files.values():
+            journal_file.flush()
+        for stem, entries in self._entries.items():
+            self._manifest['stages'][stem]['resolved'] = len(entries)
+        self.__write_manifest()
+        self._unflushed = 0
+
+
+    def complete(self, stem : str):
+        '''
+        Marks a stage as complete once its output has been written
+
+        @Keyword arguments:
+        stem(str): Name of the stage output
+        '''
+        self.load(stem)
+        with self._lock:
+            self._manifest['stages'][stem]['status'] = 'complete'
+            self.__flush()
+
+
+    def is_complete(self, stem : str) -> bool:
+        '''
+        Checks whether a stage finished in the journaled run
+
+        @Keyword arguments:
+        stem(str): Name of the stage output
+        '''
+        return self._manifest['stages'].get(stem, {}).get('status') == 'complete'
+
+
+    def close(self):
+        '''Flushes and closes every stage journal'''
+        with self._lock:
+            self.__flush()
+            for journal_file in self._files.values():
+                journal_file.close()
+            self._files = {}
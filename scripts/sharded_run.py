@@ -0,0 +1,250 @@
+import csv
+import json
+import os
+import subprocess
+import zlib
+from typing import List, Dict
+from .columnar_store import ColumnarStore, StringTable, write_columnar
+from .tranco_list import TrancoList
+
+SHARD_DIRECTORY = 'outputs/shards'
+# Stage outputs in pipeline order, and whether each key maps to a single value
+STAGES = (
+    ('domains_nameservers', False), ('nameserver_ips', False),
+    ('ip_to_asn_mapping', False), ('asn_to_org_mapping', True)
+)
+
+def shard_of(domain : str, shards : int) -> int:
+    '''
+    Returns the shard a domain belongs to, stable across processes and machines
+
+    @Keyword arguments:
+    domain(str): The domain from the Tranco list
+    shards(int): Total number of shards
+    '''
+    return zlib.crc32(domain.lower().encode()) % shards
+
+
+'''
+Splits a run across shards of the Tranco list, partitioned by a hash of each domain.
+Every shard runs the whole stage pipeline in its own process with its own project directory
+(<directory>/<shard>/outputs), so shards can also run on separate machines sharing the directory.
+merge() then combines the shard outputs, and the glue of their nameservers, into the regular /outputs files:
+domains keep their Tranco rank order, every other stage output follows the order its keys are first
+reached in, and a key resolved by several shards takes the value of the lowest shard.
+'''
+class ShardedRun:
+    def __init__(self, shards : int, tranco : TrancoList = None, directory : str = SHARD_DIRECTORY):
+        '''
+        @Keyword arguments:
+        shards(int): Number of shards the Tranco list is partitioned into
+        tranco(TrancoList): The Tranco list and rank range being partitioned, the top 10k of outputs/top-1m.csv by default
+        directory(str): Directory holding the project directory of every shard
+        '''
+        if shards < 1:
+            raise Exception(f'Shards: {shards} must be at least 1.')
+        self._shards = shards
+        self._tranco = tranco if tranco is not None else TrancoList(last_rank = 10000)
+        self._directory = os.path.abspath(directory)
+
+
+    def shard_directory(self, shard : int) -> str:
+        '''
+        Returns the project directory a shard runs in
+
+        @Keyword arguments:
+        shard(int): Index of the shard
+        '''
+        return os.path.join(self._directory, str(shard))
+
+
+    def prepare_shard(self, shard : int) -> str:
+        '''
+        Writes the part of the Tranco list that belongs to a shard, keeping each domain's rank,
+        and returns the project directory the shard runs in
+
+        @Keyword arguments:
+        shard(int): Index of the shard
+        '''
+        if not 0 <= shard < self._shards:
+            raise Exception(f'Shard: {shard} is not between 0 and {self._shards - 1}.')
+        outputs_directory = os.path.join(self.shard_directory(shard), 'outputs')
+        os.makedirs(outputs_directory, exist_ok=True)
+        temporary_path = os.path.join(outputs_directory, 'top-1m.csv.tmp')
+        with open(temporary_path, 'w', newline='') as csvfile:
+            csv.writer(csvfile).writerows(
+                (rank, domain) for rank, domain in self._tranco.rows() if shard_of(domain, self._shards) == shard
+            )
+        # Replaced atomically and byte-identical across reruns, so a resumed shard keeps its journal
+        os.replace(temporary_path, os.path.join(outputs_directory, 'top-1m.csv'))
+        return self.shard_directory(shard)
+
+
+    def run_workers(self, command : List[str]):
+        '''
+        Runs every shard in its own process and waits for all of them, logging each to <shard>/outputs/run.log
+
+        @Keyword arguments:
+        command(List[str]): The run.py command line, --shard <index> is appended for each shard
+        '''
+        workers = []
+        for shard in range(self._shards):
+            log_path = os.path.join(self.shard_directory(shard), 'outputs', 'run.log')
+            os.makedirs(os.path.dirname(log_path), exist_ok=True)
+            with open(log_path, 'w') as log_file:
+                workers.append(subprocess.Popen(command + ['--shard', str(shard)], stdout=log_file, stderr=subprocess.STDOUT))
+        failed = []
+        for shard, worker in enumerate(workers):
+            if worker.wait() != 0:
+                failed.append(shard)
+        if failed:
+            raise Exception(f'Shards: {failed} failed, see their outputs/run.log in {self._directory}.')
+
+
+    def __read_shard(self, shard : int, stem : str, output_format : str) -> Dict:
+        '''
+        Private function reading one stage output of a shard
+
+        @Keyword arguments:
+        shard(int): Index of the shard
+        stem(str): Name of the stage output
+        output_format(str): Layout the shard wrote its outputs in
+        '''
+        outputs_directory = os.path.join(self.shard_directory(shard), 'outputs')
+        if output_format == 'json':
+            with open(os.path.join(outputs_directory, f'{stem}.json'), 'r') as jsonfile:
+                return json.load(jsonfile)
+        return dict(ColumnarStore(stem, directory=os.path.join(outputs_directory, 'columns')).items())
+
+
+    def __read_failures(self, shard : int, stem : str) -> Dict[str, str]:
+        '''
+        Private function reading why keys are missing from one stage output of a shard
+
+        @Keyword arguments:
+        shard(int): Index of the shard
+        stem(str): Name of the stage output
+        '''
+        with open(os.path.join(self.shard_directory(shard), 'outputs', f'{stem}_failures.json'), 'r') as jsonfile:
+            return json.load(jsonfile)
+
+
+    def __merge_shards(self, stem : str, output_format : str) -> Dict:
+        '''
+        Private function combining one stage output of every shard, a key resolved by several shards
+        taking the value of the lowest shard
+
+        @Keyword arguments:
+        stem(str): Name of the stage output
+        output_format(str): Layout the shards wrote their outputs in
+        '''
+        merged : Dict = {}
+        for shard in range(self._shards):
+            for key, value in self.__read_shard(shard, stem, output_format).items():
+                merged.setdefault(key, value)
+        return merged
+
+
+    def __write_output(self, stem : str, output : Dict, scalar : bool, output_format : str, table : StringTable):
+        '''
+        Private function writing a merged stage output in the configured layout(s)
+
+        @Keyword arguments:
+        stem(str): Name of the stage output
+        output(Dict): The merged stage output
+        scalar(bool): Whether each key maps to a single value instead of a list
+        output_format(str): 'json', 'columnar' or 'both'
+        table(StringTable): String table shared by the columnar outputs, None for JSON only
+        '''
+        if output_format != 'columnar':
+            with open(f'outputs/{stem}.json', 'w') as jsonfile:
+                json.dump(output, jsonfile, indent=4)
+        if output_format != 'json':
+            write_columnar(stem, output, scalar, table)
+
+
+    def merge(self, output_format : str = 'json') -> Dict[str, int]:
+        '''
+        Combines the stage outputs and failures of every shard into /outputs,
+        returning the number of keys that failed in every stage
+
+        @Keyword arguments:
+        output_format(str): 'json', 'columnar' or 'both', the layout shards wrote and the merged outputs are written in
+        '''
+        ranked_domains = list(self._tranco.domains())
+        table = StringTable(writable=True) if output_format != 'json' else None
+        failed_resolutions : Dict[str, int] = {}
+        order : List[str] = ranked_domains
+        for stem, scalar in STAGES:
+            merged = self.__merge_shards(stem, output_format)
+            failures : Dict[str, str] = {}
+            for shard in range(self._shards):
+                for key, reason in self.__read_failures(shard, stem).items():
+                    failures.setdefault(key, reason)
+            # Keys reached from the previous stage in order, ASNs have no such order and are sorted
+            if stem == 'asn_to_org_mapping':
+                order = sorted(merged, key=lambda asn: (len(asn), asn))
+            output = {key: merged[key] for key in dict.fromkeys(order) if key in merged}
+            # A key can fail in one shard and resolve in another
+            failures = {key: reason for key, reason in sorted(failures.items()) if key not in output}
+
+            self.__write_output(stem, output, scalar, output_format, table)
+            with open(f'outputs/{stem}_failures.json', 'w') as jsonfile:
+                json.dump(failures, jsonfile, indent=4)
+            failed_resolutions[stem] = len(failures)
+            order = [value for values in output.values() for value in ([values] if scalar else values)]
+            if stem == 'domains_nameservers':
+                # glue harvested alongside Step 1, keyed by nameserver in the order Step 2 reaches them
+                glue = self.__merge_shards('nameserver_glue', output_format)
+                output = {nameserver: glue[nameserver] for nameserver in dict.fromkeys(order) if nameserver in glue}
+                self.__write_output('nameserver_glue', output, False, output_format, table)
+        return failed_resolutions
+
+
+    def merge_metrics(self, output_file_name : str = 'outputs/metrics.json') -> Dict:
+        '''
+        Combines the ResolverMetrics summary of every shard and writes it, returning the combined summary.
+        Shards run side by side, so elapsed time is the slowest shard's and lookups, outcomes and
+        in-flight gauges are summed. Latency quantiles and maxima are the worst shard's,
+        and every shard's own summary is kept under 'shards'.
+
+        @Keyword arguments:
+        output_file_name(str): Name of the combined metrics JSON file
+        '''
+        shard_summaries = []
+        for shard in range(self._shards):
+            with open(os.path.join(self.shard_directory(shard), 'outputs', 'metrics.json'), 'r') as jsonfile:
+                shard_summaries.append(json.load(jsonfile))
+
+        record_types : Dict[str, Dict] = {}
+        for summary in shard_summaries:
+            for record_type, metrics in summary['record_types'].items():
+                combined = record_types.setdefault(record_type, {
+                    'lookups': 0, 'outcomes': {}, 'latency_ms': {'count': 0, 'mean': 0}, 'in_flight': 0, 'peak_in_flight': 0
+                })
+                combined['lookups'] += metrics['lookups']
+                for outcome, count in metrics['outcomes'].items():
+                    combined['outcomes'][outcome] = combined['outcomes'].get(outcome, 0) + count
+                latency, shard_latency = combined['latency_ms'], metrics['latency_ms']
+                count = latency['count'] + shard_latency['count']
+                if count:
+                    latency['mean'] = (latency['mean'] * latency['count'] + shard_latency['mean'] * shard_latency['count']) / count
+                latency['count'] = count
+                for name, value in shard_latency.items():
+                    if name not in ('count', 'mean'):
+                        latency[name] = max(latency.get(name, 0), value)
+                combined['in_flight'] += metrics['in_flight']
+                combined['peak_in_flight'] += metrics['peak_in_flight']
+
+        elapsed = max(summary['elapsed_seconds'] for summary in shard_summaries)
+        lookups = sum(metrics['lookups'] for metrics in record_types.values())
+        summary = {
+            'elapsed_seconds': elapsed,
+            'lookups': lookups,
+            'lookups_per_second': lookups / elapsed if elapsed > 0 else 0,
+            'record_types': record_types,
+            'shards': shard_summaries
+        }
+        with open(output_file_name, 'w') as jsonfile:
+            json.dump(summary, jsonfile, indent=4)
+        return summary
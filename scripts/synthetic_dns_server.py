@@ -0,0 +1,387 @@
+import asyncio
+import hashlib
+import ipaddress
+import json
+import multiprocessing
+import os
+import random
+import signal
+import socket
+import sys
+import zlib
+from argparse import ArgumentParser
+from typing import List, Dict, Tuple
+import dns.flags
+import dns.message
+import dns.name
+import dns.rcode
+import dns.rdataclass
+import dns.rdatatype
+import dns.rdtypes.ANY.TXT
+import dns.rrset
+
+'''
+Local stand-in for the recursive resolver and Team Cymru (DNS and bulk whois), used by benchmark.py.
+Answers NS, A, AAAA and Team Cymru TXT queries from the shipped outputs/*.json: known domains, nameservers,
+IPs and ASNs get their recorded answers and any other name gets a stable answer drawn from them,
+so a Tranco list of any size resolves into data shaped like a real run. One in four nameservers
+also gets a synthetic IPv6 address, every other AAAA query has no answer. NS answers carry
+A and AAAA glue for about half of their nameservers, drawn independently of IPv6.
+'''
+class SyntheticZone:
+    def __init__(self, dataset_directory : str = 'outputs'):
+        '''
+        @Keyword arguments:
+        dataset_directory(str): Directory holding the shipped stage outputs
+        '''
+        def read(stem):
+            with open(os.path.join(dataset_directory, f'{stem}.json'), 'r') as jsonfile:
+                return json.load(jsonfile)
+
+        self._domains_nameservers : Dict[str, List[str]] = read('domains_nameservers')
+        # Earlier outputs map each nameserver to a single IPv4 address
+        self._nameserver_ips : Dict[str, List[str]] = {
+            nameserver: [ips] if isinstance(ips, str) else ips for nameserver, ips in read('nameserver_ips').items()
+        }
+        self._ip_to_asn : Dict[str, List[str]] = read('ip_to_asn_mapping')
+        self._asn_to_org : Dict[str, str] = read('asn_to_org_mapping')
+        self._nameserver_sets : List[List[str]] = list(self._domains_nameservers.values())
+        self._asns : List[str] = list(self._asn_to_org)
+
+
+    def domains(self) -> List[str]:
+        '''Returns the shipped domains in rank order'''
+        return list(self._domains_nameservers)
+
+
+    def __pick(self, name : str, choices : List):
+        '''
+        Private function drawing a stable choice for a name that is not in the shipped outputs
+
+        @Keyword arguments:
+        name(str): The name being answered
+        choices(List): The values to draw from
+        '''
+        return choices[zlib.crc32(name.encode()) % len(choices)]
+
+
+    def has_glue(self, nameserver : str) -> bool:
+        '''
+        Returns whether NS answers carry the addresses of a nameserver in their additional section
+
+        @Keyword arguments:
+        nameserver(str): The nameserver without its trailing dot
+        '''
+        # A salted digest rather than CRC32: CRC32 is linear, so even a salted CRC32 would tie glue to the
+        # synthetic IPv6 draw of answer() and leave every IPv6 nameserver with glue
+        return hashlib.blake2b(nameserver.encode(), digest_size=1, salt=b'glue').digest()[0] % 2 == 0
+
+
+    def origins(self, ip : str) -> List[str]:
+        '''
+        Returns the ASNs announcing an IP
+
+        @Keyword arguments:
+        ip(str): The IPv4 or IPv6 address
+        '''
+        return self._ip_to_asn.get(ip, None) or [self.__pick(ip, self._asns)]
+
+
+    def organization(self, asn : str) -> str:
+        '''
+        Returns the AS name of an ASN
+
+        @Keyword arguments:
+        asn(str): The ASN without the AS prefix
+        '''
+        return self._asn_to_org.get(asn, f'AS{asn}-SYNTHETIC, US')
+
+
+    def answer(self, qname : str, rdtype : str) -> List[str]:
+        '''
+        Returns the text of every record answering the query, or None for NXDOMAIN
+
+        @Keyword arguments:
+        qname(str): The query name without its trailing dot
+        rdtype(str): The record type of the query
+        '''
+        if rdtype == 'NS':
+            nameservers = self._domains_nameservers.get(qname, None)
+            return nameservers if nameservers is not None else self.__pick(qname, self._nameserver_sets)
+        if rdtype in ('A', 'AAAA'):
+            version = 4 if rdtype == 'A' else 6
+            ips = self._nameserver_ips.get(f'{qname}.', None)
+            if ips is not None:
+                return [ip for ip in ips if ipaddress.ip_address(ip).version == version]
+            hashed = zlib.crc32(qname.encode())
+            if version == 4:
+                return [f'10.{hashed >> 16 & 255}.{hashed >> 8 & 255}.{hashed & 255}']
+            return [f'2001:db8:{hashed >> 16:x}::{hashed & 0xffff:x}'] if hashed % 4 == 0 else []
+        if rdtype == 'TXT' and qname.endswith('.origin.asn.cymru.com'):
+            ip = '.'.join(reversed(qname.split('.')[:4]))
+            return [f'{" ".join(self.origins(ip))} | {ip}/24 | US | arin | 2000-01-01']
+        if rdtype == 'TXT' and qname.endswith('.origin6.asn.cymru.com'):
+            nibbles = ''.join(reversed(qname.split('.')[:32]))
+            ip = str(ipaddress.ip_address(int(nibbles, 16)))
+            return [f'{" ".join(self.origins(ip))} | {ip}/48 | US | arin | 2000-01-01']
+        if rdtype == 'TXT' and qname.startswith('AS') and qname.endswith('.asn.cymru.com'):
+            asn = qname.split('.')[0][2:]
+            return [f'{asn} | US | arin | 2000-01-01 | {self.organization(asn)}']
+        return None
+
+
+'''Protocol answering queries from a SyntheticZone with configurable latency, loss and failures'''
+class SyntheticDNSProtocol(asyncio.DatagramProtocol):
+    def __init__(self, zone : SyntheticZone, latency : float, jitter : float, loss : float,
+                 servfail_rate : float, nxdomain_rate : float, seed : int):
+        self._zone = zone
+        self._latency = latency
+        self._jitter = jitter
+        self._loss = loss
+        self._servfail_rate = servfail_rate
+        self._nxdomain_rate = nxdomain_rate
+        self._random = random.Random(seed)
+        self._transport = None
+
+
+    def connection_made(self, transport):
+        self._transport = transport
+
+
+    def __respond(self, query : dns.message.Message) -> dns.message.Message:
+        '''
+        Private function building the response to a query
+
+        @Keyword arguments:
+        query(dns.message.Message): The parsed query
+        '''
+        response = dns.message.make_response(query)
+        response.flags |= dns.flags.RA
+        question = query.question[0]
+        if self._random.random() < self._servfail_rate:
+            response.set_rcode(dns.rcode.SERVFAIL)
+            return response
+        rdtype = dns.rdatatype.to_text(question.rdtype)
+        qname = question.name.to_text(omit_final_dot=True)
+        records = self._zone.answer(qname, rdtype)
+        if records is None or (rdtype == 'NS' and self._random.random() < self._nxdomain_rate):
+            response.set_rcode(dns.rcode.NXDOMAIN)
+            return response
+        if not records:
+            return response
+        if rdtype == 'TXT':
+            rdatas = [dns.rdtypes.ANY.TXT.TXT(dns.rdataclass.IN, dns.rdatatype.TXT, [record.encode()]) for record in records]
+            response.answer.append(dns.rrset.from_rdata_list(question.name, 300, rdatas))
+        else:
+            response.answer.append(dns.rrset.from_text_list(question.name, 300, 'IN', rdtype, records))
+        if rdtype == 'NS':
+            for nameserver in records:
+                nameserver = nameserver.rstrip('.')
+                if not self._zone.has_glue(nameserver):
+                    continue
+                for glue_type in ('A', 'AAAA'):
+                    addresses = self._zone.answer(nameserver, glue_type)
+                    if addresses:
+                        response.additional.append(dns.rrset.from_text_list(f'{nameserver}.', 300, 'IN', glue_type, addresses))
+        return response
+
+
+    def datagram_received(self, data : bytes, addr : Tuple):
+        if self._random.random() < self._loss:
+            return
+        try:
+            wire = self.__respond(dns.message.from_wire(data)).to_wire()
+        except Exception:
+            return
+        delay = self._latency + self._random.random() * self._jitter
+        if delay > 0:
+            asyncio.get_running_loop().call_later(delay, self._transport.sendto, wire, addr)
+        else:
+            self._transport.sendto(wire, addr)
+
+
+'''
+Team Cymru bulk whois stand-in: answers one IP or AS<number> per line between 'begin' and 'end',
+in the pipe-delimited layout of whois.cymru.com, and closes the connection after 'end'
+'''
+class SyntheticWhoisProtocol(asyncio.Protocol):
+    def __init__(self, zone : SyntheticZone):
+        self._zone = zone
+        self._transport = None
+        self._buffer = b''
+        self._verbose = False
+
+
+    def connection_made(self, transport):
+        self._transport = transport
+
+
+    def __respond(self, key : str) -> List[str]:
+        '''
+        Private function building the response lines to one key
+
+        @Keyword arguments:
+        key(str): An IP or AS<number>
+        '''
+        if key.upper().startswith('AS'):
+            asn = key[2:]
+            if self._verbose:
+                return [f'{asn:<8}| US | arin     | 2000-01-01 | {self._zone.organization(asn)}']
+            return [f'{asn:<8}| {self._zone.organization(asn)}']
+        try:
+            ip = str(ipaddress.ip_address(key))
+        except ValueError:
+            return [f'Error: no ASN or IP match on line: {key}']
+        prefix = f'{ip}/24' if ':' not in ip else f'{ip}/48'
+        if self._verbose:
+            return [f'{asn:<8}| {ip:<16} | {prefix:<19} | US | arin     | 2000-01-01 | {self._zone.organization(asn)}'
+                    for asn in self._zone.origins(ip)]
+        return [f'{asn:<8}| {ip:<16} | {self._zone.organization(asn)}' for asn in self._zone.origins(ip)]
+
+
+    def data_received(self, data : bytes):
+        self._buffer += data
+        *lines, self._buffer = self._buffer.split(b'\n')
+        response = []
+        for line in lines:
+            key = line.decode(errors='replace').strip()
+            if key == 'begin':
+                response.append('Bulk mode; whois.cymru.com [2000-01-01 00:00:00 +0000]')
+            elif key == 'verbose':
+                self._verbose = True
+            elif key == 'end':
+                self._transport.write(''.join(f'{line}\n' for line in response).encode())
+                self._transport.close()
+                return
+            elif key:
+                response += self.__respond(key)
+        if response:
+            self._transport.write(''.join(f'{line}\n' for line in response).encode())
+
+
+def _serve(host : str, port : int, protocol_options : Dict, dataset_directory : str, ready, whois_port : int = None):
+    '''
+    Runs one server process until it is terminated
+
+    @Keyword arguments:
+    host(str): Address to listen on
+    port(int): UDP port to listen on, shared by every process through SO_REUSEPORT
+    protocol_options(Dict): Keyword arguments of SyntheticDNSProtocol besides the zone
+    dataset_directory(str): Directory holding the shipped stage outputs
+    ready: Event set once the socket is bound
+    whois_port(int): TCP port of the bulk whois stand-in, None to not serve it
+    '''
+    zone = SyntheticZone(dataset_directory)
+    server_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+    server_socket.bind((host, port))
+
+    async def serve_forever():
+        await asyncio.get_running_loop().create_datagram_endpoint(
+            lambda: SyntheticDNSProtocol(zone, **protocol_options), sock=server_socket
+        )
+        if whois_port is not None:
+            await asyncio.get_running_loop().create_server(
+                lambda: SyntheticWhoisProtocol(zone), host, whois_port, reuse_port=True
+            )
+        ready.set()
+        await asyncio.Event().wait()
+
+    asyncio.run(serve_forever())
+
+
+'''Runs SyntheticDNSProtocol in one or more background processes sharing one UDP port'''
+class SyntheticDNSServer:
+    def __init__(self, host : str = '127.0.0.1', port : int = 8053, latency : float = 0, jitter : float = 0,
+                 loss : float = 0, servfail_rate : float = 0, nxdomain_rate : float = 0, processes : int = 1,
+                 seed : int = 0, dataset_directory : str = 'outputs', whois_port : int = None):
+        '''
+        @Keyword arguments:
+        host(str): Address to listen on
+        port(int): UDP port to listen on
+        latency(float): Seconds every response is delayed by
+        jitter(float): Maximum extra seconds of uniformly random delay per response
+        loss(float): Fraction of queries silently dropped
+        servfail_rate(float): Fraction of queries answered with SERVFAIL
+        nxdomain_rate(float): Fraction of NS queries answered with NXDOMAIN
+        processes(int): Number of server processes, each answering a share of the queries
+        seed(int): Seed of the random latency, loss and failures
+        dataset_directory(str): Directory holding the shipped stage outputs
+        whois_port(int): TCP port to also serve Team Cymru's bulk whois interface on, None to not serve it
+        '''
+        self._host = host
+        self._port = port
+        self._processes = processes
+        self._seed = seed
+        self._dataset_directory = dataset_directory
+        self._whois_port = whois_port
+        self._protocol_options = {
+            'latency': latency, 'jitter': jitter, 'loss': loss,
+            'servfail_rate': servfail_rate, 'nxdomain_rate': nxdomain_rate
+        }
+        self._workers : List[multiprocessing.Process] = []
+
+
+    def start(self):
+        '''Starts every server process and waits until all of them are listening'''
+        for index in range(self._processes):
+            ready = multiprocessing.Event()
+            options = dict(self._protocol_options, seed = self._seed + index)
+            worker = multiprocessing.Process(
+                target=_serve, args=(self._host, self._port, options, self._dataset_directory, ready, self._whois_port),
+                daemon=True
+            )
+            worker.start()
+            if not ready.wait(timeout=30):
+                self.stop()
+                raise Exception(f'Synthetic DNS server failed to listen on {self._host}:{self._port}.')
+            self._workers.append(worker)
+
+
+    def stop(self):
+        '''Terminates every server process'''
+        for worker in self._workers:
+            worker.terminate()
+            worker.join()
+        self._workers = []
+
+
+    def wait(self):
+        '''Blocks until every server process exits'''
+        for worker in self._workers:
+            worker.join()
+
+
+    def __enter__(self):
+        self.start()
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+if __name__ == '__main__':
+    arg_parser = ArgumentParser(description='Synthetic DNS server answering from the shipped outputs')
+    arg_parser.add_argument('--host', default='127.0.0.1')
+    arg_parser.add_argument('--port', type=int, default=8053)
+    arg_parser.add_argument('--latency', type=float, default=0)
+    arg_parser.add_argument('--jitter', type=float, default=0)
+    arg_parser.add_argument('--loss', type=float, default=0)
+    arg_parser.add_argument('--servfail', dest='servfail_rate', type=float, default=0)
+    arg_parser.add_argument('--nxdomain', dest='nxdomain_rate', type=float, default=0)
+    arg_parser.add_argument('--processes', type=int, default=1)
+    arg_parser.add_argument('--whois-port', dest='whois_port', type=int, default=None)
+    settings = arg_parser.parse_args()
+    server = SyntheticDNSServer(**vars(settings))
+    # Stop the server processes when killed as well as on Ctrl+C
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    server.start()
+    print(f'Serving on {settings.host}:{settings.port}, press Ctrl+C to stop')
+    try:
+        server.wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
@@ -0,0 +1,137 @@
+import io
+import mmap
+import os
+import zipfile
+from typing import Iterator, Tuple
+
+TRANCO_FILE = 'outputs/top-1m.csv'
+
+'''
+Lazy reader of a Tranco list, either the rank,domain CSV or the .zip download holding it.
+Domains are yielded one at a time in rank order instead of being parsed into a list up front,
+and only the records whose rank lies in [first_rank, last_rank] are read.
+
+A CSV is memory-mapped and, when a range does not start at its first record, indexed by the start
+offset of every line, so the first record of the range is found by binary search and nothing before
+it is parsed. NumPy is only imported to build that index. A .zip member is compressed
+and cannot be mapped, so it is decompressed as a stream instead, skipping records below the range.
+Ranks are expected to ascend through the file, as they do in Tranco lists and shard lists.
+'''
+class TrancoList:
+    def __init__(self, path : str = TRANCO_FILE, first_rank : int = 1, last_rank : int = None):
+        '''
+        @Keyword arguments:
+        path(str): The Tranco CSV, or the .zip download holding it
+        first_rank(int): Rank of the first record read
+        last_rank(int): Rank of the last record read, None to read until the end of the list
+        '''
+        if first_rank < 1 or (last_rank is not None and last_rank < first_rank):
+            raise Exception(f'Ranks: {first_rank} to {last_rank} is not a valid range of the Tranco list.')
+        self._path = os.path.abspath(path)
+        self._first_rank = first_rank
+        self._last_rank = last_rank
+        # start offset of every line of the CSV, built on first use
+        self._offsets = None
+
+
+    @property
+    def path(self) -> str:
+        '''Absolute path of the list'''
+        return self._path
+
+
+    @property
+    def first_rank(self) -> int:
+        '''Rank of the first record read'''
+        return self._first_rank
+
+
+    @property
+    def last_rank(self) -> int:
+        '''Rank of the last record read, None if the list is read until the end'''
+        return self._last_rank
+
+
+    def __parse(self, line : bytes) -> Tuple[int, str]:
+        '''
+        Private function splitting a rank,domain line
+
+        @Keyword arguments:
+        line(bytes): One line of the list
+        '''
+        rank, _, domain = line.rstrip(b'\r\n').partition(b',')
+        return int(rank), domain.decode()
+
+
+    def __index(self, buffer : mmap.mmap):
+        '''
+        Private function returning the start offset of every line of the mapped CSV as a NumPy array, built on first use
+
+        @Keyword arguments:
+        buffer(mmap.mmap): The memory-mapped CSV
+        '''
+        if self._offsets is None:
+            import numpy as np
+            newlines = np.flatnonzero(np.frombuffer(buffer, dtype=np.uint8) == ord('\n'))
+            starts = np.concatenate(([0], newlines + 1))
+            self._offsets = starts[starts < len(buffer)]
+        return self._offsets
+
+
+    def __mapped_rows(self) -> Iterator[Tuple[int, str]]:
+        '''Private function yielding the (rank, domain) records of the range from the memory-mapped CSV'''
+        with open(self._path, 'rb') as csvfile:
+            if os.fstat(csvfile.fileno()).st_size == 0:
+                return
+            with mmap.mmap(csvfile.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                if self.__parse(buffer.readline())[0] < self._first_rank:
+                    # binary search for the first line whose rank is in the range
+                    offsets = self.__index(buffer)
+                    low, high = 0, len(offsets)
+                    while low < high:
+                        middle = (low + high) // 2
+                        buffer.seek(int(offsets[middle]))
+                        if self.__parse(buffer.readline())[0] < self._first_rank:
+                            low = middle + 1
+                        else:
+                            high = middle
+                    buffer.seek(int(offsets[low]) if low < len(offsets) else len(buffer))
+                else:
+                    buffer.seek(0)
+                for line in iter(buffer.readline, b''):
+                    rank, domain = self.__parse(line)
+                    if self._last_rank is not None and rank > self._last_rank:
+                        break
+                    yield rank, domain
+
+
+    def __zipped_rows(self) -> Iterator[Tuple[int, str]]:
+        '''Private function yielding the (rank, domain) records of the range from the CSV inside the .zip'''
+        with zipfile.ZipFile(self._path) as archive:
+            members = [member for member in archive.namelist() if member.endswith('.csv')]
+            if len(members) != 1:
+                raise Exception(f'Tranco list: {self._path} should hold exactly one CSV, found {members}.')
+            with archive.open(members[0]) as csvfile:
+                for line in io.BufferedReader(csvfile, 1 << 20):
+                    rank, domain = self.__parse(line)
+                    if rank < self._first_rank:
+                        continue
+                    if self._last_rank is not None and rank > self._last_rank:
+                        break
+                    yield rank, domain
+
+
+    def rows(self) -> Iterator[Tuple[int, str]]:
+        '''Yields the (rank, domain) record of every rank in the range, in rank order'''
+        if zipfile.is_zipfile(self._path):
+            return self.__zipped_rows()
+        return self.__mapped_rows()
+
+
+    def domains(self) -> Iterator[str]:
+        '''Yields the domain of every rank in the range, in rank order'''
+        return (domain for _, domain in self.rows())
+
+
+    def __iter__(self) -> Iterator[str]:
+        return self.domains()
@@ -0,0 +1,206 @@
+import bisect
+import threading
+import time
+import zlib
+from typing import List, Dict
+import dns.asyncresolver
+import dns.resolver
+from .resolver_metrics import ResolverMetrics
+
+# Outcomes that count against the health of an upstream
+UNHEALTHY_OUTCOMES = ('timeout', 'SERVFAIL', 'REFUSED', 'network')
+
+'''One recursive resolver of an UpstreamPool, with its own dnspython resolvers and stats'''
+class Upstream:
+    def __init__(self, address : str, port : int):
+        '''
+        @Keyword arguments:
+        address(str): IP address of the recursive resolver
+        port(int): Port of the recursive resolver
+        '''
+        self.name = f'[{address}]:{port}' if ':' in address else f'{address}:{port}'
+        self.resolver = dns.resolver.Resolver(configure=False)
+        self.resolver.nameservers = [address]
+        self.resolver.port = port
+        self.async_resolver = dns.asyncresolver.Resolver(configure=False)
+        self.async_resolver.nameservers = [address]
+        self.async_resolver.port = port
+        self.outstanding = 0
+        self.peak_outstanding = 0
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        self.ejections = 0
+        self.queries = 0
+        self.total_latency = 0.0
+        self.outcomes : Dict[str, int] = {}
+
+
+'''
+Pool of recursive resolvers queries are spread across.
+'least-outstanding' sends each query to the healthy upstream with the fewest queries in flight,
+'consistent-hash' always sends a query name to the same upstream (keeping each upstream's cache warm for
+its share of names) and only remaps the names of an upstream while it is ejected. An upstream is ejected
+for eject_seconds after eject_after consecutive timeouts, SERVFAILs, REFUSEDs or network errors.
+'''
+class UpstreamPool:
+    ROUTINGS = ('least-outstanding', 'consistent-hash')
+
+    def __init__(self, upstreams : List[str] = None, port : int = 8053, routing : str = 'least-outstanding',
+                 eject_after : int = 5, eject_seconds : float = 30.0, virtual_nodes : int = 64):
+        '''
+        @Keyword arguments:
+        upstreams(List[str]): Addresses of the recursive resolvers, as address or address:port ([address]:port for IPv6)
+        port(int): Port of upstreams given without one
+        routing(str): 'least-outstanding' or 'consistent-hash'
+        eject_after(int): Consecutive failures after which an upstream is ejected
+        eject_seconds(float): Seconds an ejected upstream receives no queries
+        virtual_nodes(int): Points per upstream on the consistent-hash ring
+        '''
+        if routing not in self.ROUTINGS:
+            raise Exception(f'Routing: {routing} not supported.')
+        self._upstreams = [self.__parse(upstream, port) for upstream in (upstreams or ['127.0.0.1'])]
+        self._routing = routing
+        self._eject_after = eject_after
+        self._eject_seconds = eject_seconds
+        self._lock = threading.Lock()
+        self._next = 0
+        ring = sorted(
+            (zlib.crc32(f'{upstream.name}#{node}'.encode()), index)
+            for index, upstream in enumerate(self._upstreams) for node in range(virtual_nodes)
+        )
+        self._ring_hashes = [point for point, _ in ring]
+        self._ring_upstreams = [index for _, index in ring]
+
+
+    def __parse(self, upstream : str, port : int) -> Upstream:
+        '''
+        Private function turning an address[:port] into an Upstream
+
+        @Keyword arguments:
+        upstream(str): address, address:port or [IPv6 address]:port
+        port(int): Port used when none is given
+        '''
+        if upstream.startswith('['):
+            address, _, rest = upstream[1:].partition(']')
+            return Upstream(address, int(rest[1:]) if rest.startswith(':') else port)
+        if upstream.count(':') == 1:
+            address, upstream_port = upstream.split(':')
+            return Upstream(address, int(upstream_port))
+        return Upstream(upstream, port)
+
+
+    def __select(self, query : str) -> Upstream:
+        '''
+        Private function picking the upstream a query is sent to and counting it as outstanding
+
+        @Keyword arguments:
+        query(str): The DNS query
+        '''
+        now = time.monotonic()
+        with self._lock:
+            healthy = [upstream.ejected_until <= now for upstream in self._upstreams]
+            if not any(healthy):
+                # Every upstream is ejected, rather try them all than fail every query
+                healthy = [True] * len(self._upstreams)
+            if self._routing == 'consistent-hash':
+                position = bisect.bisect(self._ring_hashes, zlib.crc32(query.lower().encode()))
+                for step in range(len(self._ring_upstreams)):
+                    index = self._ring_upstreams[(position + step) % len(self._ring_upstreams)]
+                    if healthy[index]:
+                        break
+                upstream = self._upstreams[index]
+            else:
+                # Rotate the starting point so ties are spread evenly
+                self._next = (self._next + 1) % len(self._upstreams)
+                order = list(range(self._next, len(self._upstreams))) + list(range(self._next))
+                upstream = min(
+                    (self._upstreams[index] for index in order if healthy[index]),
+                    key=lambda candidate: candidate.outstanding
+                )
+            upstream.outstanding += 1
+            upstream.peak_outstanding = max(upstream.peak_outstanding, upstream.outstanding)
+        return upstream
+
+
+    def __complete(self, upstream : Upstream, outcome : str, started : float):
+        '''
+        Private function recording the outcome of a query and ejecting the upstream if it keeps failing
+
+        @Keyword arguments:
+        upstream(Upstream): The upstream the query was sent to
+        outcome(str): Outcome of the query, as classified by ResolverMetrics
+        started(float): time.perf_counter() when the query was sent
+        '''
+        latency = time.perf_counter() - started
+        with self._lock:
+            upstream.outstanding -= 1
+            upstream.queries += 1
+            upstream.total_latency += latency
+            upstream.outcomes[outcome] = upstream.outcomes.get(outcome, 0) + 1
+            if outcome not in UNHEALTHY_OUTCOMES:
+                upstream.consecutive_failures = 0
+                return
+            upstream.consecutive_failures += 1
+            if upstream.consecutive_failures >= self._eject_after and upstream.ejected_until <= time.monotonic():
+                upstream.ejected_until = time.monotonic() + self._eject_seconds
+                upstream.ejections += 1
+                # One more failure after it comes back ejects it again
+                upstream.consecutive_failures = self._eject_after - 1
+
+
+    def resolve(self, query : str, record_type : str) -> dns.resolver.Answer:
+        '''
+        Sends a query to the upstream picked by the routing policy
+
+        @Keyword arguments:
+        query(str): The DNS query
+        record_type(str): The record type of the query
+        '''
+        upstream = self.__select(query)
+        started = time.perf_counter()
+        outcome = 'NOERROR'
+        try:
+            return upstream.resolver.resolve(query, record_type)
+        except Exception as e:
+            outcome = ResolverMetrics.classify(e)
+            raise
+        finally:
+            self.__complete(upstream, outcome, started)
+
+
+    async def resolve_async(self, query : str, record_type : str) -> dns.resolver.Answer:
+        '''
+        Asyncio counterpart of resolve
+
+        @Keyword arguments:
+        query(str): The DNS query
+        record_type(str): The record type of the query
+        '''
+        upstream = self.__select(query)
+        started = time.perf_counter()
+        outcome = 'NOERROR'
+        try:
+            return await upstream.async_resolver.resolve(query, record_type)
+        except Exception as e:
+            outcome = ResolverMetrics.classify(e)
+            raise
+        finally:
+            self.__complete(upstream, outcome, started)
+
+
+    def stats(self) -> Dict[str, Dict]:
+        '''Returns the queries, outcomes, latency, load and health of every upstream'''
+        now = time.monotonic()
+        with self._lock:
+            return {
+                upstream.name: {
+                    'queries': upstream.queries,
+                    'outcomes': dict(upstream.outcomes),
+                    'mean_latency_ms': upstream.total_latency / upstream.queries * 1000 if upstream.queries else 0,
+                    'outstanding': upstream.outstanding,
+                    'peak_outstanding': upstream.peak_outstanding,
+                    'ejections': upstream.ejections,
+                    'healthy': upstream.ejected_until <= now
+                }
+                for upstream in self._upstreams
+            }
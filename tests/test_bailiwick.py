@@ -0,0 +1,85 @@
+import pytest
+
+from scripts.bailiwick import BailiwickClassifier, PublicSuffixList, canonical_name, normalize_name
+
+RULES = '''// a few rules of the real list
+com
+uk
+co.uk
+*.ck
+!www.ck
+'''
+
+
+@pytest.fixture
+def public_suffix_list(tmp_path):
+    path = tmp_path / 'public_suffix_list.dat'
+    path.write_text(RULES)
+    return PublicSuffixList(str(path))
+
+
+def registrable(public_suffix_list, name):
+    labels = public_suffix_list.registrable_domain(normalize_name(name))
+    return None if labels is None else '.'.join(reversed(labels))
+
+
+def test_names_are_canonicalized():
+    assert canonical_name('NS1.Example.COM.') == 'ns1.example.com'
+    assert canonical_name('bücher.de') == 'xn--bcher-kva.de'
+    assert normalize_name('ns1.example.com.') == ('com', 'example', 'ns1')
+    assert normalize_name('.') == ()
+
+
+def test_longest_rule_wins(public_suffix_list):
+    assert registrable(public_suffix_list, 'ns1.example.com') == 'example.com'
+    assert registrable(public_suffix_list, 'www.example.co.uk') == 'example.co.uk'
+    assert registrable(public_suffix_list, 'example.uk') == 'example.uk'
+
+
+def test_public_suffixes_have_no_registrable_domain(public_suffix_list):
+    assert registrable(public_suffix_list, 'co.uk') is None
+    assert registrable(public_suffix_list, 'com') is None
+    assert registrable(public_suffix_list, 'anything.ck') is None
+
+
+def test_wildcard_rules_match_any_one_label(public_suffix_list):
+    assert public_suffix_list.suffix_length(normalize_name('foo.ck')) == 2
+    assert registrable(public_suffix_list, 'www.foo.ck') == 'www.foo.ck'
+    assert registrable(public_suffix_list, 'ns.a.b.foo.ck') == 'b.foo.ck'
+
+
+def test_exception_rules_override_wildcards(public_suffix_list):
+    assert public_suffix_list.suffix_length(normalize_name('www.ck')) == 1
+    assert registrable(public_suffix_list, 'www.ck') == 'www.ck'
+    assert registrable(public_suffix_list, 'ns1.www.ck') == 'www.ck'
+
+
+def test_names_matching_no_rule_use_their_tld(public_suffix_list, tmp_path):
+    assert registrable(public_suffix_list, 'ns1.example.zz') == 'example.zz'
+    (tmp_path / 'empty.dat').write_text('')
+    assert registrable(PublicSuffixList(str(tmp_path / 'empty.dat')), 'www.example.co.uk') == 'co.uk'
+
+
+def test_classifier_buckets(public_suffix_list):
+    classifier = BailiwickClassifier(public_suffix_list)
+    buckets = classifier.classify({
+        'a.com': ['ns1.a.com.', 'NS2.A.COM'],
+        'b.com': ['ns1.b.com.', 'ns1.host.net.'],
+        'x.com': ['ns.fox.com.'],
+        'www.example.co.uk': ['ns1.example.co.uk.'],
+        'shop.example.com': ['ns.example.com.', 'ns.host.net.'],
+        'a.b.foo.ck': ['ns.b.foo.ck.'],
+        'x.foo.ck': ['ns.y.foo.ck.'],
+        'example.co.uk': ['ns.co.uk.'],
+        'c.com': []
+    })
+    assert buckets == {
+        'full': ['a.com'],
+        'partial': ['b.com'],
+        'same_registrable': ['www.example.co.uk', 'shop.example.com', 'a.b.foo.ck']
+    }
+
+
+def test_domains_are_their_own_bailiwick(public_suffix_list):
+    buckets = BailiwickClassifier(public_suffix_list).classify({'a.com': ['a.com.'], 'com': ['ns.a.com.']})
+    assert buckets['full'] == ['a.com', 'com']
@@ -0,0 +1,107 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from scripts import columnar_store
+from scripts.columnar_store import ColumnarStore, StringTable, write_columnar
+
+NAMESERVERS = {
+    'a.com': ['ns1.a.com.', 'ns2.a.com.'],
+    'b.com': ['ns1.a.com.'],
+    'c.com': ['ns.c.com.']
+}
+
+
+@pytest.fixture
+def directory(tmp_path):
+    return str(tmp_path / 'columns')
+
+
+def write(stem, mapping, scalar, directory):
+    writer = columnar_store.ColumnarWriter(stem, StringTable(directory, writable=True), scalar, directory=directory)
+    for key, values in mapping.items():
+        writer.append(key, values)
+    writer.close()
+
+
+def test_round_trip(directory):
+    write('domains_nameservers', NAMESERVERS, False, directory)
+    write('asn_to_org_mapping', {'64500': 'ORG-A', '64501': 'ORG-B'}, True, directory)
+    store = ColumnarStore('domains_nameservers', directory=directory)
+    assert dict(store.items()) == NAMESERVERS
+    assert list(store) == list(NAMESERVERS)
+    assert store['b.com'] == ['ns1.a.com.']
+    assert dict(ColumnarStore('asn_to_org_mapping', directory=directory)) == {'64500': 'ORG-A', '64501': 'ORG-B'}
+
+
+def test_reopened_table_finds_strings_through_the_index(directory):
+    write('domains_nameservers', NAMESERVERS, False, directory)
+    table = StringTable(directory, writable=True)
+    size = len(table)
+    # nothing is decoded on open, the ids come from the index on disk
+    assert table._ids == {}
+    assert table[table.intern('ns1.a.com.')] == 'ns1.a.com.'
+    assert len(table) == size
+    assert table.intern('new.example.') == size
+
+
+def test_missing_index_is_rebuilt(directory):
+    write('domains_nameservers', NAMESERVERS, False, directory)
+    ids = {string: StringTable(directory, writable=True).intern(string) for string in ('a.com', 'ns.c.com.')}
+    for name in ('string_hashes.bin', 'string_index.bin'):
+        os.remove(os.path.join(directory, name))
+    table = StringTable(directory, writable=True)
+    assert {string: table.intern(string) for string in ids} == ids
+    assert os.path.getsize(os.path.join(directory, 'string_index.bin')) == 4 * len(table)
+
+
+def test_hash_collisions_compare_the_strings(directory, monkeypatch):
+    monkeypatch.setattr(columnar_store, '_string_hash', lambda encoded: 7)
+    write('domains_nameservers', NAMESERVERS, False, directory)
+    table = StringTable(directory, writable=True)
+    strings = ['a.com', 'b.com', 'c.com', 'ns1.a.com.', 'ns2.a.com.', 'ns.c.com.']
+    assert sorted(table.intern(string) for string in strings) == list(range(len(strings)))
+
+
+def test_write_columnar_shares_the_table_across_stages(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    table = StringTable(writable=True)
+    write_columnar('domains_nameservers', NAMESERVERS, False, table)
+    write_columnar('nameserver_ips', {'ns1.a.com.': ['192.0.2.1']}, False, table)
+    assert dict(ColumnarStore('nameserver_ips')) == {'ns1.a.com.': ['192.0.2.1']}
+    assert ColumnarStore('nameserver_ips').key_ids[0] == StringTable(writable=True).intern('ns1.a.com.')
+
+
+def test_columns_are_memory_mapped(directory):
+    write('domains_nameservers', NAMESERVERS, False, directory)
+    store = ColumnarStore('domains_nameservers', directory=directory)
+    for column in (store.key_ids, store.value_indptr, store.value_ids):
+        assert isinstance(column, np.memmap)
+    assert store.value_indptr.tolist() == [0, 2, 3, 4]
+
+
+def test_appended_records_extend_the_offsets(directory):
+    write('domains_nameservers', {'a.com': NAMESERVERS['a.com']}, False, directory)
+    writer = columnar_store.ColumnarWriter(
+        'domains_nameservers', StringTable(directory, writable=True), False, append=True, directory=directory
+    )
+    writer.append('c.com', NAMESERVERS['c.com'])
+    writer.close()
+    store = ColumnarStore('domains_nameservers', directory=directory)
+    assert dict(store) == {'a.com': NAMESERVERS['a.com'], 'c.com': NAMESERVERS['c.com']}
+
+
+def test_offsets_without_a_leading_zero_are_still_read(directory):
+    write('domains_nameservers', NAMESERVERS, False, directory)
+    # the layout before the offsets started with a 0
+    path = os.path.join(directory, 'domains_nameservers')
+    offsets = np.fromfile(f'{path}.value_offsets.bin', dtype=np.int64)
+    offsets[1:].tofile(f'{path}.value_offsets.bin')
+    with open(f'{path}.meta.json') as meta_file:
+        meta = json.load(meta_file)
+    del meta['indptr']
+    with open(f'{path}.meta.json', 'w') as meta_file:
+        json.dump(meta, meta_file)
+    assert dict(ColumnarStore('domains_nameservers', directory=directory)) == NAMESERVERS
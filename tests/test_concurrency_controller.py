@@ -0,0 +1,128 @@
+import asyncio
+import os
+import random
+import socket
+
+import pytest
+
+from scripts.concurrency_controller import AdaptiveLimiter, ConcurrencyController, RETRANSMIT_AFTER
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def drive(limiter, latencies, outcome='NOERROR'):
+    '''Keeps the window full and completes one query per latency, like a saturated resolver'''
+    outstanding = 0
+    for latency in latencies:
+        while outstanding < limiter.limit:
+            limiter.acquire()
+            outstanding += 1
+        limiter.release(outcome, latency)
+        outstanding -= 1
+    # drain, so the next drive starts from an empty window
+    for _ in range(outstanding):
+        limiter.release('cancelled', None)
+
+
+def test_slow_start_grows_the_window():
+    limiter = AdaptiveLimiter('recursive', initial=4, maximum=64)
+    drive(limiter, [0.005] * 200)
+    assert limiter.limit == 64
+    assert limiter.stats()['decreases'] == 0
+
+
+def test_latency_rise_cuts_the_window_and_recovers():
+    limiter = AdaptiveLimiter('recursive', initial=32, maximum=64)
+    drive(limiter, [0.005] * 200)
+    grown = limiter.limit
+    drive(limiter, [0.050] * 200)
+    cut = limiter.limit
+    assert cut < grown
+    assert limiter.stats()['decreases'] > 0
+    drive(limiter, [0.005] * 2000)
+    assert limiter.limit > cut
+
+
+def test_errors_cut_the_window():
+    limiter = AdaptiveLimiter('recursive', initial=32, backoff=0.5)
+    drive(limiter, [0.005] * 32, outcome='timeout')
+    assert limiter.limit == 16
+    assert limiter.stats()['timeout_rate'] == 1
+
+
+def test_window_never_drops_below_minimum():
+    limiter = AdaptiveLimiter('recursive', initial=8, minimum=2)
+    drive(limiter, [0.005] * 200, outcome='SERVFAIL')
+    assert limiter.limit == 2
+
+
+def test_retransmitted_queries_do_not_cut_the_window():
+    # 5% random loss: every lost packet is answered after the per-try timeout, on the retransmission
+    generator = random.Random(0)
+    latencies = [
+        RETRANSMIT_AFTER + 0.005 if generator.random() < 0.05 else 0.005
+        for _ in range(5000)
+    ]
+    limiter = AdaptiveLimiter('recursive', initial=25, maximum=100)
+    drive(limiter, latencies)
+    stats = limiter.stats()
+    assert stats['decreases'] == 0
+    assert stats['retransmitted'] > 0
+    assert stats['limit'] == 100
+    assert stats['smoothed_latency_ms'] < 10
+
+
+def test_controller_routes_cymru_queries():
+    controller = ConcurrencyController(initial=10)
+    assert controller.limiter_for('AS15169.asn.cymru.com.').name == 'cymru'
+    assert controller.limiter_for('example.com').name == 'recursive'
+    assert controller.stats() == {}
+
+
+def test_lossy_upstream_keeps_the_window_open():
+    from scripts.dns_resolver import DNSResolver
+    from scripts.synthetic_dns_server import SyntheticDNSServer
+    from scripts.upstream_pool import UpstreamPool
+
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    controller = ConcurrencyController(initial=25)
+    resolver = DNSResolver(
+        'NS', engine='async', upstreams=UpstreamPool(['127.0.0.1'], port), controller=controller
+    )
+    domains = resolver.read_json(os.path.join(PROJECT_ROOT, 'outputs', 'domains_nameservers.json'))
+    with SyntheticDNSServer(port=port, latency=0.005, loss=0.05,
+                            dataset_directory=os.path.join(PROJECT_ROOT, 'outputs')):
+        results = resolver.resolve_all(list(domains)[:300])
+    stats = controller.stats()['recursive']
+    assert stats['retransmitted'] > 0
+    # without the retransmission filter every lost packet cut the window, ending at the minimum
+    assert stats['limit'] >= 8
+    assert sum(result is not None for result in results) > 250
+
+
+def cancel_waiter(hand_over_first):
+    '''Cancels a coroutine waiting for a slot right after a release handed it one'''
+    async def scenario():
+        limiter = AdaptiveLimiter('recursive', initial=1)
+        await limiter.acquire_async()
+        waiter = asyncio.ensure_future(limiter.acquire_async())
+        await asyncio.sleep(0)
+        limiter.release('NOERROR', 0.005)
+        if hand_over_first:
+            await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        await asyncio.sleep(0)
+        return limiter
+    return asyncio.run(scenario())
+
+
+def test_cancelled_waiter_returns_its_slot_once():
+    for hand_over_first in (False, True):
+        limiter = cancel_waiter(hand_over_first)
+        assert limiter._in_flight == 0
+        assert not limiter._waiters
+        assert limiter.stats()['outcomes'] == {'NOERROR': 1}
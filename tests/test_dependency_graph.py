@@ -0,0 +1,91 @@
+import json
+
+import pytest
+
+from scripts.columnar_store import StringTable, write_columnar
+from scripts.dependency_graph import STAGES, DependencyGraph
+
+OUTPUTS = {
+    'domains_nameservers': {
+        'a.com': ['ns1.a.com.', 'ns2.a.com.'],
+        'b.com': ['ns1.host.net.', 'ns2.a.com.'],
+        'c.com': ['ns1.host.net.'],
+        'd.com': ['ns.dead.org.']
+    },
+    # ns.dead.org. has no IPs
+    'nameserver_ips': {
+        'ns1.a.com.': ['192.0.2.1'], 'ns2.a.com.': ['192.0.2.2'], 'ns1.host.net.': ['198.51.100.1', '192.0.2.2']
+    },
+    'ip_to_asn_mapping': {'192.0.2.1': ['64500'], '192.0.2.2': ['64500'], '198.51.100.1': ['64501']},
+    'asn_to_org_mapping': {'64500': 'ORG-A', '64501': 'HOST'}
+}
+
+
+@pytest.fixture(params=['json', 'columnar'])
+def graph(request, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'outputs').mkdir()
+    table = StringTable(writable=True)
+    for stem in STAGES:
+        (tmp_path / 'outputs' / f'{stem}.json').write_text(json.dumps(OUTPUTS[stem]))
+        write_columnar(stem, OUTPUTS[stem], stem == 'asn_to_org_mapping', table)
+    return DependencyGraph.read(request.param)
+
+
+def test_adjacency_round_trips_the_outputs(graph):
+    assert dict(graph.adjacency('domain')) == OUTPUTS['domains_nameservers']
+    assert dict(graph.adjacency('nameserver')) == {**OUTPUTS['nameserver_ips'], 'ns.dead.org.': []}
+    assert dict(graph.adjacency('ip')) == OUTPUTS['ip_to_asn_mapping']
+    assert dict(graph.adjacency('asn')) == {asn: [org] for asn, org in OUTPUTS['asn_to_org_mapping'].items()}
+    assert graph.adjacency('domain')['b.com'] == ['ns1.host.net.', 'ns2.a.com.']
+    with pytest.raises(Exception, match='no edges'):
+        graph.adjacency('organization')
+
+
+def test_nodes_are_stored_once(graph):
+    assert len(graph) == 4
+    assert graph.names('domain') == ['a.com', 'b.com', 'c.com', 'd.com']
+    assert graph.names('nameserver') == ['ns1.a.com.', 'ns2.a.com.', 'ns1.host.net.', 'ns.dead.org.']
+    assert [graph.node_count(layer) for layer in ('ip', 'asn', 'organization')] == [3, 2, 2]
+    assert graph.name('organization', graph.node('organization', 'HOST')) == 'HOST'
+    assert graph.node('organization', 'NOBODY') is None
+    assert graph.targets('nameserver', 'ns1.host.net.') == ['198.51.100.1', '192.0.2.2']
+
+
+def test_pairs_are_unique_across_paths(graph):
+    domains, organizations = graph.pairs('domain', 'organization')
+    pairs = [(graph.name('domain', domain), graph.name('organization', org)) for domain, org in zip(domains, organizations)]
+    assert sorted(pairs) == [('a.com', 'ORG-A'), ('b.com', 'HOST'), ('b.com', 'ORG-A'), ('c.com', 'HOST'), ('c.com', 'ORG-A')]
+    with pytest.raises(Exception, match='do not depend'):
+        graph.pairs('organization', 'domain')
+
+
+def test_reverse_index(graph):
+    assert graph.domains_of('ORG-A') == ['a.com', 'b.com', 'c.com']
+    assert graph.domains_of('HOST') == ['b.com', 'c.com']
+    assert graph.domains_of('NOBODY') == []
+    assert graph.nameservers_of('64500') == ['ns1.a.com.', 'ns2.a.com.', 'ns1.host.net.']
+    assert graph.dependents('ip', '198.51.100.1') == ['b.com', 'c.com']
+
+
+def test_outage(graph):
+    assert graph.outage(['ORG-A']) == {'unreachable': ['a.com'], 'affected': ['a.com', 'b.com', 'c.com']}
+    assert graph.outage(['ORG-A', 'HOST'])['unreachable'] == ['a.com', 'b.com', 'c.com']
+    assert graph.outage(['ns1.host.net.'], 'nameserver') == {'unreachable': ['c.com'], 'affected': ['b.com', 'c.com']}
+    assert graph.outage(['192.0.2.2'], 'ip') == {'unreachable': [], 'affected': ['a.com', 'b.com', 'c.com']}
+    assert graph.outage(['NOBODY']) == {'unreachable': [], 'affected': []}
+
+
+def test_graph_starting_below_the_domains():
+    graph = DependencyGraph.from_outputs([{'ns1.a.com.': '192.0.2.1', 'ns2.a.com.': None}], layer='nameserver')
+    assert dict(graph.adjacency('nameserver')) == {'ns1.a.com.': ['192.0.2.1'], 'ns2.a.com.': []}
+    assert graph.names('ip') == ['192.0.2.1']
+    with pytest.raises(Exception, match='were not built'):
+        graph.names('domain')
+
+
+def test_outputs_must_fit_the_stages():
+    with pytest.raises(Exception, match='do not fit'):
+        DependencyGraph.from_outputs([{}, {}], layer='asn')
+    with pytest.raises(Exception, match='do not fit'):
+        DependencyGraph.from_outputs([])
@@ -0,0 +1,57 @@
+import json
+import sqlite3
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from scripts.dns_resolver import DNSResolver
+from scripts.resolution_cache import ResolutionCache
+
+
+def test_cache_counters_add_up_across_threads(tmp_path):
+    cache = ResolutionCache(str(tmp_path / 'cache.sqlite3'))
+    cache.put('cached.example.', 'NS', ['ns1.example.'], 3600)
+    resolver = DNSResolver('NS', cache=cache)
+    # switch threads as often as possible, so unlocked increments would lose updates
+    previous_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            lookups = [('cached.example.' if index % 2 else 'missing.example.') for index in range(4000)]
+            list(executor.map(resolver._cached_records, lookups))
+    finally:
+        sys.setswitchinterval(previous_interval)
+    assert resolver.get_cache_counters() == (2000, 2000)
+    cache.close()
+
+
+def test_failures_are_only_written_for_resolved_stages(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'outputs').mkdir()
+    resolver = DNSResolver('NS')
+    resolver._record_stage_failure('domains_nameservers', 'missing.com', 'NXDOMAIN')
+    resolver.write_stage('domains_nameservers', {'a.com': ['ns1.a.com.']}, scalar = False)
+    resolver.write_stage('nameserver_glue', {'ns1.a.com.': ['192.0.2.1']}, scalar = False, resolved = False)
+    assert json.loads((tmp_path / 'outputs' / 'domains_nameservers_failures.json').read_text()) == {'missing.com': 'NXDOMAIN'}
+    assert (tmp_path / 'outputs' / 'nameserver_glue.json').exists()
+    assert not (tmp_path / 'outputs' / 'nameserver_glue_failures.json').exists()
+
+
+class Answer(list):
+    '''Stands in for a dns.resolver.Answer: its records and the TTL of their rrset'''
+    def __init__(self, records, ttl=3600):
+        super().__init__(records)
+        self.rrset = type('RRset', (), {'ttl': ttl})()
+
+
+def test_cache_errors_do_not_fail_resolutions(tmp_path):
+    cache = ResolutionCache(str(tmp_path / 'cache.sqlite3'), busy_timeout=0.1)
+    other = sqlite3.connect(str(tmp_path / 'cache.sqlite3'))
+    other.execute('BEGIN IMMEDIATE')
+    resolver = DNSResolver('A', cache=cache)
+    resolver._query = lambda query: Answer(['192.0.2.1'])
+    assert resolver.resolve('a.com') == ['192.0.2.1']
+    assert resolver.get_failure('a.com') is None
+    assert cache.get_error_counter() == 1
+    other.rollback()
+    other.close()
+    cache.close()
@@ -0,0 +1,51 @@
+import json
+
+import pytest
+
+from scripts.incremental_resolver import IncrementalResolver
+from scripts.tranco_list import TrancoList
+
+PREVIOUS = {
+    'domains_nameservers': {'old.com': ['ns1.old.com.']},
+    'nameserver_ips': {'ns1.old.com.': ['192.0.2.1', '2001:db8::1']},
+    'ip_to_asn_mapping': {'192.0.2.1': ['64500'], '2001:db8::1': ['64500'], '192.0.2.9': ['64501'], '2001:db8::9': ['64501']},
+    'asn_to_org_mapping': {'64500': 'ORG-A', '64501': 'ORG-B'}
+}
+
+
+@pytest.fixture
+def incremental(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'outputs').mkdir()
+    (tmp_path / 'previous').mkdir()
+    for stem, output in PREVIOUS.items():
+        (tmp_path / 'previous' / f'{stem}.json').write_text(json.dumps(output))
+    (tmp_path / 'top-1m.csv').write_text('1,old.com\n2,new.com\n')
+    resolver = IncrementalResolver(str(tmp_path / 'previous'), 2, tranco=TrancoList(str(tmp_path / 'top-1m.csv')))
+    nameserver_resolver = resolver._nameserver_resolver
+
+    def resolve_journaled(stem, keys, queries):
+        # new.com's NS answer came with A glue only
+        nameserver_resolver._glue['ns1.new.com.'] = {'A': ['192.0.2.9']}
+        return [['ns1.new.com.'] for _ in keys]
+    monkeypatch.setattr(nameserver_resolver, 'resolve_journaled', resolve_journaled)
+    return resolver
+
+
+def test_partial_glue_still_looks_up_the_other_record_type(incremental, tmp_path, monkeypatch):
+    sent = {'A': [], 'AAAA': []}
+
+    def answering(record_type, records):
+        def query(name):
+            sent[record_type].append(name)
+            return records
+        return query
+    monkeypatch.setattr(incremental._ip_resolver, '_query', answering('A', ['192.0.2.9']))
+    monkeypatch.setattr(incremental._ip_resolver._ipv6_resolver, '_query', answering('AAAA', ['2001:db8::9']))
+    assert incremental.execute_incremental_resolution() == {
+        'domains_nameservers': 0, 'nameserver_ips': 0, 'ip_to_asn_mapping': 0, 'asn_to_org_mapping': 0
+    }
+    assert sent == {'A': [], 'AAAA': ['ns1.new.com.']}
+    nameserver_ips = json.loads((tmp_path / 'outputs' / 'nameserver_ips.json').read_text())
+    assert nameserver_ips['ns1.new.com.'] == ['192.0.2.9', '2001:db8::9']
+    assert json.loads((tmp_path / 'outputs' / 'nameserver_glue.json').read_text()) == {'ns1.new.com.': ['192.0.2.9']}
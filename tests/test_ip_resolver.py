@@ -0,0 +1,123 @@
+import asyncio
+
+import dns.exception
+import dns.resolver
+import pytest
+
+from scripts.ip_resolver import IPResolver
+from scripts.retry_policy import RetryPolicy
+
+NAMESERVER = 'ns1.example.'
+
+
+def answering(records, failures=()):
+    '''Replaces a resolver's upstream query: raises each of failures in turn, then answers with records'''
+    failures = list(failures)
+    sent = []
+
+    def query(name):
+        sent.append(name)
+        if failures:
+            raise failures.pop(0)
+        return list(records)
+
+    async def query_async(name):
+        return query(name)
+    return query, query_async, sent
+
+
+def ip_resolver(monkeypatch, engine, ipv4, ipv6, retry_policy=None):
+    resolver = IPResolver(engine=engine, retry_policy=retry_policy)
+    sent = {}
+    for target, (records, failures), record_type in ((resolver, ipv4, 'A'), (resolver._ipv6_resolver, ipv6, 'AAAA')):
+        query, query_async, sent[record_type] = answering(records, failures)
+        monkeypatch.setattr(target, '_query', query)
+        monkeypatch.setattr(target, '_query_async', query_async)
+    return resolver, sent
+
+
+@pytest.mark.parametrize('engine', IPResolver.ENGINES)
+def test_both_record_types_are_kept(monkeypatch, engine):
+    resolver, _ = ip_resolver(monkeypatch, engine, (['192.0.2.1'], ()), (['2001:db8::1'], ()))
+    assert resolver.resolve_all([NAMESERVER]) == [['192.0.2.1', '2001:db8::1']]
+
+
+@pytest.mark.parametrize('engine', IPResolver.ENGINES)
+def test_missing_aaaa_keeps_ipv4(monkeypatch, engine):
+    resolver, _ = ip_resolver(monkeypatch, engine, (['192.0.2.1'], ()), ([], [dns.resolver.NoAnswer()]))
+    assert resolver.resolve_all([NAMESERVER]) == [['192.0.2.1']]
+
+
+@pytest.mark.parametrize('engine', IPResolver.ENGINES)
+def test_transient_aaaa_failure_is_retried(monkeypatch, engine):
+    resolver, sent = ip_resolver(
+        monkeypatch, engine, (['192.0.2.1'], ()), (['2001:db8::1'], [dns.exception.Timeout()]),
+        RetryPolicy(max_attempts=3, base_delay=0.01)
+    )
+    keys = [NAMESERVER]
+    assert resolver.resolve_journaled('nameserver_ips', keys, keys) == [['192.0.2.1', '2001:db8::1']]
+    assert len(sent['AAAA']) == 2
+    assert resolver.get_failure(NAMESERVER) is None
+
+
+@pytest.mark.parametrize('engine', IPResolver.ENGINES)
+def test_retries_only_look_up_the_failed_record_type(monkeypatch, engine):
+    resolver, sent = ip_resolver(
+        monkeypatch, engine, (['192.0.2.1'], ()), (['2001:db8::1'], [dns.exception.Timeout()] * 2),
+        RetryPolicy(max_attempts=3, base_delay=0.01)
+    )
+    keys = [NAMESERVER]
+    assert resolver.resolve_journaled('nameserver_ips', keys, keys) == [['192.0.2.1', '2001:db8::1']]
+    assert len(sent['A']) == 1
+    assert len(sent['AAAA']) == 3
+
+
+@pytest.mark.parametrize('engine', IPResolver.ENGINES)
+def test_given_up_record_type_keeps_the_other(monkeypatch, engine):
+    resolver, sent = ip_resolver(
+        monkeypatch, engine, (['192.0.2.1'], ()), ([], [dns.exception.Timeout()] * 3),
+        RetryPolicy(max_attempts=3, base_delay=0.01)
+    )
+    keys = [NAMESERVER]
+    assert resolver.resolve_journaled('nameserver_ips', keys, keys) == [['192.0.2.1']]
+    assert (len(sent['A']), len(sent['AAAA'])) == (1, 3)
+    assert resolver.get_partial_counter() == 1
+    assert resolver._stage_failures.get('nameserver_ips', {}) == {}
+
+
+@pytest.mark.parametrize('engine', IPResolver.ENGINES)
+def test_both_record_types_failing_fails_the_nameserver(monkeypatch, engine):
+    resolver, _ = ip_resolver(
+        monkeypatch, engine, ([], [dns.exception.Timeout()] * 2), ([], [dns.exception.Timeout()] * 2),
+        RetryPolicy(max_attempts=2, base_delay=0.01)
+    )
+    keys = [NAMESERVER]
+    assert resolver.resolve_journaled('nameserver_ips', keys, keys) == [None]
+    assert resolver._stage_failures['nameserver_ips'] == {NAMESERVER: 'timeout'}
+
+
+def test_streaming_lookup_keeps_the_record_type_that_resolved(monkeypatch):
+    resolver, sent = ip_resolver(
+        monkeypatch, 'async', (['192.0.2.1'], []), (['2001:db8::1'], [dns.exception.Timeout()] * 2),
+        RetryPolicy(max_attempts=2, base_delay=0.01)
+    )
+    assert asyncio.run(resolver.resolve_journaled_async('nameserver_ips', NAMESERVER, NAMESERVER)) == ['192.0.2.1']
+    assert (len(sent['A']), len(sent['AAAA'])) == (1, 2)
+
+
+@pytest.mark.parametrize('engine', IPResolver.ENGINES)
+def test_partial_glue_looks_up_the_other_record_type(monkeypatch, engine):
+    resolver, sent = ip_resolver(monkeypatch, engine, (['192.0.2.1'], ()), (['2001:db8::1'], ()))
+    resolver.use_glue({NAMESERVER: ['198.51.100.1'], 'ns2.example.': ['2001:db8::2']}.get)
+    assert resolver.resolve_all([NAMESERVER, 'ns2.example.']) == [
+        ['198.51.100.1', '2001:db8::1'], ['192.0.2.1', '2001:db8::2']
+    ]
+    assert sent == {'A': ['ns2.example.'], 'AAAA': [NAMESERVER]}
+
+
+def test_full_glue_needs_no_lookup():
+    resolver = IPResolver()
+    resolver.use_glue({NAMESERVER: ['198.51.100.1', '2001:db8::1'], 'ns2.example.': ['198.51.100.2']}.get)
+    assert resolver.full_glue(NAMESERVER) == ['198.51.100.1', '2001:db8::1']
+    assert resolver.full_glue('ns2.example.') is None
+    assert resolver.full_glue('ns3.example.') is None
@@ -0,0 +1,106 @@
+import asyncio
+import json
+import re
+import time
+
+import pytest
+
+from scripts import retry_policy
+from scripts.pipeline import StreamingPipeline
+from scripts.retry_policy import RetryPolicy
+from scripts.tranco_list import TrancoList
+
+DOMAINS = [f'domain{index}.com' for index in range(60)]
+
+
+@pytest.fixture
+def pipeline(tmp_path, monkeypatch):
+    tranco_path = tmp_path / 'top-1m.csv'
+    tranco_path.write_text(''.join(f'{rank},{domain}\n' for rank, domain in enumerate(DOMAINS, 1)))
+    (tmp_path / 'outputs').mkdir()
+    monkeypatch.chdir(tmp_path)
+    return StreamingPipeline(len(DOMAINS), tranco=TrancoList(str(tranco_path)), engine='async', concurrency=4)
+
+
+def answer(stem, query):
+    '''Upstream answer of every stage, each domain getting its own nameserver, IP and ASN'''
+    if stem == 'domains_nameservers':
+        return [f'ns.{query}.']
+    if stem == 'nameserver_ips':
+        return [f'192.0.2.{re.search(r"[0-9]+", query).group()}']
+    if stem == 'ip_to_asn_mapping':
+        # the query holds the reversed octets, the last octet first
+        return f'{64500 + int(query.split(".")[0])} | 192.0.2.0/24 | US | arin | 2000-01-01'
+    asn = re.search(r"[0-9]+", query).group()
+    return f'{asn} | US | arin | 2000-01-01 | ORG-{asn}'
+
+
+def fake_lookups(monkeypatch, pipeline, failing_stem=None, timing_out=()):
+    '''
+    Replaces the upstream lookups of every stage, returning the peak number of lookups in flight
+    and when each domain's NS lookup last completed. Queries in timing_out always time out.
+    '''
+    in_flight = {'now': 0, 'peak': 0, 'completed': {}}
+    stems = ('domains_nameservers', 'nameserver_ips', 'ip_to_asn_mapping', 'asn_to_org_mapping')
+    resolvers = (
+        pipeline._nameserver_resolver, pipeline._ip_resolver, pipeline._asn_resolver, pipeline._as_org_resolver
+    )
+    for stem, resolver in zip(stems, resolvers):
+        async def lookup(query, stem=stem, resolver=resolver):
+            in_flight['now'] += 1
+            in_flight['peak'] = max(in_flight['peak'], in_flight['now'])
+            await asyncio.sleep(0.001)
+            in_flight['now'] -= 1
+            if stem == 'domains_nameservers':
+                in_flight['completed'][query] = time.monotonic()
+            if stem == failing_stem:
+                raise ValueError(f'{stem} failed')
+            if query in timing_out:
+                resolver._record_failure(query, 'timeout')
+                return None
+            return answer(stem, query)
+        monkeypatch.setattr(resolver, 'resolve_async', lookup)
+    return in_flight
+
+
+def test_stages_share_one_in_flight_bound(monkeypatch, pipeline):
+    in_flight = fake_lookups(monkeypatch, pipeline)
+    pipeline.execute_streaming_resolution()
+    assert in_flight['peak'] <= 4
+    with open('outputs/asn_to_org_mapping.json') as jsonfile:
+        assert len(json.load(jsonfile)) == len(DOMAINS)
+    with open('outputs/domains_nameservers.json') as jsonfile:
+        assert list(json.load(jsonfile)) == DOMAINS
+
+
+def test_failing_stage_fails_the_pipeline(monkeypatch, pipeline):
+    fake_lookups(monkeypatch, pipeline, failing_stem='ip_to_asn_mapping')
+    with pytest.raises(ValueError, match='ip_to_asn_mapping failed'):
+        pipeline.execute_streaming_resolution()
+
+
+def test_keys_waiting_to_be_retried_do_not_hold_lookups(tmp_path, monkeypatch):
+    tranco_path = tmp_path / 'top-1m.csv'
+    tranco_path.write_text(''.join(f'{rank},{domain}\n' for rank, domain in enumerate(DOMAINS, 1)))
+    (tmp_path / 'outputs').mkdir()
+    monkeypatch.chdir(tmp_path)
+    # every backoff lasts its whole bound of 1 second
+    monkeypatch.setattr(retry_policy.random, 'uniform', lambda low, high: high)
+    pipeline = StreamingPipeline(
+        len(DOMAINS), tranco=TrancoList(str(tranco_path)), engine='async', concurrency=2,
+        retry_policy=RetryPolicy(max_attempts=2, base_delay=1.0)
+    )
+    # the two highest ranked domains take both lookups first, then keep timing out
+    failing = DOMAINS[:2]
+    in_flight = fake_lookups(monkeypatch, pipeline, timing_out=failing)
+    started = time.monotonic()
+    pipeline.execute_streaming_resolution()
+    assert in_flight['peak'] <= 2
+    healthy_done = max(completed for domain, completed in in_flight['completed'].items() if domain not in failing)
+    # every healthy domain resolved while the failing ones slept out their backoff, without a lookup
+    assert healthy_done - started < 0.5
+    assert min(in_flight['completed'][domain] for domain in failing) - started >= 1.0
+    with open('outputs/domains_nameservers_failures.json') as jsonfile:
+        assert json.load(jsonfile) == {domain: 'timeout' for domain in failing}
+    with open('outputs/asn_to_org_mapping.json') as jsonfile:
+        assert len(json.load(jsonfile)) == len(DOMAINS) - len(failing)
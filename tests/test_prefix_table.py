@@ -0,0 +1,76 @@
+import gzip
+
+from scripts.prefix_table import PrefixTable
+
+
+def table_of(prefixes):
+    table = PrefixTable()
+    for prefix, asns in prefixes:
+        table.insert(prefix, asns)
+    return table
+
+
+def test_longest_prefix_wins():
+    table = table_of([('10.0.0.0/8', ('64500',)), ('10.1.0.0/16', ('64501',)), ('10.1.2.0/24', ('64502',))])
+    assert table.lookup('10.1.2.3') == ['64502']
+    assert table.lookup('10.1.3.3') == ['64501']
+    assert table.lookup('10.2.0.1') == ['64500']
+    assert table.lookup('11.0.0.1') is None
+
+
+def test_insertion_order_does_not_matter():
+    table = table_of([('10.1.2.0/24', ('64502',)), ('10.0.0.0/8', ('64500',))])
+    assert table.lookup('10.1.2.255') == ['64502']
+    assert table.lookup('10.1.3.0') == ['64500']
+
+
+def test_prefix_boundaries():
+    table = table_of([('192.0.2.128/25', ('64500',))])
+    assert table.lookup('192.0.2.127') is None
+    assert table.lookup('192.0.2.128') == ['64500']
+    assert table.lookup('192.0.2.255') == ['64500']
+    assert table.lookup('192.0.3.0') is None
+
+
+def test_host_routes_and_the_default_route():
+    table = table_of([('0.0.0.0/0', ('64500',)), ('198.51.100.7/32', ('64501',))])
+    assert table.lookup('198.51.100.7') == ['64501']
+    assert table.lookup('198.51.100.6') == ['64500']
+    assert table.lookup('203.0.113.1') == ['64500']
+
+
+def test_address_families_are_separate():
+    table = table_of([('0.0.0.0/0', ('64500',)), ('2001:db8::/32', ('64501',))])
+    assert table.lookup('2001:db8:1::1') == ['64501']
+    assert table.lookup('2001:db9::1') is None
+    assert table.lookup('192.0.2.1') == ['64500']
+
+
+def test_reinserting_a_prefix_replaces_its_origins():
+    table = table_of([('10.0.0.0/8', ('64500',)), ('10.0.0.0/8', ('64501',))])
+    assert len(table) == 1
+    assert table.lookup('10.0.0.1') == ['64501']
+
+
+def test_non_canonical_prefixes_are_masked():
+    table = table_of([('10.1.2.3/16', ('64500',))])
+    assert table.lookup('10.1.255.255') == ['64500']
+
+
+def test_invalid_addresses_are_not_found():
+    table = table_of([('0.0.0.0/0', ('64500',))])
+    assert table.lookup('not-an-ip') is None
+
+
+def test_load_pfx2as_and_pyasn_files(tmp_path):
+    pfx2as = tmp_path / 'routeviews-rv2-pfx2as.gz'
+    with gzip.open(pfx2as, 'wt') as prefix_file:
+        prefix_file.write('1.0.0.0\t24\t13335\n8.8.8.0\t24\t15169_36040\n')
+    pyasn = tmp_path / 'ipasn.dat'
+    pyasn.write_text('; IP-ASN32-DAT file\n2001:db8::/32\t{64500,64501}\n')
+    table = PrefixTable(str(pfx2as))
+    table.load(str(pyasn))
+    assert len(table) == 3
+    assert table.lookup('1.0.0.1') == ['13335']
+    assert table.lookup('8.8.8.8') == ['15169', '36040']
+    assert table.lookup('2001:db8::53') == ['64500', '64501']
@@ -0,0 +1,73 @@
+import json
+
+import pytest
+
+from scripts.process_results import ResultProcessor
+from scripts.tranco_list import TrancoList
+
+OUTPUTS = {
+    'domains_nameservers': {
+        'a.com': ['ns1.a.com.'], 'b.com': ['ns1.host.net.', 'ns2.other.org.'], 'c.com': ['ns1.host.net.']
+    },
+    'nameserver_ips': {
+        'ns1.a.com.': ['192.0.2.1'], 'ns1.host.net.': ['192.0.2.2'], 'ns2.other.org.': ['198.51.100.1']
+    },
+    'ip_to_asn_mapping': {'192.0.2.1': ['64500'], '192.0.2.2': ['64501'], '198.51.100.1': ['64502']},
+    'asn_to_org_mapping': {'64500': 'ORG-A', '64501': 'HOST', '64502': 'OTHER'}
+}
+
+
+def write_outputs(directory, outputs):
+    (directory / 'outputs').mkdir()
+    for stem, output in outputs.items():
+        (directory / 'outputs' / f'{stem}.json').write_text(json.dumps(output))
+
+
+@pytest.fixture
+def outputs(tmp_path, monkeypatch):
+    write_outputs(tmp_path, OUTPUTS)
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def tranco_of(directory, domains):
+    path = directory / 'top-1m.csv'
+    path.write_text(''.join(f'{rank},{domain}\n' for rank, domain in domains))
+    return TrancoList(str(path))
+
+
+def test_unreachable_organizations(outputs):
+    processor = ResultProcessor(tranco=tranco_of(outputs, [(1, 'a.com'), (2, 'b.com'), (3, 'c.com')]), resamples=0)
+    assert dict(processor.get_top_unreachable_as_numbers()) == {'ORG-A': 1, 'HOST': 1}
+
+
+def test_domain_missing_from_the_tranco_list_raises(outputs):
+    tranco = tranco_of(outputs, [(1, 'a.com'), (2, 'b.com'), (3, 'd.com')])
+    with pytest.raises(Exception, match='c.com'):
+        ResultProcessor(tranco=tranco, resamples=0)
+
+
+def test_same_registrable_domains_are_counted(tmp_path, monkeypatch):
+    # shop.example-dns.co.uk is not a parent of ns1.example-dns.co.uk, but both belong to example-dns.co.uk
+    write_outputs(tmp_path, {
+        'domains_nameservers': {
+            'shop.example-dns.co.uk': ['ns1.example-dns.co.uk.', 'ns2.example-dns.co.uk.'],
+            'a.com': ['ns1.a.com.'],
+            'b.com': ['ns1.a.com.'],
+            'c.co.uk': ['ns1.co.uk.']
+        },
+        'nameserver_ips': {
+            'ns1.example-dns.co.uk.': ['192.0.2.1'], 'ns2.example-dns.co.uk.': ['192.0.2.1'],
+            'ns1.a.com.': ['192.0.2.2'], 'ns1.co.uk.': ['192.0.2.2']
+        },
+        'ip_to_asn_mapping': {'192.0.2.1': ['64500'], '192.0.2.2': ['64501']},
+        'asn_to_org_mapping': {'64500': 'ORG-A', '64501': 'HOST'}
+    })
+    (tmp_path / 'public_suffix_list.dat').write_text('com\nuk\nco.uk\n')
+    monkeypatch.chdir(tmp_path)
+    processor = ResultProcessor(resamples=0, public_suffix_list=str(tmp_path / 'public_suffix_list.dat'))
+    assert processor.get_inbailwick_percent() == 25.0
+    assert processor.get_inbailwick_same_registrable_percent() == 25.0
+    processor.execute_process_all_results()
+    results = json.loads((tmp_path / 'outputs' / 'results.json').read_text())
+    assert results['inbailwick_same_registrable_percent'] == 25.0
@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+
+from scripts.rank_statistics import RankStatistics
+
+
+def statistics_of(pairs, ranks, organizations, seed=0):
+    '''Builds RankStatistics from (domain, organization, sole) pairs'''
+    domains, orgs, sole = (np.array(column) for column in zip(*pairs))
+    return RankStatistics(np.array(ranks), domains, orgs, sole, organizations, seed=seed)
+
+
+@pytest.fixture
+def random_statistics():
+    generator = np.random.default_rng(1)
+    ranks = generator.permutation(np.arange(1, 2001))
+    pairs = []
+    for domain in range(len(ranks)):
+        orgs = generator.choice(5, size=generator.integers(1, 3), replace=False)
+        pairs += [(domain, int(org), len(orgs) == 1) for org in orgs]
+    return statistics_of(pairs, ranks, [f'ORG-{org}' for org in range(5)]), ranks, pairs
+
+
+def test_counts_match_a_scan_of_the_pairs(random_statistics):
+    statistics, ranks, pairs = random_statistics
+    cutoffs = [0, 1, 10, 999, 1000, 2000, 5000]
+    unreachable, affected = statistics.counts_at(cutoffs)
+    for org in range(5):
+        for column, cutoff in enumerate(cutoffs):
+            assert affected[org, column] == sum(1 for domain, o, _ in pairs if o == org and ranks[domain] <= cutoff)
+            assert unreachable[org, column] == sum(1 for domain, o, s in pairs if o == org and s and ranks[domain] <= cutoff)
+    assert statistics.domains_at(cutoffs).tolist() == [0, 1, 10, 999, 1000, 2000, 2000]
+
+
+def test_cumulative_counts_follow_every_rank(random_statistics):
+    statistics, _, _ = random_statistics
+    curves = statistics.cumulative_counts(2)
+    unreachable, affected = statistics.counts_at(curves['ranks'], [2])
+    assert curves['unreachable'].tolist() == unreachable[0].tolist()
+    assert curves['affected'].tolist() == affected[0].tolist()
+    assert curves['domains'][-1] == 2000
+
+
+def test_bootstrap_intervals_cover_the_observed_share(random_statistics):
+    statistics, _, _ = random_statistics
+    organizations = np.arange(5)
+    unreachable, affected = (counts[:, 0] / 2000 for counts in statistics.counts_at([2000], organizations))
+    unreachable_intervals, affected_intervals = statistics.bootstrap(2000, organizations, resamples=500)
+    assert unreachable_intervals.shape == affected_intervals.shape == (5, 2)
+    assert np.all(unreachable_intervals[:, 0] <= unreachable) and np.all(unreachable <= unreachable_intervals[:, 1])
+    assert np.all(affected_intervals[:, 0] <= affected) and np.all(affected <= affected_intervals[:, 1])
+    # a share near 0.2 of 2000 domains has a standard error near 0.009
+    assert np.all(affected_intervals[:, 1] - affected_intervals[:, 0] < 0.06)
+
+
+def test_bootstrap_narrows_with_more_domains(random_statistics):
+    statistics, _, _ = random_statistics
+    narrow, _ = statistics.bootstrap(2000, [0], resamples=500)
+    wide, _ = statistics.bootstrap(100, [0], resamples=500)
+    assert narrow[0, 1] - narrow[0, 0] < wide[0, 1] - wide[0, 0]
+
+
+def test_bootstrap_is_reproducible_with_its_seed(random_statistics):
+    statistics, ranks, pairs = random_statistics
+    first = statistics.bootstrap(500, [0, 1], resamples=200)
+    again = statistics_of(pairs, ranks, [f'ORG-{org}' for org in range(5)]).bootstrap(500, [0, 1], resamples=200)
+    assert all(np.array_equal(a, b) for a, b in zip(first, again))
+
+
+def test_bootstrap_of_certain_shares_is_exact():
+    # ORG-A is behind every domain alone, ORG-B behind none
+    statistics = statistics_of([(domain, 0, True) for domain in range(10)], range(1, 11), ['ORG-A', 'ORG-B'])
+    unreachable, affected = statistics.bootstrap(10, [0, 1], resamples=100)
+    assert unreachable.tolist() == [[1.0, 1.0], [0.0, 0.0]]
+    assert affected.tolist() == [[1.0, 1.0], [0.0, 0.0]]
+
+
+def test_bootstrap_without_domains_is_empty():
+    statistics = statistics_of([(0, 0, True)], [5], ['ORG-A'])
+    unreachable, affected = statistics.bootstrap(4, [0])
+    assert unreachable.tolist() == affected.tolist() == [[0.0, 0.0]]
+
+
+def test_summary_adds_intervals_for_every_cutoff():
+    pairs = [(0, 0, True), (1, 0, False), (1, 1, False), (2, 1, True)]
+    statistics = statistics_of(pairs, [1, 2, 3], ['ORG-A', 'ORG-B'])
+    summary = statistics.summarize([1, 10], count=2, resamples=50)
+    assert summary['cutoffs'] == [1, 3]
+    assert summary['domains'] == [1, 3]
+    assert summary['organizations']['ORG-A']['unreachable'] == [1, 1]
+    assert summary['organizations']['ORG-A']['affected'] == [1, 2]
+    assert len(summary['organizations']['ORG-B']['affected_percent_intervals']) == 2
+    assert 'unreachable_percent_intervals' not in statistics.summarize([1], resamples=0)['organizations']['ORG-A']
@@ -0,0 +1,111 @@
+import sqlite3
+
+import pytest
+
+from scripts import resolution_cache
+from scripts.resolution_cache import ResolutionCache
+
+
+class Clock:
+    '''Stands in for time.time() in resolution_cache'''
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(resolution_cache, 'time', clock)
+    return clock
+
+
+def test_entries_expire_with_their_ttl(tmp_path, clock):
+    cache = ResolutionCache(str(tmp_path / 'cache.sqlite3'))
+    cache.put('a.com', 'NS', ['ns1.a.com.'], 300)
+    assert cache.get('a.com', 'NS') == ['ns1.a.com.']
+    assert cache.get('a.com', 'A') is None
+    clock.now += 299
+    assert cache.get('a.com', 'NS') == ['ns1.a.com.']
+    clock.now += 1
+    assert cache.get('a.com', 'NS') is None
+    cache.close()
+
+
+def test_max_age_caps_the_ttl(tmp_path, clock):
+    cache = ResolutionCache(str(tmp_path / 'cache.sqlite3'), max_age=60)
+    cache.put('a.com', 'NS', ['ns1.a.com.'], 86400)
+    clock.now += 61
+    assert cache.get('a.com', 'NS') is None
+    cache.close()
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path, clock):
+    # every entry takes len('a.com') + len('["ns1.a.com."]') = 19 bytes, three fit
+    cache = ResolutionCache(str(tmp_path / 'cache.sqlite3'), max_size=3 * 19, evict_interval=1000)
+    for domain in ('a.com', 'b.com', 'c.com'):
+        clock.now += 1
+        cache.put(domain, 'NS', [f'ns1.{domain}.'], 3600)
+    clock.now += 1
+    assert cache.get('a.com', 'NS') is not None
+    clock.now += 1
+    cache.put('d.com', 'NS', ['ns1.d.com.'], 3600)
+    cache.commit()
+    # b.com was used longest ago, a.com was read after it
+    assert cache.get('b.com', 'NS') is None
+    assert [cache.get(domain, 'NS') is not None for domain in ('a.com', 'c.com', 'd.com')] == [True, True, True]
+    cache.close()
+
+
+def test_entries_persist_across_connections(tmp_path):
+    path = str(tmp_path / 'cache.sqlite3')
+    cache = ResolutionCache(path)
+    cache.put('a.com', 'NS', ['ns1.a.com.', 'ns2.a.com.'], 3600)
+    cache.close()
+    cache = ResolutionCache(path)
+    assert cache.get('a.com', 'NS') == ['ns1.a.com.', 'ns2.a.com.']
+    cache.close()
+
+
+def test_expired_entries_are_dropped_on_commit(tmp_path, clock):
+    cache = ResolutionCache(str(tmp_path / 'cache.sqlite3'))
+    cache.put('a.com', 'NS', ['ns1.a.com.'], 10)
+    cache.put('b.com', 'NS', ['ns1.b.com.'], 1000)
+    clock.now += 100
+    cache.commit()
+    rows = cache._connection.execute('SELECT qname FROM entries').fetchall()
+    assert rows == [('b.com',)]
+    cache.close()
+
+
+def test_caches_can_share_one_file(tmp_path):
+    path = str(tmp_path / 'cache.sqlite3')
+    first, second = ResolutionCache(path, busy_timeout=0.1), ResolutionCache(path, busy_timeout=0.1)
+    first.put('a.com', 'NS', ['ns1.a.com.'], 3600)
+    assert first.get('a.com', 'NS') == ['ns1.a.com.']
+    second.put('b.com', 'NS', ['ns1.b.com.'], 3600)
+    assert second.get('a.com', 'NS') == ['ns1.a.com.']
+    assert first.get('b.com', 'NS') == ['ns1.b.com.']
+    # reads leave no write transaction open for the other process to wait on
+    assert not first._connection.in_transaction and not second._connection.in_transaction
+    assert first.get_error_counter() == second.get_error_counter() == 0
+    first.close()
+    second.close()
+
+
+def test_locked_cache_only_skips_caching(tmp_path):
+    path = str(tmp_path / 'cache.sqlite3')
+    cache = ResolutionCache(path, busy_timeout=0.1)
+    cache.put('a.com', 'NS', ['ns1.a.com.'], 3600)
+    other = sqlite3.connect(path)
+    other.execute('BEGIN IMMEDIATE')
+    cache.put('b.com', 'NS', ['ns1.b.com.'], 3600)
+    assert cache.get('a.com', 'NS') == ['ns1.a.com.']
+    cache.commit()
+    assert cache.get_error_counter() == 2
+    other.rollback()
+    other.close()
+    assert cache.get('b.com', 'NS') is None
+    cache.close()
@@ -0,0 +1,80 @@
+import pytest
+
+from scripts import retry_policy
+from scripts.retry_policy import RetryPolicy, RetryScheduler
+
+
+class Clock:
+    '''Stands in for time.monotonic() in retry_policy'''
+    def __init__(self):
+        self.now = 100.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(retry_policy, 'time', clock)
+    return clock
+
+
+@pytest.fixture
+def longest_backoff(monkeypatch):
+    # full jitter draws from [0, bound], always wait the whole bound
+    monkeypatch.setattr(retry_policy.random, 'uniform', lambda low, high: high)
+
+
+def test_permanent_failures_are_not_retried(clock):
+    policy = RetryPolicy()
+    assert policy.retry_at('NXDOMAIN', 1, clock.now) is None
+    assert policy.retry_at('NoAnswer', 1, clock.now) is None
+    assert policy.retry_at('timeout', 1, clock.now) is not None
+
+
+def test_attempts_are_capped(clock):
+    policy = RetryPolicy(max_attempts=3)
+    assert policy.retry_at('SERVFAIL', 2, clock.now) is not None
+    assert policy.retry_at('SERVFAIL', 3, clock.now) is None
+    assert RetryPolicy(max_attempts=1).retry_at('SERVFAIL', 1, clock.now) is None
+
+
+def test_backoff_doubles_up_to_max_delay(clock, longest_backoff):
+    policy = RetryPolicy(max_attempts=10, base_delay=0.5, max_delay=3.0, deadline=1000)
+    delays = [policy.retry_at('timeout', attempts, clock.now) - clock.now for attempts in range(1, 6)]
+    assert delays == [0.5, 1.0, 2.0, 3.0, 3.0]
+
+
+def test_backoff_is_jittered_below_its_bound(clock):
+    policy = RetryPolicy(max_attempts=10, base_delay=0.5, max_delay=8.0, deadline=1000)
+    for attempts in range(1, 8):
+        delay = policy.retry_at('timeout', attempts, clock.now) - clock.now
+        assert 0 <= delay <= min(8.0, 0.5 * 2 ** (attempts - 1))
+
+
+def test_deadline_gives_up(clock, longest_backoff):
+    policy = RetryPolicy(max_attempts=10, base_delay=1.0, max_delay=8.0, deadline=10)
+    first_failed = clock.now
+    clock.now += 8
+    assert policy.retry_at('timeout', 2, first_failed) == first_failed + 10
+    clock.now += 0.5
+    assert policy.retry_at('timeout', 2, first_failed) is None
+
+
+def test_scheduler_returns_due_queries_in_order(clock):
+    scheduler = RetryScheduler()
+    assert scheduler.seconds_until_due() is None
+    scheduler.defer(clock.now + 2, 7, 1)
+    scheduler.defer(clock.now + 1, 3, 2)
+    scheduler.defer(clock.now + 5, 1, 1)
+    assert len(scheduler) == 3
+    assert scheduler.seconds_until_due() == 1
+    assert scheduler.pop_due() == []
+    clock.now += 2
+    assert scheduler.pop_due() == [(3, 2), (7, 1)]
+    assert scheduler.seconds_until_due() == 3
+    clock.now += 10
+    assert scheduler.seconds_until_due() == 0
+    assert scheduler.pop_due() == [(1, 1)]
+    assert len(scheduler) == 0
@@ -0,0 +1,110 @@
+import os
+
+import pytest
+
+from scripts.dns_resolver import DNSResolver
+from scripts.run_journal import RunJournal
+
+
+@pytest.fixture
+def tranco_file(tmp_path):
+    path = tmp_path / 'top-1m.csv'
+    path.write_text('1,a.com\n2,b.com\n')
+    return str(path)
+
+
+def journal_of(tranco_file, tmp_path, **options):
+    return RunJournal(tranco_file, 2, directory=str(tmp_path / 'journal'), **options)
+
+
+def test_scoped_run_only_starts_its_stages_over(tranco_file, tmp_path):
+    journal = journal_of(tranco_file, tmp_path)
+    journal.record('domains_nameservers', 'a.com', ['ns1.a.com.'])
+    journal.record('nameserver_ips', 'ns1.a.com.', ['192.0.2.1'])
+    journal.complete('domains_nameservers')
+    journal.complete('nameserver_ips')
+    journal.close()
+
+    journal = journal_of(tranco_file, tmp_path, stages=['nameserver_ips'])
+    assert journal.is_complete('domains_nameservers')
+    assert not journal.is_complete('nameserver_ips')
+    assert journal.load('domains_nameservers') == {'a.com': ['ns1.a.com.']}
+    assert journal.load('nameserver_ips') == {}
+    journal.close()
+
+
+def test_scoped_run_of_other_settings_starts_everything_over(tranco_file, tmp_path):
+    journal = journal_of(tranco_file, tmp_path)
+    journal.record('domains_nameservers', 'a.com', ['ns1.a.com.'])
+    journal.complete('domains_nameservers')
+    journal.close()
+
+    journal = RunJournal(tranco_file, 1, directory=str(tmp_path / 'journal'), stages=['nameserver_ips'])
+    assert not journal.is_complete('domains_nameservers')
+    assert not os.path.exists(tmp_path / 'journal' / 'domains_nameservers.jsonl')
+    journal.close()
+
+
+def test_resume_keeps_results_and_stage_progress(tranco_file, tmp_path):
+    journal = journal_of(tranco_file, tmp_path)
+    journal.record('domains_nameservers', 'a.com', ['ns1.a.com.'])
+    journal.record('domains_nameservers', 'b.com', None)
+    journal.complete('domains_nameservers')
+    journal.record('nameserver_ips', 'ns1.a.com.', ['192.0.2.1'])
+    journal.close()
+
+    journal = journal_of(tranco_file, tmp_path, resume=True)
+    assert journal.is_complete('domains_nameservers')
+    assert not journal.is_complete('nameserver_ips')
+    # failed resolutions are not journaled, so a resume retries them
+    assert journal.load('domains_nameservers') == {'a.com': ['ns1.a.com.']}
+    assert journal.load('nameserver_ips') == {'ns1.a.com.': ['192.0.2.1']}
+    journal.close()
+
+
+def test_run_without_resume_starts_over(tranco_file, tmp_path):
+    journal = journal_of(tranco_file, tmp_path)
+    journal.record('domains_nameservers', 'a.com', ['ns1.a.com.'])
+    journal.complete('domains_nameservers')
+    journal.close()
+    journal = journal_of(tranco_file, tmp_path)
+    assert not journal.is_complete('domains_nameservers')
+    assert journal.load('domains_nameservers') == {}
+    journal.close()
+
+
+def test_resume_refuses_another_rank_range(tranco_file, tmp_path):
+    journal_of(tranco_file, tmp_path).close()
+    with pytest.raises(Exception, match='Cannot resume'):
+        RunJournal(tranco_file, 2, resume=True, first_rank=5, directory=str(tmp_path / 'journal'))
+
+
+def test_partial_last_line_is_ignored(tranco_file, tmp_path):
+    journal = journal_of(tranco_file, tmp_path)
+    journal.record('domains_nameservers', 'a.com', ['ns1.a.com.'])
+    journal.close()
+    with open(tmp_path / 'journal' / 'domains_nameservers.jsonl', 'a') as journal_file:
+        journal_file.write('["b.com", ["ns1.b')
+    journal = journal_of(tranco_file, tmp_path, resume=True)
+    assert journal.load('domains_nameservers') == {'a.com': ['ns1.a.com.']}
+    journal.close()
+
+
+def test_resumed_stage_skips_journaled_keys(tranco_file, tmp_path):
+    journal = journal_of(tranco_file, tmp_path)
+    journal.record('domains_nameservers', 'a.com', ['ns1.a.com.'])
+    journal.close()
+
+    journal = journal_of(tranco_file, tmp_path, resume=True)
+    resolver = DNSResolver('NS', journal=journal)
+    sent = []
+
+    def query(name):
+        sent.append(name)
+        return [f'ns1.{name}.']
+    resolver._query = query
+    keys = ['a.com', 'b.com']
+    assert resolver.resolve_journaled('domains_nameservers', keys, keys) == [['ns1.a.com.'], ['ns1.b.com.']]
+    assert sent == ['b.com']
+    assert journal.load('domains_nameservers') == {'a.com': ['ns1.a.com.'], 'b.com': ['ns1.b.com.']}
+    journal.close()
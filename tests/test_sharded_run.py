@@ -0,0 +1,68 @@
+import json
+import os
+
+from scripts.sharded_run import ShardedRun, shard_of
+from scripts.tranco_list import TrancoList
+
+DOMAINS = ['a.com', 'b.com', 'c.com', 'd.com']
+
+
+def write_outputs(directory, outputs):
+    os.makedirs(directory, exist_ok=True)
+    for stem, output in outputs.items():
+        with open(os.path.join(directory, f'{stem}.json'), 'w') as jsonfile:
+            json.dump(output, jsonfile)
+
+
+def test_shards_partition_the_list(tmp_path):
+    tranco_path = tmp_path / 'top-1m.csv'
+    tranco_path.write_text(''.join(f'{rank},{domain}\n' for rank, domain in enumerate(DOMAINS, 1)))
+    sharded_run = ShardedRun(2, TrancoList(str(tranco_path)), str(tmp_path / 'shards'))
+    shard_domains = []
+    for shard in range(2):
+        directory = sharded_run.prepare_shard(shard)
+        shard_domains.append(list(TrancoList(os.path.join(directory, 'outputs', 'top-1m.csv')).domains()))
+        assert all(shard_of(domain, 2) == shard for domain in shard_domains[-1])
+    assert sorted(shard_domains[0] + shard_domains[1]) == DOMAINS
+
+
+def test_merge_keeps_rank_order_and_glue(tmp_path, monkeypatch):
+    tranco_path = tmp_path / 'top-1m.csv'
+    tranco_path.write_text(''.join(f'{rank},{domain}\n' for rank, domain in enumerate(DOMAINS, 1)))
+    sharded_run = ShardedRun(2, TrancoList(str(tranco_path)), str(tmp_path / 'shards'))
+    shard_outputs = [
+        {
+            'domains_nameservers': {'c.com': ['ns2.'], 'a.com': ['ns1.']},
+            'nameserver_glue': {'ns1.': ['192.0.2.1']},
+            'nameserver_ips': {'ns1.': ['192.0.2.1', '2001:db8::1'], 'ns2.': ['192.0.2.2']},
+            'ip_to_asn_mapping': {'192.0.2.1': ['64500'], '2001:db8::1': ['64500'], '192.0.2.2': ['64501']},
+            'asn_to_org_mapping': {'64500': 'ORG-A', '64501': 'ORG-B'}
+        },
+        {
+            'domains_nameservers': {'b.com': ['ns2.']},
+            'nameserver_glue': {'ns2.': ['192.0.2.2'], 'ns1.': ['198.51.100.1']},
+            'nameserver_ips': {'ns2.': ['192.0.2.2']},
+            'ip_to_asn_mapping': {'192.0.2.2': ['64501']},
+            'asn_to_org_mapping': {'64501': 'ORG-B'}
+        }
+    ]
+    shard_failures = [{'domains_nameservers': {'d.com': 'NXDOMAIN'}}, {}]
+    for shard, outputs in enumerate(shard_outputs):
+        directory = os.path.join(sharded_run.shard_directory(shard), 'outputs')
+        write_outputs(directory, outputs)
+        write_outputs(directory, {
+            f'{stem}_failures': shard_failures[shard].get(stem, {}) for stem in outputs if stem != 'nameserver_glue'
+        })
+    (tmp_path / 'outputs').mkdir()
+    monkeypatch.chdir(tmp_path)
+
+    assert sharded_run.merge() == {
+        'domains_nameservers': 1, 'nameserver_ips': 0, 'ip_to_asn_mapping': 0, 'asn_to_org_mapping': 0
+    }
+    with open('outputs/domains_nameservers.json') as jsonfile:
+        assert list(json.load(jsonfile)) == ['a.com', 'b.com', 'c.com']
+    with open('outputs/nameserver_glue.json') as jsonfile:
+        # the lowest shard wins, in the order Step 2 reaches the nameservers
+        assert json.load(jsonfile) == {'ns1.': ['192.0.2.1'], 'ns2.': ['192.0.2.2']}
+    with open('outputs/domains_nameservers_failures.json') as jsonfile:
+        assert json.load(jsonfile) == {'d.com': 'NXDOMAIN'}
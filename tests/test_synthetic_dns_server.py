@@ -0,0 +1,23 @@
+import os
+
+from scripts.synthetic_dns_server import SyntheticZone
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_synthetic_nameservers_answer_both_record_types():
+    zone = SyntheticZone(os.path.join(PROJECT_ROOT, 'outputs'))
+    ipv4 = zone.answer('ns1.synthetic-example.net', 'A')
+    assert len(ipv4) == 1 and ipv4[0].startswith('10.')
+    assert zone.answer('ns1.synthetic-example.net', 'A') == ipv4
+    assert zone.answer('missing.synthetic-example.net', 'TXT') is None
+
+
+def test_glue_is_independent_of_ipv6():
+    zone = SyntheticZone(os.path.join(PROJECT_ROOT, 'outputs'))
+    nameservers = [f'ns{index}.synthetic-example.net' for index in range(400)]
+    ipv6_nameservers = [nameserver for nameserver in nameservers if zone.answer(nameserver, 'AAAA')]
+    glued = [nameserver for nameserver in ipv6_nameservers if zone.has_glue(nameserver)]
+    # a quarter of the nameservers have IPv6, and about half of those have glue, so AAAA lookups get answers
+    assert 50 < len(ipv6_nameservers) < 150
+    assert 0 < len(glued) < len(ipv6_nameservers)